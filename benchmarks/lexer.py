@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Pathological-input benchmark of the line classifier.
+
+Times uml_sequence.lexer against the regular expressions it replaced, on
+long and adversarial lines of growing length, and checks that both give
+the same groups. Run from the top of the source tree:
+
+    python benchmarks/lexer.py [MAX_LENGTH]
+
+For each case, the lexer time should roughly double with the length
+(linear). The regular expressions are quadratic on long identifiers,
+brace runs and long message texts, where they backtrack.
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from uml_sequence import lexer
+
+EXPRE1 = re.compile(
+    "([A-Za-z_0-9]+?)([\+\-\#~!]?)"
+    " *"
+    "(\??-+>"
+    "|<-+\??"
+    "|\??=+>\??"
+    "|\??<=+\??"
+    "|\??#+>"
+    "|<#+\??"
+    "|\??:+>"
+    "|<:+\??"
+    "|//"
+    "|:"
+    "|>"
+    "|\*"
+    "|\["
+    "|\]"
+    "|\{_?\}"
+    ")"
+    " *"
+    "([#A-Za-z_0-9]*)([\+\-\#~!]?)"
+    " *"
+    "(.*)")
+
+EXPRE2 = re.compile("([A-Za-z_0-9]+[\+\-\#~!]|:)+")
+
+EXPRE3 = re.compile("([A-Za-z_0-9]*)([\+\-\#~!]?) *(_?)\{(.*)\}")
+
+# name -> line generator, given a length
+CASES = [
+    ("long identifier", lambda n: "a" * n),
+    ("identifiers and spaces", lambda n: "ab " * (n / 3)),
+    ("dangling dashes", lambda n: "a" + "-" * n),
+    ("open braces", lambda n: "{" * n),
+    ("spaced braces", lambda n: "a {" * (n / 3)),
+    ("modifiers", lambda n: "a+ " * (n / 3) + "?"),
+    ("long message", lambda n: "A -> B " + "x" * n),
+    ]
+
+
+def regex_classify(line):
+    t = EXPRE3.findall(line)
+    if t:
+        return t[0]
+    t = EXPRE1.findall(line)
+    if t:
+        return t[0]
+    return EXPRE2.findall(line) == line.split()
+
+
+def lexer_classify(line):
+    t = lexer.match_constraint(line)
+    if t:
+        return t
+    t = lexer.match_arrow(line)
+    if t:
+        return t
+    return lexer.match_modifiers(line) is not None
+
+
+def timeit(fn, line, budget=.2):
+    runs = 0
+    start = time.time()
+    while True:
+        fn(line)
+        runs += 1
+        elapsed = time.time() - start
+        if elapsed > budget:
+            return elapsed / runs
+
+
+def main():
+    max_length = len(sys.argv) > 1 and int(sys.argv[1]) or 8000
+    lengths = []
+    n = 500
+    while n <= max_length:
+        lengths.append(n)
+        n *= 2
+
+    print "%-24s %8s %12s %12s" % ("case", "length", "regex (ms)",
+                                   "lexer (ms)")
+    for name, make in CASES:
+        for n in lengths:
+            line = make(n)
+            assert regex_classify(line) == lexer_classify(line), name
+            print "%-24s %8d %12.3f %12.3f" % (
+                name, len(line),
+                timeit(regex_classify, line) * 1000,
+                timeit(lexer_classify, line) * 1000)
+
+
+if __name__ == "__main__":
+    main()
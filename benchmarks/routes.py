@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Latency of the routes to each output format.
+
+Renders a diagram to each format pic2plot can write itself, once through
+ImageMagick (--route convert) and once letting pic2plot write it (--route
+direct), and reports the time saved. Needs pic2plot and convert. Run from
+the top of the source tree:
+
+    python benchmarks/routes.py [DIAGRAM [RUNS]]
+"""
+
+import os
+import StringIO
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import uml_sequence
+
+FORMATS = ("svg", "png", "gif", "pnm")
+
+
+def render(raw, fmt, route):
+    out = StringIO.StringIO()
+    ret = uml_sequence.Parser(raw).format(False, 100, out, fmt, "white",
+                                          route=route)
+    if ret:
+        raise RuntimeError("rendering %s via %s failed" % (fmt, route))
+    return len(out.getvalue())
+
+
+def timeit(raw, fmt, route, runs):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        size = render(raw, fmt, route)
+        elapsed = time.time() - start
+        best = min(best or elapsed, elapsed)
+    return best, size
+
+
+def main():
+    here = os.path.dirname(__file__)
+    name = len(sys.argv) > 1 and sys.argv[1] \
+        or os.path.join(here, "..", "example.umlgraph")
+    runs = len(sys.argv) > 2 and int(sys.argv[2]) or 5
+    raw = open(name).read()
+
+    print "%-6s %14s %14s %10s %12s %12s" % (
+        "format", "convert (ms)", "direct (ms)", "saved", "convert (B)",
+        "direct (B)")
+    for fmt in FORMATS:
+        slow, slow_size = timeit(raw, fmt, "convert", runs)
+        fast, fast_size = timeit(raw, fmt, "direct", runs)
+        print "%-6s %14.1f %14.1f %9.0f%% %12d %12d" % (
+            fmt, slow * 1000, fast * 1000, 100 * (1 - fast / slow),
+            slow_size, fast_size)
+
+
+if __name__ == "__main__":
+    main()
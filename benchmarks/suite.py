@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of umlsequence.
+
+Times, for example.umlgraph and synthetic diagrams of growing size:
+ - translate: the translation into PIC alone;
+ - live:      the incremental translation after a one-line edit in the
+              middle of the diagram;
+ - pic2plot:  the translation, fed to pic2plot writing PostScript;
+ - run:       the whole run() pipeline, per output format.
+The stages needing pic2plot (and convert) are skipped if it is not
+installed. Run from the top of the source tree:
+
+    python benchmarks/suite.py [-o results.json] [--compare old.json]
+
+The results are written as JSON, and compared with those of a previous
+run, e.g. of another version; the exit code is 1 if some case got slower
+than the threshold.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import StringIO
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+sys.path.insert(0, here)
+
+import uml_sequence
+from uml_sequence.cache import find_tool, tool_fingerprint
+from uml_sequence.live import LiveTranslation
+from synthetic import generate
+
+# name -> generate() arguments
+SYNTHETIC = [
+    ("small", dict(participants=4, messages=20, depth=2)),
+    ("medium", dict(participants=8, messages=200, depth=3, frames=10,
+                    comments=10)),
+    ("large", dict(participants=12, messages=2000, depth=4, frames=50,
+                   comments=50)),
+    ("deep", dict(participants=6, messages=500, depth=20)),
+    ("wide", dict(participants=60, messages=500, depth=1)),
+    ]
+
+FORMATS = ("ps", "svg", "png", "jpg")
+
+
+def cases():
+    yield "example", open(os.path.join(here, "..", "example.umlgraph")).read()
+    for name, params in SYNTHETIC:
+        yield name, generate(**params)
+
+
+def measure(fn, runs):
+    """
+    Call fn() 'runs' times; return the sorted times, and fn's last result.
+    """
+    times = []
+    for i in range(runs):
+        start = time.time()
+        result = fn()
+        times.append(time.time() - start)
+    return sorted(times), result
+
+
+def translate(raw):
+    return len(uml_sequence.Parser(raw).translate())
+
+
+def live(raw):
+    """
+    Return a function translating 'raw' incrementally after editing the
+    line in its middle, the edit being undone by the next call.
+    """
+    lines = raw.split("\n")
+    middle = len(lines) / 2
+    edited = "\n".join(lines[:middle] + [lines[middle] + " edited"]
+                       + lines[middle + 1:])
+    translation = LiveTranslation(raw)
+    texts = itertools.cycle((edited, raw))
+    return lambda: len(translation.update(next(texts)))
+
+
+def pic2plot(raw):
+    stdout, stderr = uml_sequence.execute(
+        uml_sequence.PIC2PLOT_CMD,
+        "".join(uml_sequence.pic_document(uml_sequence.Parser(raw).pic())),
+        "latin1", None)
+    if stderr:
+        raise RuntimeError(stderr)
+    return len(stdout)
+
+
+def run(raw, fmt):
+    out = StringIO.StringIO()
+    if uml_sequence.run(StringIO.StringIO(raw), out, 100, False, fmt,
+                        "white"):
+        raise RuntimeError("rendering %s failed" % fmt)
+    return len(out.getvalue())
+
+
+def benchmark(runs, formats, only=None):
+    have_pic2plot = find_tool("pic2plot") is not None
+    have_convert = find_tool("convert") is not None
+    results = []
+    for case, raw in cases():
+        if only and case not in only:
+            continue
+        stages = [("translate", None, lambda: translate(raw)),
+                  ("live", None, live(raw))]
+        if have_pic2plot:
+            stages.append(("pic2plot", "ps", lambda: pic2plot(raw)))
+            for fmt in formats:
+                if len(uml_sequence.plan(fmt, 100, "white")) == 1 \
+                        or have_convert:
+                    stages.append(("run", fmt,
+                                   lambda fmt=fmt: run(raw, fmt)))
+
+        for stage, fmt, fn in stages:
+            times, size = measure(fn, runs)
+            result = dict(case=case, stage=stage, format=fmt,
+                          input_bytes=len(raw), output_bytes=size,
+                          runs=runs, min=times[0],
+                          median=times[len(times) / 2])
+            results.append(result)
+            print >>sys.stderr, "%-8s %-10s %-4s %10.2f ms %10.2f ms" % (
+                case, stage, fmt or "", result["min"] * 1000,
+                result["median"] * 1000)
+    return results
+
+
+def key(result):
+    return result["case"], result["stage"], result["format"]
+
+
+def compare(old, new, threshold):
+    """
+    Print the change of the median time of each case; return the number
+    of cases slower by more than 'threshold' percent.
+    """
+    before = dict([(key(r), r) for r in old["results"]])
+    slower = 0
+    print "%-8s %-10s %-4s %12s %12s %8s" % (
+        "case", "stage", "fmt", "old (ms)", "new (ms)", "change")
+    for r in new["results"]:
+        o = before.get(key(r))
+        if o is None:
+            continue
+        change = 100. * (r["median"] / o["median"] - 1)
+        flag = ""
+        if change > threshold:
+            slower += 1
+            flag = " SLOWER"
+        print "%-8s %-10s %-4s %12.2f %12.2f %7.1f%%%s" % (
+            r["case"], r["stage"], r["format"] or "", o["median"] * 1000,
+            r["median"] * 1000, change, flag)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark umlsequence on fixed and synthetic diagrams.")
+    parser.add_argument("--output", "-o",
+                        help="file to write the results to, as JSON")
+    parser.add_argument("--compare",
+                        help="results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="slowdown, in percent, reported as a "
+                        "regression; default is 10")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="runs per case; default is 5")
+    parser.add_argument("--format", action="append",
+                        help="output format of the run stage (repeatable); "
+                        "default is %s" % ", ".join(FORMATS))
+    parser.add_argument("--case", action="append",
+                        help="case to run (repeatable); default is all")
+    args = parser.parse_args()
+
+    data = dict(
+        version=uml_sequence.VERSION,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        tools=dict(pic2plot=tool_fingerprint("pic2plot"),
+                   convert=tool_fingerprint("convert")),
+        results=benchmark(args.runs, args.format or FORMATS, args.case),
+        )
+
+    if args.output:
+        f = open(args.output, "w")
+        try:
+            json.dump(data, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    if args.compare:
+        old = json.load(open(args.compare))
+        if compare(old, data, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic diagrams in the alternate syntax.
+
+A diagram has 'participants' objects, and 'messages' calls between them,
+each call activating its target; calls nest up to 'depth' levels of
+activation. 'frames' of the calls are boxed with [ and ], and 'comments'
+of them carry a // comment. The same parameters and seed always give the
+same diagram.
+
+    python benchmarks/synthetic.py [--participants N] [--messages N]
+        [--depth N] [--frames N] [--comments N] [--seed N] > diagram.umlgraph
+"""
+
+import argparse
+import random
+
+
+def generate(participants=5, messages=20, depth=2, frames=0, comments=0,
+             seed=0):
+    """
+    Return the text of a synthetic diagram.
+    """
+    rnd = random.Random(seed)
+    names = ["P%d" % i for i in range(max(participants, 2))]
+    lines = ["U * User"] + ["%s : %s:Class%d" % (name, name.lower(), i)
+                            for i, name in enumerate(names[1:], 1)]
+    lines.append(":")
+
+    # the calls marked for a frame or a comment, spread over the diagram
+    framed = set(rnd.sample(range(messages), min(frames, messages)))
+    commented = set(rnd.sample(range(messages), min(comments, messages)))
+    count = [0]
+    names[0] = "U"
+
+    def call(caller, level):
+        k = count[0]
+        count[0] += 1
+        callee = rnd.choice([n for n in names if n != caller])
+        if k in framed:
+            lines.append("F%d [ %s frame %d" % (k, caller, k))
+        lines.append("%s -> %s+ call%d(arg)" % (caller, callee, k))
+        if k in commented:
+            lines.append("%s // comment %d \\n on two lines" % (callee, k))
+
+        # nested calls, while there are messages left
+        if level < depth:
+            for i in range(rnd.randint(0, 2)):
+                if count[0] >= messages:
+                    break
+                call(callee, level + 1)
+
+        lines.append("%s ==> %s result%d" % (callee, caller, k))
+        lines.append("%s-" % callee)
+        if k in framed:
+            lines.append("%s ] F%d" % (callee, k))
+
+    while count[0] < messages:
+        call("U", 1)
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic diagram on stdout.")
+    parser.add_argument("--participants", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=0)
+    parser.add_argument("--comments", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print generate(args.participants, args.messages, args.depth,
+                   args.frames, args.comments, args.seed),
+
+
+if __name__ == "__main__":
+    main()
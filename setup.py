@@ -22,7 +22,7 @@ def setVersion(v):
 def make_linux(info):
     info.update({
             'name': "umlsequence",
-            'scripts': ['umlsequence'],
+            'scripts': ['umlsequence', 'umlsequence-client'],
             'packages': ['uml_sequence'],
             })
     setup(**info)
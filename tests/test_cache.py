@@ -0,0 +1,165 @@
+"""
+Tests of the render cache and of the render keys.
+"""
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+import uml_sequence
+from uml_sequence import svg
+from uml_sequence.cache import LOCK_NAME, RenderCache, make_key
+
+SOURCE = "A : Alice\nB : Bob\nA -> B hello\n"
+
+
+class KeyTest(unittest.TestCase):
+
+    def test_parts(self):
+        self.assertEqual(make_key("a", 1, None), make_key("a", "1", ""))
+        self.assertEqual(make_key(u"\xe9"), make_key("\xc3\xa9"))
+        self.assertNotEqual(make_key("ab", "c"), make_key("a", "bc"))
+        self.assertNotEqual(make_key("a"), make_key("a", ""))
+
+    def test_render_key(self):
+        key = uml_sequence.render_key(SOURCE, 100, "png", None)
+        self.assertEqual(key, uml_sequence.render_key(SOURCE, 100, "png",
+                                                      None))
+        for other in [(SOURCE.replace("hello", "bye"), 100, "png", None),
+                      (SOURCE, 50, "png", None),
+                      (SOURCE, 100, "svg", None),
+                      (SOURCE, 100, "png", "white"),
+                      (SOURCE, 100, "png", None, "pic2plot", "direct"),
+                      (SOURCE, 100, "png", None, "native")]:
+            self.assertNotEqual(key, uml_sequence.render_key(*other))
+
+    def test_render_key_translation(self):
+        # the source is keyed through the PIC it translates to
+        self.assertEqual(
+            uml_sequence.render_key(SOURCE, 100, "png", None),
+            uml_sequence.render_key(SOURCE.replace(" -> ", "  ->  "), 100,
+                                    "png", None))
+
+    def test_native_key(self):
+        # keyed on the operations drawn, and the revision of the drawing
+        key = uml_sequence.render_key(SOURCE, 100, "svg", None, "native")
+        self.assertEqual(key, uml_sequence.render_key(
+                SOURCE.replace(" -> ", "  ->  "), 100, "svg", None, "native"))
+        self.assertNotEqual(key, uml_sequence.render_key(
+                SOURCE.replace("hello", "bye"), 100, "svg", None, "native"))
+        revision = svg.REVISION
+        try:
+            svg.REVISION += 1
+            self.assertNotEqual(key, uml_sequence.render_key(
+                    SOURCE, 100, "svg", None, "native"))
+        finally:
+            svg.REVISION = revision
+
+    def test_translated(self):
+        for backend in ("pic2plot", "native"):
+            translated = uml_sequence.translate_diagram(SOURCE, backend)
+            self.assertEqual(
+                uml_sequence.render_key(SOURCE, 100, "svg", None, backend),
+                uml_sequence.render_key(SOURCE, 100, "svg", None, backend,
+                                        translated=translated))
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def total(self):
+        f = open(os.path.join(self.path, LOCK_NAME))
+        try:
+            return int(f.read())
+        finally:
+            f.close()
+
+    def age(self, cache, key, seconds):
+        t = time.time() - seconds
+        os.utime(cache._entry_path(key), (t, t))
+
+    def test_put_get(self):
+        cache = RenderCache(self.path)
+        key = make_key("a")
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, "data")
+        self.assertEqual(cache.get(key), "data")
+        self.assertEqual(RenderCache(self.path).get(key), "data")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1,
+                                         "stores": 1, "evictions": 0})
+
+    def test_running_total(self):
+        cache = RenderCache(self.path)
+        cache.put(make_key("a"), "x" * 10)
+        cache.put(make_key("b"), "x" * 20)
+        self.assertEqual(self.total(), 30)
+        # replaced
+        cache.put(make_key("a"), "x" * 5)
+        self.assertEqual(self.total(), 25)
+
+    def test_lost_total(self):
+        cache = RenderCache(self.path)
+        cache.put(make_key("a"), "x" * 10)
+        os.unlink(os.path.join(self.path, LOCK_NAME))
+        cache.put(make_key("b"), "x" * 20)
+        self.assertEqual(self.total(), 30)
+
+    def test_eviction(self):
+        cache = RenderCache(self.path, max_size=25)
+        keys = [make_key(k) for k in "abc"]
+        for k, key in enumerate(keys):
+            cache.put(key, "x" * 10)
+            self.age(cache, key, 100 - k)
+        self.assertEqual(cache.get(keys[0]), None)
+        self.assertEqual(cache.get(keys[2]), "x" * 10)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(self.total(), 20)
+
+    def test_lru(self):
+        cache = RenderCache(self.path, max_size=25)
+        a, b, c = [make_key(k) for k in "abc"]
+        cache.put(a, "x" * 10)
+        cache.put(b, "x" * 10)
+        self.age(cache, a, 100)
+        self.age(cache, b, 50)
+        # used, hence kept
+        cache.get(a)
+        cache.put(c, "x" * 10)
+        self.assertEqual(cache.get(b), None)
+        self.assertEqual(cache.get(a), "x" * 10)
+
+    def test_run(self):
+        cache = RenderCache(self.path)
+        for k in range(2):
+            out = StringIO.StringIO()
+            self.assertEqual(uml_sequence.run(
+                    StringIO.StringIO(SOURCE), out, 100, False, "svg",
+                    cache=cache, backend="native"), 0)
+            self.assertTrue(out.getvalue().startswith("<?xml"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["stores"], 1)
+
+    def test_evict(self):
+        cache = RenderCache(self.path)
+        for k in "abc":
+            cache.put(make_key(k), "x" * 10)
+        cache.max_size = 10
+        cache.evict()
+        self.assertEqual(self.total(), 10)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
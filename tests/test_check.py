@@ -0,0 +1,111 @@
+"""
+Tests of the checker of diagrams.
+"""
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence.check import ERR_CHECK, check, check_file, check_files
+
+HEADER = "A : a\nB : b\n"
+
+
+def problems(body):
+    """
+    The problems of the diagram HEADER + 'body', as (line, severity,
+    message).
+    """
+    return [(d.lnr, d.severity, d.message) for d in check(HEADER + body)]
+
+
+class CheckTest(unittest.TestCase):
+
+    def test_clean(self):
+        self.assertEqual(problems("A -> B hi\nB+\nB <- A back\nB-\n"), [])
+
+    def test_example(self):
+        f = open(os.path.join(here, "..", "example.umlgraph"))
+        try:
+            self.assertEqual(
+                [d for d in check(f) if d.severity == "error"], [])
+        finally:
+            f.close()
+
+    def test_undefined(self):
+        self.assertEqual(problems("A -> C hi\nC -> A back\n"),
+                         [(3, "error", "undefined participant 'C'")])
+
+    def test_destroyed(self):
+        self.assertEqual(
+            problems("A ##> B\nA -> B hi\n"),
+            [(4, "error", "message uses participant 'B', destroyed on "
+              "line 3")])
+
+    def test_created_again(self):
+        self.assertEqual(problems("A ##> B\nA ::> B new\nA -> B hi\n"), [])
+
+    def test_inactive(self):
+        self.assertEqual(
+            problems("A-\n"),
+            [(3, "error", "participant 'A' deactivated while not active")])
+
+    def test_still_active(self):
+        self.assertEqual(
+            problems("A+\nA -> B hi\n"),
+            [(3, "warning", "participant 'A' is still active at the end")])
+
+    def test_frames(self):
+        self.assertEqual(
+            problems("F [ A frame\nA -> B hi\nB ] G\n"),
+            [(3, "error", "frame 'F' is never closed"),
+             (5, "error", "end of frame 'G' without a begin")])
+        self.assertEqual(problems("F [ A frame\nA -> B hi\nB ] F\n"), [])
+
+
+class CheckFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, text):
+        path = os.path.join(self.path, name)
+        f = open(path, "w")
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        return path
+
+    def test_check_file(self):
+        path = self.write("bad.umlgraph", HEADER + "A -> C hi\nA+\n")
+        self.assertEqual(check_file(path), (path, ERR_CHECK, [
+            "%s:3: error: undefined participant 'C'" % path,
+            "%s:4: warning: participant 'A' is still active at the end"
+            % path]))
+        # warnings only
+        path = self.write("warn.umlgraph", HEADER + "A+\n")
+        self.assertEqual(check_file(path)[1], 0)
+
+    def test_check_files(self):
+        paths = [self.write("%d.umlgraph" % k, HEADER + "A -> B hi\n")
+                 for k in range(3)]
+        paths.append(self.write("bad.umlgraph", HEADER + "A -> C hi\n"))
+        report = StringIO.StringIO()
+        self.assertEqual(check_files(paths, 2, report), ERR_CHECK)
+        self.assertEqual(report.getvalue().split("\n"), [
+            "%s:3: error: undefined participant 'C'" % paths[-1],
+            "Umlsequence: 1 of 4 diagrams have errors", ""])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Tests of the rendering of the diagrams embedded in documentation.
+"""
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence import docs
+from uml_sequence.docs import Block, markdown_blocks, rst_blocks
+
+DIAGRAM = "A : a\nB : b\nA -> B hi\n"
+
+MARKDOWN = """# Title
+
+```umlsequence
+A : a
+B : b
+A -> B hi
+```
+
+Text
+
+```python
+print "not a diagram"
+```
+"""
+
+RST = """Title
+=====
+
+.. umlsequence::
+
+   A : a
+   B : b
+   A -> B hi
+
+Text
+"""
+
+
+class MarkdownBlocksTest(unittest.TestCase):
+
+    def test_fenced(self):
+        lines = MARKDOWN.split("\n")
+        self.assertEqual(markdown_blocks(lines),
+                         [Block(3, 8, DIAGRAM, "")])
+
+    def test_fences(self):
+        # tildes, longer fences, closed by at least as many characters
+        lines = ["~~~~ umlsequence", "A : a", "```", "~~~", "~~~~~"]
+        self.assertEqual(markdown_blocks(lines),
+                         [Block(1, 6, "A : a\n```\n~~~\n", "")])
+
+    def test_indented(self):
+        lines = ["- item", "", "  ```umlsequence", "  A : a", "  ```"]
+        self.assertEqual(markdown_blocks(lines),
+                         [Block(3, 6, "A : a\n", "  ")])
+
+    def test_unclosed(self):
+        self.assertEqual(markdown_blocks(["```umlsequence", "A : a"]), [])
+
+
+class RstBlocksTest(unittest.TestCase):
+
+    def test_directive(self):
+        lines = RST.split("\n")
+        self.assertEqual(rst_blocks(lines), [Block(4, 9, DIAGRAM, "")])
+
+    def test_code_block(self):
+        lines = ["* item", "", "  .. code-block:: umlsequence",
+                 "     :caption: a diagram", "", "     A : a", "",
+                 "     A+", "", "  Text"]
+        self.assertEqual(rst_blocks(lines),
+                         [Block(3, 9, "A : a\n\nA+\n", "  ")])
+
+    def test_other(self):
+        lines = [".. code-block:: python", "", "   print 1", ""]
+        self.assertEqual(rst_blocks(lines), [])
+
+
+class RenderDocsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path)
+
+    def write(self, name, text):
+        f = open(name, "w")
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+    def read(self, name):
+        f = open(name)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def render(self, write=True):
+        out = StringIO.StringIO()
+        report = StringIO.StringIO()
+        ret = docs.render_docs(["."], 1, 100, "svg", backend="native",
+                               write=write, out=out, report=report)
+        self.assertEqual((ret, report.getvalue()), (0, ""))
+        return out.getvalue()
+
+    def image(self):
+        images = os.listdir(docs.OUTPUT_DIR)
+        self.assertEqual(len(images), 1)
+        return docs.OUTPUT_DIR + "/" + images[0]
+
+    def test_references(self):
+        self.write("a.md", MARKDOWN)
+        self.write("b.rst", RST)
+        self.render()
+        # the same diagram, rendered once
+        image = self.image()
+        self.assertEqual(self.read("a.md"), MARKDOWN.replace(
+                "```\n\nText", "```\n\n![umlsequence](%s)\n\nText" % image))
+        self.assertEqual(self.read("b.rst"), RST.replace(
+                "hi\n\nText", "hi\n\n.. image:: %s\n\nText" % image))
+
+    def test_idempotent(self):
+        self.write("a.md", MARKDOWN)
+        self.write("b.rst", RST)
+        self.render()
+        texts = self.read("a.md"), self.read("b.rst")
+        self.render()
+        self.assertEqual((self.read("a.md"), self.read("b.rst")), texts)
+
+    def test_changed(self):
+        # the reference is updated, not added again
+        self.write("a.md", MARKDOWN)
+        self.render()
+        self.write("a.md", self.read("a.md").replace("hi", "bye"))
+        self.render()
+        text = self.read("a.md")
+        self.assertEqual(text.count("![umlsequence]"), 1)
+        image = [i for i in os.listdir(docs.OUTPUT_DIR)
+                 if docs.OUTPUT_DIR + "/" + i in text]
+        self.assertEqual(len(image), 1)
+        self.assertTrue("bye" in self.read(docs.OUTPUT_DIR + "/" + image[0]))
+
+    def test_block_at_end(self):
+        self.write("c.md", "```umlsequence\n" + DIAGRAM + "```")
+        self.render()
+        self.assertEqual(self.read("c.md"), "```umlsequence\n%s```\n\n"
+                         "![umlsequence](%s)" % (DIAGRAM, self.image()))
+
+    def test_print(self):
+        self.write("a.md", MARKDOWN)
+        out = self.render(write=False)
+        self.assertEqual(out, "./a.md:3: ./%s\n" % self.image())
+        self.assertEqual(self.read("a.md"), MARKDOWN)
+
+
+if __name__ == "__main__":
+    unittest.main()
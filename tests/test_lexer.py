@@ -0,0 +1,87 @@
+"""
+Tests of the line classifier, against the regular expressions it replaced
+(kept in benchmarks/lexer.py).
+"""
+
+import imp
+import os
+import random
+import re
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence import lexer
+
+reference = imp.load_source("lexer_reference",
+                            os.path.join(here, "..", "benchmarks", "lexer.py"))
+
+CALL = re.compile("(.*?) *(=) *(.*)")
+
+# characters of the fuzzed lines, the special ones more likely
+ALPHABET = "ab_1 " * 2 + "+-#~!?<>=:/*[]{}"
+
+SEED = 20121018
+FUZZ_LINES = 20000
+
+
+def first(found):
+    return found and found[0] or None
+
+
+def example_lines():
+    f = open(os.path.join(here, "..", "example.umlgraph"))
+    try:
+        return [l.strip() for l in f.read().split("\n")]
+    finally:
+        f.close()
+
+
+def fuzz_lines():
+    rnd = random.Random(SEED)
+    return ["".join([rnd.choice(ALPHABET)
+                     for i in range(rnd.randint(0, 12))])
+            for k in range(FUZZ_LINES)]
+
+
+class LexerTest(unittest.TestCase):
+
+    def check(self, lines):
+        for line in lines:
+            self.assertEqual(lexer.match_constraint(line),
+                             first(reference.EXPRE3.findall(line)), line)
+            self.assertEqual(lexer.match_arrow(line),
+                             first(reference.EXPRE1.findall(line)), line)
+            self.assertEqual(lexer.match_modifiers(line) is not None,
+                             reference.EXPRE2.findall(line) == line.split(),
+                             line)
+            self.assertEqual(lexer.split_call(line),
+                             first(CALL.findall(line)), line)
+            self.assertEqual(reference.lexer_classify(line),
+                             reference.regex_classify(line), line)
+
+    def test_example(self):
+        self.check(example_lines())
+
+    def test_cases(self):
+        self.check([make(60) for name, make in reference.CASES])
+
+    def test_fuzz(self):
+        self.check(fuzz_lines())
+
+    def test_groups(self):
+        self.assertEqual(lexer.match_arrow("O1+ ==> O2- result = f(x)"),
+                         ("O1", "+", "==>", "O2", "-", "result = f(x)"))
+        self.assertEqual(lexer.match_constraint("O1 _{x > 0}"),
+                         ("O1", "", "_", "x > 0"))
+        self.assertEqual(lexer.match_modifiers("O1+ : O2-"),
+                         ["O1+", ":", "O2-"])
+        self.assertEqual(lexer.match_modifiers("O1+ O2"), None)
+        self.assertEqual(lexer.split_call("r  =  f(a=1)"),
+                         ("r", "=", "f(a=1)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
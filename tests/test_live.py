@@ -0,0 +1,107 @@
+"""
+Tests of the incremental translation: after each edit, the output,
+updated with the changes, is the full translation of the new text.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence import Parser
+from uml_sequence.ir import emit_pic
+from uml_sequence.live import LiveTranslation, common_prefix, common_suffix
+
+SEED = 20121018
+EDITS = 300
+
+# lines inserted by the edits, some joined to the next one
+LINES = [
+    "A -> B hello",
+    "B <- A back",
+    "A+",
+    "A-",
+    "B ##> C",
+    "A ::> C new",
+    ":",
+    "C : c",
+    "A -> B continued \\",
+    "   on the next line",
+    "B //[,right 1] a comment \\",
+    "",
+    "# a comment",
+    "boxwid = 1;",
+    ]
+
+
+def example():
+    f = open(os.path.join(here, "..", "example.umlgraph"))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def translate(text):
+    return list(emit_pic(Parser(text).ir()))
+
+
+class LiveTest(unittest.TestCase):
+
+    def update(self, live, preview, text):
+        for start, stop, lines in reversed(live.update(text)):
+            preview[start:stop] = lines
+        self.assertEqual(live.output, translate(text))
+        self.assertEqual(preview, live.output)
+
+    def test_initial(self):
+        text = example()
+        self.assertEqual(LiveTranslation(text).output, translate(text))
+        self.assertEqual(LiveTranslation().output, translate(""))
+
+    def test_edits(self):
+        rnd = random.Random(SEED)
+        lines = example().split("\n")
+        live = LiveTranslation("\n".join(lines))
+        preview = list(live.output)
+        for k in range(EDITS):
+            i = rnd.randint(0, len(lines))
+            edit = rnd.choice(("insert", "delete", "replace"))
+            if edit == "insert" or not lines:
+                lines.insert(i, rnd.choice(LINES))
+            elif edit == "delete":
+                del lines[min(i, len(lines) - 1)]
+            else:
+                lines[min(i, len(lines) - 1)] = rnd.choice(LINES)
+            self.update(live, preview, "\n".join(lines))
+
+    def test_joined(self):
+        live = LiveTranslation("A : a\nB : b\nA -> B one\nA -> B two\n")
+        preview = list(live.output)
+        # join the line to the next, then split them again
+        self.update(live, preview,
+                    "A : a\nB : b\nA -> B one \\\nA -> B two\n")
+        self.update(live, preview,
+                    "A : a\nB : b\nA -> B one\nA -> B two\n")
+
+    def test_local(self):
+        lines = example().split("\n")
+        live = LiveTranslation("\n".join(lines))
+        translated = live.translated
+        lines[len(lines) / 2] += " edited"
+        self.update(live, list(live.output), "\n".join(lines))
+        self.assertTrue(live.translated - translated < 5)
+
+    def test_common(self):
+        a, b = [1, 2, 3, 4, 5], [1, 2, 0, 4, 5]
+        self.assertEqual(common_prefix(a, b, 5), 2)
+        self.assertEqual(common_suffix(a, b, 5), 2)
+        self.assertEqual(common_prefix(a, a, 3), 3)
+        self.assertEqual(common_suffix(a, [5], 1), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
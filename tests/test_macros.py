@@ -0,0 +1,154 @@
+"""
+Tests of the dependency graph of the prelude macros: a document defines
+exactly the macros it uses and those they call, before their first call.
+
+The comparison of the output with that of the full prelude is skipped if
+pic2plot is not installed.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+import uml_sequence
+from uml_sequence import PRELUDE, UMLGRAPH_PIC, peephole
+from uml_sequence.cache import find_tool
+from uml_sequence.ir import Op, RAW, emit_pic
+from uml_sequence.macros import Prelude, define_used
+
+DEFINE = re.compile(r"^\s*define\s+([A-Za-z_][A-Za-z_0-9]*)", re.M)
+
+DIAGRAMS = [
+    "A : a\nB : b\nA -> B hello\n",
+    "U * User\nS : Server\nU -> S+ request\nU <- S- response\n",
+    "A : a\nB :\nA ::> B new\nA ##> B\n",
+    "A : a\nB : b\nF [ A frame\nA -> B hi\nB ] F\nA _{x > 0}\n",
+    ]
+
+
+def example():
+    f = open(os.path.join(here, "..", "example.umlgraph"))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def defined(ops):
+    """
+    The names of the macros defined by the RAW operations 'ops'.
+    """
+    return [name for op in ops if op.kind == RAW
+            for name in DEFINE.findall(op.args[0])]
+
+
+def pic2plot(text):
+    p = subprocess.Popen(["pic2plot", "-T", "ps"], stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         close_fds=True)
+    out, err = p.communicate(text.encode("latin1"))
+    if p.returncode or err:
+        raise RuntimeError("pic2plot: %s" % err)
+    return [l for l in out.split("\n") if not l.startswith("%%Creat")]
+
+
+class PreludeTest(unittest.TestCase):
+
+    def test_split(self):
+        # every statement of the prelude is in the settings or in a macro
+        self.assertEqual(DEFINE.findall(PRELUDE.settings), [])
+        parts = [PRELUDE.settings] + [PRELUDE.macros[name]
+                                      for name in PRELUDE.order]
+        for line in UMLGRAPH_PIC.split("\n"):
+            if line.strip() and not line.strip().startswith("#"):
+                self.assertTrue([p for p in parts if line in p], line)
+        for name in PRELUDE.order:
+            self.assertEqual(DEFINE.findall(PRELUDE.macros[name]), [name])
+
+    def test_deps(self):
+        self.assertEqual(PRELUDE.deps["destroy_message"],
+                         set(["message", "complete", "drawx"]))
+        self.assertEqual(PRELUDE.deps["complete"], set(["extend_lifeline"]))
+        self.assertEqual(PRELUDE.deps["step"], set())
+
+    def test_closure(self):
+        self.assertEqual(PRELUDE.closure(["dmessage"]),
+                         ["extend_lifeline", "complete", "message", "drawx",
+                          "destroy_message", "dmessage"])
+        self.assertEqual(PRELUDE.closure(["step", "unknown"]), ["step"])
+        self.assertEqual(PRELUDE.closure([]), [])
+
+    def test_small(self):
+        prelude = Prelude("x = 1;\n# a\ndefine a { b(); }\n\n"
+                          "define b {\n c = 2;\n}\ny = 2;")
+        self.assertEqual(prelude.order, ["a", "b"])
+        self.assertEqual(prelude.deps, {"a": set(["b"]), "b": set()})
+        self.assertEqual(prelude.macros["a"], "# a\ndefine a { b(); }")
+        self.assertEqual(prelude.settings, "x = 1;\n\ny = 2;")
+
+
+class DefineUsedTest(unittest.TestCase):
+
+    def check(self, raw):
+        ops = list(peephole.optimize(uml_sequence.Parser(raw).ir()))
+        out = list(define_used(ops, PRELUDE))
+        called = set([op.kind for op in ops if op.kind in PRELUDE.macros])
+        names = defined(out)
+        # exactly the closure, once each
+        self.assertEqual(sorted(names), sorted(PRELUDE.closure(called)))
+        # each before its first call
+        done = set()
+        for op in out:
+            if op.kind == RAW:
+                done.update(defined([op]))
+            elif op.kind in PRELUDE.macros:
+                self.assertTrue(set(PRELUDE.closure([op.kind])) <= done,
+                                op.kind)
+        # the same operations otherwise
+        self.assertEqual([op for op in out if not defined([op])], ops)
+
+    def test_diagrams(self):
+        for raw in DIAGRAMS:
+            self.check(raw)
+
+    def test_example(self):
+        self.check(example())
+
+    def test_pic(self):
+        # the macros called from PIC statements
+        out = list(define_used([Op(RAW, ("message(A,B,\"x\");",), 1)],
+                               PRELUDE))
+        self.assertEqual(defined(out), ["message"])
+
+    def test_user_definitions(self):
+        # a definition, or a block pic may skip, pulls in the whole prelude
+        for code in ("define mine { message($1,$2,\"x\"); }",
+                     "if x > 1 then { step(); }"):
+            ops = [Op("step", (), 1), Op(RAW, (code,), 2),
+                   Op("message", ("A", "B", '"x"'), 3)]
+            out = list(define_used(ops, PRELUDE))
+            self.assertEqual(defined(out[:1]), ["step"])
+            self.assertEqual(sorted(defined(out[:-2])),
+                             sorted(PRELUDE.order))
+            self.assertEqual(out[-2:], ops[-2:])
+
+
+@unittest.skipUnless(find_tool("pic2plot"), "pic2plot is not installed")
+class RenderTest(unittest.TestCase):
+
+    def test_full_prelude(self):
+        for raw in DIAGRAMS + [example()]:
+            parser = uml_sequence.Parser(raw)
+            used = u"".join(uml_sequence.pic_document(parser.pic()))
+            full = u".PS\n%s\n%s\n.PE" % (UMLGRAPH_PIC, "\n".join(
+                    emit_pic(peephole.optimize(parser.ir()))))
+            self.assertEqual(pic2plot(used), pic2plot(full))
+
+
+if __name__ == "__main__":
+    unittest.main()
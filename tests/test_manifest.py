@@ -0,0 +1,145 @@
+"""
+Tests of the build manifest and of the keys stamped into the outputs.
+"""
+
+import os
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence import manifest
+from uml_sequence.manifest import Manifest, png_chunk, read_stamp, stamp
+
+KEY = "0123456789abcdef"
+
+# a 1x1 grey image
+PNG = manifest.PNG_SIGNATURE + \
+    png_chunk("IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)) + \
+    png_chunk("IDAT", zlib.compress("\0\x80")) + png_chunk("IEND", "")
+SVG = '<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg"/>\n'
+PS = "%!PS-Adobe-3.0\n%%Pages: 1\nshowpage\n"
+
+
+class TempDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def name(self, name):
+        return os.path.join(self.path, name)
+
+    def write(self, name, data):
+        f = open(self.name(name), "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return self.name(name)
+
+
+class StampTest(TempDirTest):
+
+    def test_formats(self):
+        for ext, data in (("png", PNG), ("svg", SVG), ("ps", PS)):
+            stamped = stamp(data, KEY)
+            self.assertNotEqual(stamped, data)
+            self.assertEqual(read_stamp(self.write("out." + ext, stamped)),
+                             KEY, ext)
+            self.assertEqual(read_stamp(self.write("out." + ext, data)),
+                             None, ext)
+
+    def test_png_chunks(self):
+        # the text chunk follows IHDR, and the chunks stay well-formed
+        data = stamp(PNG, KEY)
+        pos = 8
+        kinds = []
+        while pos < len(data):
+            length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+            crc, = struct.unpack(">I", data[pos + 8 + length:
+                                            pos + 12 + length])
+            self.assertEqual(crc, zlib.crc32(data[pos + 4:pos + 8 + length])
+                             & 0xffffffff)
+            kinds.append(kind)
+            pos += 12 + length
+        self.assertEqual(kinds, ["IHDR", "tEXt", "IDAT", "IEND"])
+
+    def test_other(self):
+        self.assertEqual(stamp("GIF89a", KEY), "GIF89a")
+        self.assertEqual(read_stamp(self.name("missing.png")), None)
+
+
+class WriteAtomicTest(TempDirTest):
+
+    def test_write(self):
+        name = self.write("doc.md", "old")
+        os.chmod(name, 0600)
+        manifest.write_atomic(name, "new")
+        self.assertEqual(open(name).read(), "new")
+        # the mode of a new file, as open() creates it
+        other = self.write("other.md", "")
+        self.assertEqual(stat.S_IMODE(os.stat(name).st_mode),
+                         stat.S_IMODE(os.stat(other).st_mode))
+        os.unlink(other)
+        self.assertEqual(os.listdir(self.path), ["doc.md"])
+
+    def test_failure(self):
+        # the temporary file is removed
+        self.assertRaises(OSError, manifest.write_atomic,
+                          self.name("missing/doc.md"), "new")
+        self.assertRaises(OSError, manifest.write_atomic, self.path, "new")
+        self.assertEqual(os.listdir(self.path), [])
+
+
+class ManifestTest(TempDirTest):
+
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.source = self.write("a.umlgraph", "A : a\n")
+        self.output = self.write("a.png", stamp(PNG, KEY))
+
+    def test_record(self):
+        m = Manifest(self.name("manifest"))
+        m.record(self.output, self.source, KEY)
+        self.assertTrue(m.up_to_date(self.output, self.source, KEY))
+        self.assertFalse(m.up_to_date(self.output, self.source, "other"))
+        m.save()
+        m = Manifest(self.name("manifest"))
+        self.assertEqual(m.entries, {"a.png": {"source": "a.umlgraph",
+                                               "key": KEY}})
+        os.unlink(self.output)
+        self.assertFalse(m.up_to_date(self.output, self.source, KEY))
+
+    def test_from_stamp(self):
+        # no manifest: rebuilt from the key in the output
+        m = Manifest(self.name("manifest"))
+        self.assertTrue(m.up_to_date(self.output, self.source, KEY))
+        self.assertEqual(m.entries["a.png"]["key"], KEY)
+        self.assertFalse(Manifest(self.name("manifest")).up_to_date(
+            self.output, self.source, "other"))
+
+    def test_damaged(self):
+        m = Manifest(self.write("manifest", "{"))
+        self.assertEqual(m.entries, {})
+
+    def test_prune(self):
+        m = Manifest(self.name("manifest"))
+        m.record(self.output, self.source, KEY)
+        self.assertEqual(m.prune(), [])
+        os.unlink(self.source)
+        self.assertEqual(m.prune(), [self.output])
+        self.assertFalse(os.path.exists(self.output))
+        self.assertEqual(m.entries, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests of the pagination of large diagrams: each page must stand on its
+own, with the activations and frames left open carried over.
+"""
+
+import os
+import re
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+sys.path.insert(0, os.path.join(here, "..", "benchmarks"))
+
+import uml_sequence
+from uml_sequence import svg
+from uml_sequence.ir import COMMENT, RAW, PARTICIPANTS
+from uml_sequence.pages import STEPS, page_names, paginate
+from synthetic import generate
+
+ACTIVE = re.compile(r"^active_([A-Za-z_0-9]+) = (\d+);$")
+
+STEP_SIZES = (1, 2, 3, 5, 8, 1000)
+
+
+def example():
+    f = open(os.path.join(here, "..", "example.umlgraph"))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def messages(ops):
+    return [op for op in ops if op.kind in STEPS[:-1]]
+
+
+class PaginateTest(unittest.TestCase):
+
+    def check(self, raw):
+        parser = uml_sequence.Parser(raw)
+        ops = [op for op in parser.ir() if op.kind != COMMENT]
+        for steps in STEP_SIZES:
+            pages = paginate(ops, steps)
+            self.check_pages(parser, ops, pages, steps)
+
+    def check_pages(self, parser, ops, pages, steps):
+        # each message once, in order
+        self.assertEqual(sum([messages(page) for page in pages], []),
+                         messages(ops))
+        for k, page in enumerate(pages[:-1]):
+            # without the steps starting and ending the page
+            moves = [op for op in page if op.kind in STEPS]
+            self.assertTrue(len(moves) - (k > 0) - 1 >= steps)
+
+        levels = {}
+        columns = []
+        for k, page in enumerate(pages):
+            where = "page %d of %d, %d steps" % (k + 1, len(pages), steps)
+            # translates, and is laid out
+            list(parser.pic(page))
+            svg.render(page)
+
+            # the participants declared so far, in their columns, alive
+            # or as placeholders
+            names = [op.args[0] for op in page if op.kind in PARTICIPANTS]
+            self.assertEqual(names[:len(columns)], columns, where)
+            columns = names
+            for op in messages(page):
+                self.assertTrue(op.args[0] in names and op.args[1] in names,
+                                where)
+
+            # the activations carried over, and balanced on the page
+            carried = dict([(m.group(1), int(m.group(2)))
+                            for m in [ACTIVE.match(op.args[0])
+                                      for op in page if op.kind == RAW]
+                            if m])
+            self.assertEqual(carried, dict([(n, l) for n, l in levels.items()
+                                            if l > 0]), where)
+            for op in page:
+                if op.kind == "active":
+                    levels[op.args[0]] = levels.get(op.args[0], 0) + 1
+                elif op.kind == "inactive":
+                    levels[op.args[0]] = levels.get(op.args[0], 0) - 1
+                    self.assertTrue(levels[op.args[0]] >= 0, where)
+
+            # the frames closed on each page they are open on
+            opened = []
+            for op in page:
+                if op.kind == "begin_frame":
+                    opened.append(op.args[1])
+                elif op.kind == "end_frame":
+                    self.assertEqual(opened.pop(), op.args[1], where)
+            self.assertEqual(opened, [], where)
+
+    def test_example(self):
+        self.check(example())
+
+    def test_synthetic(self):
+        self.check(generate(participants=6, messages=60, depth=3, frames=6,
+                            comments=4))
+
+    def test_placeholders(self):
+        raw = "A : a\nB : b\nC :\nA -> B one\nA ::> C new\n" \
+            "A -> C two\nA ##> C\nA -> B three\n"
+        pages = paginate(uml_sequence.Parser(raw).ir(), 1)
+        heads = [[(op.kind, op.args[0]) for op in page
+                  if op.kind in PARTICIPANTS] for page in pages]
+        # C is a placeholder before its creation and after its destruction
+        self.assertEqual(heads, [[("object", "A"), ("object", "B"),
+                                  ("pobject", "C")]] * 2 +
+                         [[("object", "A"), ("object", "B"),
+                           ("object", "C")]] * 2 +
+                         [[("object", "A"), ("object", "B"),
+                           ("pobject", "C")]])
+
+    def test_single_page(self):
+        ops = [op for op in uml_sequence.Parser(example()).ir()]
+        self.assertEqual(paginate(ops, 1000), [ops])
+
+
+class PageNamesTest(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual(page_names("d.png", 2),
+                         ["d-page1.png", "d-page2.png"])
+        self.assertEqual(page_names("d.pdf", 10)[0], "d-page01.pdf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Tests of the peephole optimizations of the operations.
+"""
+
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence.ir import Op, COMMENT, RAW
+from uml_sequence.peephole import drop_toggles, merge_steps, optimize
+
+
+def op(kind, *args):
+    return Op(kind, args, 1)
+
+
+STEP = op("step")
+SYNC = op("sync")
+ASYNC = op("async")
+MESSAGE = op("message", "A", "B", '"hi"')
+
+
+class MergeStepsTest(unittest.TestCase):
+
+    def test_runs(self):
+        self.assertEqual(
+            list(merge_steps([STEP, STEP, STEP, MESSAGE, STEP, MESSAGE,
+                              STEP, STEP])),
+            [op(RAW, "down; move spacing * 3;"), MESSAGE, STEP, MESSAGE,
+             op(RAW, "down; move spacing * 2;")])
+
+    def test_line(self):
+        ops = [Op("step", (), 4), Op("step", (), 5)]
+        self.assertEqual(list(merge_steps(ops))[0].line, 4)
+
+    def test_no_steps(self):
+        self.assertEqual(list(merge_steps([MESSAGE, SYNC])), [MESSAGE, SYNC])
+
+
+class DropTogglesTest(unittest.TestCase):
+
+    def test_pair(self):
+        self.assertEqual(
+            list(drop_toggles([SYNC, MESSAGE, ASYNC, SYNC, MESSAGE])),
+            [SYNC, MESSAGE, MESSAGE])
+        self.assertEqual(
+            list(drop_toggles([ASYNC, MESSAGE, SYNC, ASYNC, MESSAGE])),
+            [ASYNC, MESSAGE, MESSAGE])
+
+    def test_change(self):
+        ops = [SYNC, MESSAGE, ASYNC, MESSAGE, SYNC]
+        self.assertEqual(list(drop_toggles(ops)), ops)
+
+    def test_unknown(self):
+        # the arrowhead is not known before the first toggle
+        self.assertEqual(list(drop_toggles([ASYNC, SYNC])), [ASYNC, SYNC])
+
+    def test_raw(self):
+        # PIC statements may set the arrowhead
+        ops = [SYNC, ASYNC, op(RAW, "arrowhead = 0;"), SYNC]
+        self.assertEqual(list(drop_toggles(ops)), ops)
+        ops = [SYNC, MESSAGE, op(RAW, "x = 1;"), ASYNC, SYNC]
+        self.assertEqual(list(drop_toggles(ops)), ops)
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def test_optimize(self):
+        ops = [SYNC, op(COMMENT, "# a comment"), STEP, op(COMMENT, "#"),
+               STEP, ASYNC, SYNC, MESSAGE]
+        self.assertEqual(list(optimize(ops)),
+                         [SYNC, op(RAW, "down; move spacing * 2;"), MESSAGE])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Tests of the reaping and signalling of the external programs.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+from uml_sequence import supervisor
+
+
+def start(code):
+    p = subprocess.Popen([sys.executable, "-c", code], close_fds=True)
+    supervisor.track(p)
+    return p
+
+
+def exited(p):
+    # exited, not reaped yet: a zombie
+    for i in range(500):
+        f = open("/proc/%d/stat" % p.pid)
+        try:
+            if f.read().split(")")[-1].split()[0] == "Z":
+                return
+        finally:
+            f.close()
+        time.sleep(.01)
+    raise AssertionError("process %d still running" % p.pid)
+
+
+class ReapKillTest(unittest.TestCase):
+
+    def test_kill(self):
+        p = start("import time; time.sleep(30)")
+        supervisor.kill(p, signal.SIGKILL)
+        status, rusage = supervisor.reap(p)
+        self.assertTrue(os.WIFSIGNALED(status))
+        self.assertEqual(os.WTERMSIG(status), signal.SIGKILL)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/stat"), "needs /proc")
+    def test_exited(self):
+        # an exited process is reaped by kill() rather than signalled,
+        # and reap() gets its status
+        p = start("import sys; sys.exit(3)")
+        exited(p)
+        supervisor.kill(p, signal.SIGKILL)
+        self.assertNotEqual(p.reaped, None)
+        status, rusage = supervisor.reap(p)
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 3)
+
+    def test_reaped(self):
+        # never signalled once reaped
+        p = start("pass")
+        status, rusage = supervisor.reap(p)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        supervisor.kill(p, signal.SIGKILL)
+        supervisor.kill(p, signal.SIGTERM, True)
+        self.assertEqual(supervisor.reap(p), (status, rusage))
+
+
+if __name__ == "__main__":
+    unittest.main()
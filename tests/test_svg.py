@@ -0,0 +1,121 @@
+"""
+Tests of the native SVG backend.
+
+The parity tests compare its output for example.umlgraph with that of
+pic2plot, and are skipped if pic2plot is not installed. Run from the top
+of the source tree:
+
+    python -m unittest discover -s tests
+"""
+
+import HTMLParser
+import os
+import re
+import subprocess
+import sys
+import unittest
+from xml.dom import minidom
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+import uml_sequence
+from uml_sequence import svg
+from uml_sequence.cache import find_tool
+from uml_sequence.ir import Op, RAW
+
+EXAMPLE = os.path.join(here, "..", "example.umlgraph")
+
+TEXT = re.compile(r"<text[^>]*>(.*?)</text>", re.S)
+WORD = re.compile(r"[A-Za-z]{3,}")
+BOUNDING_BOX = re.compile(r"^%%BoundingBox: *(-?\d+) (-?\d+) (-?\d+) (-?\d+)",
+                          re.M)
+
+
+def example():
+    f = open(EXAMPLE)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def words(document):
+    """
+    The words of the text labels of the SVG 'document'.
+    """
+    unescape = HTMLParser.HTMLParser().unescape
+    found = set()
+    for text in TEXT.findall(document):
+        found.update(WORD.findall(unescape(text.decode("utf-8"))))
+    return found
+
+
+def pic2plot(text, fmt):
+    cmd = ["pic2plot", "-T", fmt]
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, close_fds=True)
+    out, err = p.communicate(text.encode("latin1"))
+    if p.returncode or err:
+        raise RuntimeError("%s: %s" % (" ".join(cmd), err))
+    return out
+
+
+class NativeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = uml_sequence.Parser(example())
+        self.ops = self.parser.ir()
+
+    def test_well_formed(self):
+        document = svg.render(self.ops)
+        root = minidom.parseString(document).documentElement
+        self.assertEqual(root.tagName, "svg")
+        width, height = svg.extent(self.ops)
+        self.assertEqual(int(root.getAttribute("width")),
+                         int(round(width * 100)))
+        self.assertEqual(int(root.getAttribute("height")),
+                         int(round(height * 100)))
+
+    def test_labels(self):
+        found = words(svg.render(self.ops))
+        for word in ("Actor", "Instance", "Class", "constraint", "async",
+                     "create", "destroy", "comment", "result"):
+            self.assertIn(word, found)
+
+    def test_percent(self):
+        root = minidom.parseString(svg.render(self.ops, 50)).documentElement
+        width, height = svg.extent(self.ops)
+        self.assertEqual(int(root.getAttribute("width")),
+                         int(round(width * 50)))
+
+    def test_unsupported(self):
+        ops = [Op(RAW, ("circle rad 1;",), 1)]
+        self.assertRaises(svg.NativeError, svg.render, ops)
+        self.assertEqual(uml_sequence.diagram_size(ops), None)
+
+
+@unittest.skipUnless(find_tool("pic2plot"), "pic2plot is not installed")
+class ParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = uml_sequence.Parser(example())
+        self.ops = self.parser.ir()
+        self.pic = u"".join(uml_sequence.pic_document(
+            self.parser.pic(self.ops)))
+
+    def test_labels(self):
+        self.assertEqual(words(svg.render(self.ops)),
+                         words(pic2plot(self.pic, "svg")))
+
+    def test_aspect_ratio(self):
+        width, height = svg.extent(self.ops)
+        native = (width - 2 * svg.MARGIN) / (height - 2 * svg.MARGIN)
+        x0, y0, x1, y1 = map(int, BOUNDING_BOX.search(
+            pic2plot(self.pic, "ps")).groups())
+        reference = float(x1 - x0) / (y1 - y0)
+        self.assertAlmostEqual(native / reference, 1, delta=.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Tests of the rendering of several diagrams with one pic2plot run: the
+pages of its input and output, and the errors mapped back to each
+diagram as a single render reports them.
+
+The comparisons with single renders are skipped if pic2plot is not
+installed.
+"""
+
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+
+import uml_sequence
+from uml_sequence import page_texts, pic_document, pic_error, split_ps
+from uml_sequence.cache import find_tool
+
+SMALL = "A : a\nB : b\nA -> B hello\n"
+OTHER = "U * User\nS : Server\nU -> S+ request\nU <- S- response\n"
+BAD = "A : a\nB : b\nA -> B hello\nBOOM ( ;\n"
+
+PS_HEADER = ["%!PS-Adobe-3.0", "%%BoundingBox: 0 0 600 800", "%%Pages: 3",
+             "%%EndComments", "%%BeginProlog", "/x {} def", "%%EndProlog"]
+PS_TRAILER = ["%%Trailer", "%%EOF"]
+
+
+def example():
+    f = open(os.path.join(here, "..", "example.umlgraph"))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def body(raw):
+    return uml_sequence.Parser(raw).translate()
+
+
+def single(raw):
+    return u"".join(pic_document(uml_sequence.Parser(raw).pic()))
+
+
+def error(lnr):
+    return "pic2plot:<stdin>:%d:syntax error\n" % lnr
+
+
+class PageTextsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.raws = [SMALL, example(), OTHER]
+        self.texts, self.offsets = page_texts(map(body, self.raws))
+
+    def test_pages(self):
+        joined = "\n".join(self.texts).split("\n")
+        for raw, text, offset in zip(self.raws, self.texts, self.offsets):
+            lines = text.split("\n")
+            self.assertEqual(joined[offset:offset + len(lines)], lines)
+            # numbered as in a single render
+            self.assertEqual(len(lines), len(single(raw).split("\n")))
+
+    def test_reset(self):
+        for k, (raw, text) in enumerate(zip(self.raws, self.texts)):
+            expected = single(raw).split("\n")
+            if k:
+                expected[1] = "reset; " + expected[1]
+            self.assertEqual(text.split("\n"), expected)
+
+    def test_errors(self):
+        # an error on each line of each page is reported as on that line
+        # of the single render
+        for raw, text, offset in zip(self.raws, self.texts, self.offsets):
+            alone = single(raw)
+            for lnr in range(3, text.count("\n") + 2):
+                grouped = pic_error(error(offset + lnr), text, offset)
+                expected = pic_error(error(lnr), alone)
+                self.assertEqual(grouped.lnr, lnr)
+                self.assertEqual(
+                    (grouped.message, grouped.output, grouped.line),
+                    (expected.message, expected.output, expected.line))
+                if not offset or lnr > 4:
+                    # out of reach of the reset
+                    self.assertEqual(grouped.context, expected.context)
+
+
+class SplitPsTest(unittest.TestCase):
+
+    def test_split(self):
+        pages = [["%%%%Page: %d %d" % (k, k),
+                  "%%%%PageBoundingBox: 0 0 %d 50" % (k * 100),
+                  "page %d" % k, "showpage"] for k in (1, 2, 3)]
+        docs = split_ps("\n".join(PS_HEADER + sum(pages, []) + PS_TRAILER))
+        self.assertEqual(len(docs), 3)
+        for k, doc in enumerate(docs, 1):
+            head = list(PS_HEADER)
+            head[1] = "%%%%BoundingBox: 0 0 %d 50" % (k * 100)
+            head[2] = "%%Pages: 1"
+            self.assertEqual(doc.split("\n"),
+                             head + ["%%Page: 1 1"] + pages[k - 1][1:] +
+                             PS_TRAILER)
+
+    def test_no_page_box(self):
+        doc, = split_ps("\n".join(PS_HEADER + ["%%Page: 1 1", "showpage"] +
+                                  PS_TRAILER))
+        self.assertTrue("%%BoundingBox: 0 0 600 800" in doc.split("\n"))
+
+
+@unittest.skipUnless(find_tool("pic2plot"), "pic2plot is not installed")
+class RenderTogetherTest(unittest.TestCase):
+
+    def compare(self, raws):
+        results = uml_sequence.render_together(raws, 100, False, "ps")
+        for raw, (ret, data, diagnostics) in zip(raws, results):
+            alone = uml_sequence.Parser(raw).render(100, "ps")
+            self.assertEqual(ret, alone[0])
+            self.assertEqual([d.text() for d in diagnostics],
+                             [d.text() for d in alone[2]])
+            self.assertEqual(data is None, alone[1] is None)
+
+    def test_ok(self):
+        self.compare([SMALL, example(), OTHER])
+
+    def test_errors(self):
+        # the first page, and the next ones with their reset
+        self.compare([BAD, SMALL])
+        self.compare([SMALL, BAD, OTHER, BAD])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -54,12 +54,18 @@ Pascal Bauermeister <pascal DOT bauermeister AT gmail DOT com> 2007-05-13:
 
 """
 
+import errno
+import itertools
 import os
-import re
-import sha
+import shutil
+import signal
 import StringIO
 import string
 import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
 
 try:
     from __version__ import VERSION
@@ -484,71 +490,644 @@ define connect_to_comment {
 
 ###############################################################################
 
-import os
 from subprocess import Popen, PIPE
 
+from cache import find_tool, make_key, tool_fingerprint
+from ir import Op, COMMENT, RAW, PARTICIPANTS, emit_pic
+from lexer import match_constraint, match_arrow, match_modifiers, split_call
+from macros import Prelude, define_used
+import metrics
+import peephole
+import supervisor
+import svg
+
+# The settings and the macros of UMLGRAPH_PIC; documents define only the
+# macros they use
+PRELUDE = Prelude(UMLGRAPH_PIC)
+
 
 def escape(s):
     return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
 
 def execute(cmd, stdin, enc_in, enc_out):
+    stdout, stderrs = execute_pipeline([cmd], [stdin], enc_in)
+    if enc_out:
+        stdout = unicode(stdout, "utf-8")
+    return stdout, stderrs[0]
+
+
+# Size of the writes into a pipe, and of a tee kept in memory
+PIPE_CHUNK = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+
+
+def _drain(f, chunks):
+    # read a pipe to its end, in a thread
+    while True:
+        data = f.read(PIPE_CHUNK)
+        if not data:
+            break
+        chunks.append(data)
+    f.close()
+
+
+def _relay(src, dst, count):
+    # copy a pipe into another, counting the bytes, in a thread
+    try:
+        while True:
+            data = src.read(PIPE_CHUNK)
+            if not data:
+                break
+            count[0] += len(data)
+            dst.write(data)
+    except IOError:
+        # the reader exited early
+        pass
+    src.close()
     try:
-        p = Popen(cmd, shell=False, bufsize=0,
-                  stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
+        dst.close()
+    except IOError:
+        pass
+
+
+def _reap(p, chunks, usage, watchdog):
+    # read the stderr of a process, then wait for it, in a thread
+    _drain(p.stderr, chunks)
+    status, rusage = supervisor.reap(p)
+    watchdog.stop()
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    usage.append(rusage)
+
+
+# Per thread, the object whose add(process) is called for each command
+# started, if any (see asyncrender)
+children = threading.local()
+
+
+def _spawn(cmd, stdin, stdout):
+    wrapped = supervisor.wrap(cmd)
+    try:
+        if len(wrapped) > len(cmd) and find_tool(cmd[0]) is None:
+            # the wrapper would only fail once started
+            raise OSError(errno.ENOENT, cmd[0])
+        p = Popen(wrapped, shell=False, bufsize=0,
+                  stdin=stdin, stdout=stdout, stderr=PIPE, close_fds=True)
     except OSError:
         raise RuntimeError(
             "Error executing command " \
                 "(maybe '%s' is not installed on the system?) : %s" % (
                 os.path.split(cmd[0])[-1], ' '.join(cmd)))
+    supervisor.track(p)
+    tracker = getattr(children, "tracker", None)
+    if tracker is not None:
+        tracker.add(p)
+    return p
+
+
+def execute_pipeline(cmds, texts, enc_in, tee=None, out=None):
+    """
+    Run the commands 'cmds' connected by OS pipes, and write the input of
+    the first one as it is generated from the iterable 'texts', also
+    copying it to the file 'tee' if given.
+
+    The last command writes straight into the file 'out' if it has a file
+    descriptor; otherwise its output is collected. Return (stdout, stderrs),
+    stdout being None if written to 'out', and stderrs the stderr of each
+    command.
+
+    While metrics are collected, the pipes are relayed (and the output
+    collected) in Python, to count the bytes each command reads and writes.
+
+    The commands are supervised (see supervisor.configure()): the reason
+    a command was killed for, e.g. a timeout, is appended to its stderr.
+    """
+    counted = metrics.enabled()
+    fd = None
+    if out is not None and not counted:
+        try:
+            out.flush()
+            fd = out.fileno()
+        except (AttributeError, IOError, ValueError):
+            pass
+
+    stages = [supervisor.stage_of(cmd) for cmd in cmds]
+    held = supervisor.acquire(len(cmds))
+    try:
+        return _execute_pipeline(cmds, texts, enc_in, tee, counted, fd,
+                                 stages)
+    finally:
+        supervisor.release(held)
 
-    if enc_in:
-        stdin = stdin.encode(enc_in)
-    stdout, stderr = p.communicate(stdin)
-    if enc_out:
-        stdout = unicode(stdout, "utf-8")
-    stderr = unicode(stderr, "utf-8", "replace")
 
-    return stdout, stderr
+def _execute_pipeline(cmds, texts, enc_in, tee, counted, fd, stages):
+    procs = []
+    watchdogs = []
+    starts = []
+    try:
+        for k, cmd in enumerate(cmds):
+            if k + 1 < len(cmds) or fd is None:
+                stdout = PIPE
+            else:
+                stdout = fd
+            if k and not counted:
+                stdin = procs[-1].stdout
+            else:
+                stdin = PIPE
+            starts.append(time.time())
+            procs.append(_spawn(cmd, stdin, stdout))
+            watchdogs.append(supervisor.Watchdog(procs[-1], stages[k]))
+            if k and not counted:
+                # only the next command reads this pipe
+                procs[-2].stdout.close()
+    except RuntimeError:
+        for p, watchdog in zip(procs, watchdogs):
+            supervisor.kill(p, signal.SIGKILL)
+            supervisor.reap(p)
+            watchdog.stop()
+        raise
+
+    # the outputs are read concurrently, so that no command blocks on a
+    # full pipe while the first one is being fed
+    stdout = []
+    stderrs = [[] for p in procs]
+    usages = [[] for p in procs]
+    counts = [[0] for p in procs]
+    threads = [threading.Thread(target=_reap, args=(p, err, usage, watchdog))
+               for p, err, usage, watchdog in zip(procs, stderrs, usages,
+                                                  watchdogs)]
+    if counted:
+        threads += [threading.Thread(target=_relay, args=(
+                    procs[k].stdout, procs[k + 1].stdin, counts[k]))
+                    for k in range(len(procs) - 1)]
+    if fd is None:
+        threads.append(threading.Thread(target=_drain,
+                                        args=(procs[-1].stdout, stdout)))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    written = [0]
+
+    def write(texts):
+        data = "".join(texts)
+        if enc_in:
+            data = data.encode(enc_in)
+        if tee is not None:
+            tee.write(data)
+        written[0] += len(data)
+        procs[0].stdin.write(data)
+
+    try:
+        try:
+            buf, size = [], 0
+            for text in texts:
+                buf.append(text)
+                size += len(text)
+                if size >= PIPE_CHUNK:
+                    write(buf)
+                    buf, size = [], 0
+            write(buf)
+        except IOError:
+            # the command exited early (e.g. on a syntax error); its
+            # stderr tells why
+            pass
+    finally:
+        try:
+            procs[0].stdin.close()
+        except IOError:
+            pass
+        for t in threads:
+            t.join()
+
+    stderrs = ["".join(err) for err in stderrs]
+    for k, p in enumerate(procs):
+        stderrs[k] += supervisor.outcome(stages[k], p, watchdogs[k],
+                                         stderrs[k])
+
+    if fd is None:
+        stdout = "".join(stdout)
+        counts[-1][0] = len(stdout)
+    else:
+        stdout = None
+
+    if counted:
+        bytes_in = [written[0]] + [count[0] for count in counts[:-1]]
+        for k, cmd in enumerate(cmds):
+            metrics.emit_process(os.path.basename(cmd[0]), starts[k],
+                                 usages[k][0], bytes_in[k], counts[k][0])
+
+    return stdout, [unicode(err, "utf-8", "replace") for err in stderrs]
+
+
+def output_offset(out):
+    """
+    Offset of the file 'out', or None if it is not a seekable file.
+    """
+    try:
+        out.flush()
+        return os.lseek(out.fileno(), 0, os.SEEK_CUR)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def truncate_output(out, start):
+    """
+    Take back what a failed command wrote into the file 'out' after the
+    offset 'start', so that no partial image is left.
+    """
+    if start is not None:
+        os.ftruncate(out.fileno(), start)
+        os.lseek(out.fileno(), start, os.SEEK_SET)
+
+
+def pic_document(body, prelude=PRELUDE.settings):
+    """
+    Generate the text of the PIC document made of the prelude settings
+    and the lines of 'body', which defines the macros it uses.
+    """
+    yield u".PS\n%s\n" % prelude
+    sep = ""
+    for line in body:
+        yield sep + line
+        sep = "\n"
+    yield "\n.PE"
+
+PIC2PLOT_CMD = [
+    "pic2plot",
+    "-T", "ps",
+    "--page-size", "a4,xsize=16.8cm,xoffset=-1cm",
+    ]
+
+
+def background_opts(bgcolor):
+    if bgcolor is None:
+        return []
+    # add background
+    return ["-compose", "over", "-background", bgcolor, "-flatten"]
+
+
+def convert_cmd(opt_percent, bgcolor):
+    """
+    Leading part of the ImageMagick command rasterizing PostScript;
+    inputs and output are to be appended.
+    """
+    cmd = [
+        "convert",
+        "-density", "%dx%d" % (opt_percent, opt_percent),
+        ]
+    return cmd + background_opts(bgcolor)
+
+
+# Formats pic2plot writes itself, the bitmap ones being drawn on a square
+# as wide as the PostScript drawing area (xsize=16.8cm, in inches)
+PIC2PLOT_FORMATS = ("ps", "svg", "png", "gif", "pnm")
+PIC2PLOT_BITMAPS = ("png", "gif", "pnm")
+PAGE_WIDTH = 16.8 / 2.54
+
+# Routes to the output format; auto is convert, as before pic2plot wrote
+# the formats itself
+ROUTES = ("auto", "convert", "direct", "fit")
+
+
+def pic2plot_color(bgcolor):
+    """
+    Whether pic2plot knows the color 'bgcolor': an X11 name or #rrggbb,
+    but none of the other notations of ImageMagick, nor 'transparent'.
+    """
+    if bgcolor is None:
+        return True
+    if bgcolor.startswith("#"):
+        return len(bgcolor) == 7 and \
+            not bgcolor[1:].strip(string.hexdigits)
+    return bgcolor.isalnum() and bgcolor.lower() != "transparent"
+
+
+def fit_page(size):
+    """
+    pic2plot page size of a square viewport holding a diagram of 'size'
+    (width, height in inches) without scaling it.
+    """
+    side = max(size) * 2.54
+    return "a4,xsize=%.2fcm,ysize=%.2fcm" % (side, side)
+
+
+def diagram_size(ops):
+    """
+    Width and height of the diagram of 'ops' in inches, as laid out by the
+    native backend; None if it cannot lay it out (e.g. PIC statements).
+    """
+    try:
+        return svg.extent(ops)
+    except svg.NativeError:
+        return None
+
+
+def plan(fmt, opt_percent, bgcolor=None, route="auto", size=None):
+    """
+    Choose the way to produce the format 'fmt', and return the commands
+    of the pipeline: pic2plot writing PostScript that convert rasterizes,
+    or on the route 'direct', pic2plot alone if it can write 'fmt' itself
+    (faster, but its bitmaps are drawn by its own driver, uncropped).
+
+    The route 'fit' sizes the canvas to the diagram: pic2plot gets a page
+    as large as 'size' (see diagram_size()), and convert rasterizes the
+    bounding box of the PostScript rather than the page.
+    """
+    if route == "fit":
+        cmd = ["pic2plot", "-T", "ps"]
+        if size is not None:
+            cmd += ["--page-size", fit_page(size)]
+        else:
+            cmd = PIC2PLOT_CMD
+        if fmt == "ps":
+            return [cmd]
+        if fmt == "svg" and size is not None and pic2plot_color(bgcolor):
+            cmd = ["pic2plot", "-T", "svg", "--page-size",
+                   fit_page([x * opt_percent / 100. for x in size])]
+            if bgcolor is not None:
+                cmd += ["--bg-color", bgcolor]
+            return [cmd]
+        return [cmd, convert_cmd(opt_percent, bgcolor) + ["eps:-",
+                                                          fmt + ":-"]]
+
+    if fmt == "ps":
+        return [PIC2PLOT_CMD]
+
+    if route == "direct" and fmt in PIC2PLOT_FORMATS \
+            and pic2plot_color(bgcolor):
+        cmd = ["pic2plot", "-T", fmt]
+        if fmt in PIC2PLOT_BITMAPS:
+            # as many pixels per inch as convert -density would give
+            size = int(round(PAGE_WIDTH * opt_percent))
+            cmd += ["--bitmap-size", "%dx%d" % (size, size)]
+        else:
+            cmd += ["--page-size", "a4,xsize=%.2fcm,xoffset=-1cm" % (
+                16.8 * opt_percent / 100.)]
+        if bgcolor is not None:
+            cmd += ["--bg-color", bgcolor]
+        return [cmd]
+
+    return [PIC2PLOT_CMD,
+            convert_cmd(opt_percent, bgcolor) + ["ps:-", fmt+":-"]]
+
+
+class Diagnostic(object):
+    """
+    An error met while rendering: the 'stage' that failed (pic2plot,
+    convert or native), its 'message', and the 'output' of the failing
+    program if any; for a PIC error, the number 'lnr' of the faulty line
+    of the PIC text, the 'line' itself and its 'context', if known.
+    Problems found by the check stage (see check.py) have the number 'lnr'
+    of the source line, and their 'severity' is error or warning.
+    """
+
+    def __init__(self, stage, message, output=None, lnr=None, line=None,
+                 context=None, severity="error"):
+        self.stage = stage
+        self.message = message
+        self.output = output
+        self.lnr = lnr
+        self.line = line
+        self.context = context
+        self.severity = severity
+
+    def text(self):
+        """
+        The diagnostic as umlsequence prints it, in unicode.
+        """
+        lines = []
+        if self.output is not None:
+            lines.append(self.output)
+        lines.append("Umlsequence %s:  %s" % (self.severity, self.message))
+        if self.line:
+            lines += ["Faulty line:", self.line, "", "Context:",
+                      self.context]
+        return u"\n".join([isinstance(l, str) and l.decode("utf-8", "replace")
+                           or l for l in lines]) + "\n"
+
+    def write(self, f):
+        f.write(self.text().encode(getattr(f, "encoding", None) or "utf-8",
+                                   "replace"))
+
+
+def report(diagnostic, diagnostics=None):
+    """
+    Append 'diagnostic' to the list 'diagnostics', or print it if None.
+    """
+    if diagnostics is None:
+        diagnostic.write(sys.stderr)
+    else:
+        diagnostics.append(diagnostic)
+
+
+def pic_error(stderr, all, lnr_offset=0):
+    """
+    Explain a pic2plot error, given the PIC text it was fed with, as a
+    string or a file; return a Diagnostic. 'lnr_offset' is the number of
+    lines preceding 'all' in pic2plot's input, when several diagrams were
+    rendered at once.
+    """
+    # let us parse the 1st line of the error file, saying:
+    #   pic2plot:<PIC_FILENAME>:<LINE_NR>:<ERROR_MESSAGE>
+    first = stderr.split('\n')[0].split(":")
+    if len(first) == 4 and first[2].isdigit():
+        lnr, msg = first[2:2 + 2]
+        ix = int(lnr) - 1 - lnr_offset
+        if lnr_offset:
+            first[2] = str(ix + 1)
+            stderr = "\n".join([":".join(first)] + stderr.split('\n')[1:])
+        if isinstance(all, basestring):
+            all = StringIO.StringIO(all)
+        all.seek(0)
+        start = max(ix - 2, 0)
+        context = [l.rstrip() for l in
+                   itertools.islice(all, start, ix + 1 + 2)]
+        # a file holds the latin-1 text fed to pic2plot
+        context = [isinstance(l, str) and l.decode("latin1") or l
+                   for l in context]
+        snip = 0 <= ix - start < len(context) and context[ix - start] or ""
+        return Diagnostic("pic2plot", msg, stderr, ix + 1, snip,
+                          "\n".join(context))
+
+    # cannot parse it
+    return Diagnostic("pic2plot", ":".join(first), stderr)
+
+
+def split_ps(ps):
+    """
+    Split a multi-page PostScript document, as produced by pic2plot, into
+    single-page documents.
+    """
+    lines = ps.split('\n')
+    pages = []
+    header = []
+    trailer = []
+    current = header
+    for line in lines:
+        if line.startswith("%%Page:"):
+            current = []
+            pages.append(current)
+        elif line.startswith("%%Trailer"):
+            current = trailer
+        current.append(line)
+
+    docs = []
+    for page in pages:
+        head = []
+        for line in header:
+            if line.startswith("%%Pages:"):
+                line = "%%Pages: 1"
+            elif line.startswith("%%BoundingBox:"):
+                # use the page's own box if known
+                for l in page:
+                    if l.startswith("%%PageBoundingBox:"):
+                        line = "%%BoundingBox:" + l.split(":", 1)[1]
+                        break
+            head.append(line)
+        page = ["%%Page: 1 1"] + page[1:]
+        docs.append('\n'.join(head + page + trailer))
+    return docs
+
+
+def page_texts(bodies):
+    """
+    The PIC documents of the diagrams 'bodies', made to be the pages of a
+    single pic2plot input: the parameters are set on the first page and
+    reset on the others. Return the documents, to be joined by newlines,
+    and the number of lines before each one.
+
+    The reset shares the line of the first setting, so that the lines of
+    each page are numbered as in a single render.
+    """
+    settings = u"reset; " + PRELUDE.settings
+    texts = []
+    offsets = []
+    lnr = 0
+    for body in bodies:
+        text = u".PS\n%s\n%s\n.PE" % (texts and settings or PRELUDE.settings,
+                                      body)
+        texts.append(text)
+        offsets.append(lnr)
+        lnr += text.count('\n') + 1
+    return texts, offsets
+
+
+def render_together(raws, pcent, debug, fmt, bgcolor=None):
+    """
+    Render several diagrams with one pic2plot run, each diagram being a
+    page of its output, and (unless the format is ps) one convert run.
+    Each page defines the macros it uses, and the parameters are set on
+    the first page and reset on the others.
+
+    Return a list of (ret, data, diagnostics), one per diagram, data
+    being None unless ret is 0.
+    """
+    results = [None] * len(raws)
+    bodies = []
+    for raw in raws:
+        with metrics.Stage("translate", len(raw)) as stage:
+            bodies.append(Parser(raw).translate(debug))
+            stage.bytes_out = len(bodies[-1])
+
+    pending = range(len(raws))
+    while pending:
+        # concatenate the pending diagrams, noting where each page starts
+        texts, offsets = page_texts([bodies[i] for i in pending])
+
+        stdout, stderr = execute(PIC2PLOT_CMD, '\n'.join(texts),
+                                 "latin1", None)
+
+        if stderr:
+            # attribute the error to its diagram, and retry the others
+            first = stderr.split('\n')[0].split(":")
+            if len(first) == 4 and first[2].isdigit():
+                lnr = int(first[2]) - 1
+                k = max([k for k in range(len(pending)) if offsets[k] <= lnr])
+            else:
+                k = 0
+            results[pending[k]] = 1, None, [
+                pic_error(stderr, texts[k], offsets[k])]
+            del pending[k]
+            continue
+
+        pages = split_ps(stdout)
+        if len(pages) != len(pending):
+            for i in pending:
+                results[i] = 1, None, [Diagnostic(
+                    "pic2plot", "expected %d pages from pic2plot, got %d" % (
+                        len(pending), len(pages)))]
+            break
+
+        if fmt == "ps":
+            for i, page in zip(pending, pages):
+                results[i] = 0, page, []
+            break
+
+        # one convert run, each page being flattened in its own sequence
+        tmpdir = tempfile.mkdtemp(prefix="umlsequence-")
+        try:
+            cmd = convert_cmd(pcent, None)
+            for k, page in enumerate(pages):
+                name = os.path.join(tmpdir, "in-%d.ps" % k)
+                open(name, "wb").write(page)
+                cmd += ["(", "ps:" + name] + background_opts(bgcolor) + [")"]
+            cmd += ["+adjoin", "%s:%s" % (fmt, os.path.join(
+                tmpdir, "out-%%d.%s" % fmt))]
+            stdout, stderr = execute(cmd, "", None, None)
+
+            for k, i in enumerate(pending):
+                name = os.path.join(tmpdir, "out-%d.%s" % (k, fmt))
+                if stderr or not os.path.exists(name):
+                    results[i] = 2, None, [Diagnostic("convert", stderr)]
+                else:
+                    results[i] = 0, open(name, "rb").read(), []
+        finally:
+            shutil.rmtree(tmpdir, True)
+        break
+
+    return results
 
 ###############################################################################
 
 
-class Parser:
-    EXPRE1 = re.compile(
-        "([A-Za-z_0-9]+?)([\+\-\#~!]?)"
-        " *"
-        "(\??-+>"
-        "|<-+\??"
-        "|\??=+>\??"
-        "|\??<=+\??"
-        "|\??#+>"
-        "|<#+\??"
-        "|\??:+>"
-        "|<:+\??"
-        "|//"
-        "|:"
-        "|>"
-        "|\*"
-        "|\["
-        "|\]"
-        "|\{_?\}"
-        ")"
-        " *"
-        "([#A-Za-z_0-9]*)([\+\-\#~!]?)"
-        " *"
-        "(.*)")
-
-    EXPRE1_call = re.compile("([A-Za-z_0-9]+) *(=) *(.*)")
-    EXPRE1_call = re.compile("(.*?) *(=) *(.*)")
-
-    EXPRE2 = re.compile("([A-Za-z_0-9]+[\+\-\#~!]|:)+")
-
-    EXPRE3 = re.compile("([A-Za-z_0-9]*)([\+\-\#~!]?) *(_?)\{(.*)\}")
+class Translation(object):
+    """
+    State of one translation: the operations of the line being translated,
+    the objects alive, and whether the first step was emitted.
+    """
+
+    def __init__(self):
+        self.ops = []
+        self.objects = []
+        self.has_first_step = False
 
+    def add_obj(self, name):
+        if name not in self.objects:
+            self.objects.append(name)
+
+    def rem_obj(self, name):
+        if name in self.objects:
+            self.objects.remove(name)
+
+
+class Parser:
+    """
+    Translator and renderer of a diagram. A parser keeps no state between
+    calls, so that one made from a string can serve concurrent calls.
+    """
     extensions = ['.dot']
 
     def __init__(self, raw):
+        # a stream is read lazily, and only once, by lines()
+        if hasattr(raw, "read"):
+            self.raw = None
+            self.stream = raw
+            return
+
         # save call arguments for later use in format()
         self.raw = raw.encode('utf-8')
         self.raw = raw.encode('latin1')
@@ -557,29 +1136,36 @@ class Parser:
         return
 
     def _convert_from_alternate_1(self, lines):
-        newlines = []
+        return list(emit_pic(self._translate(enumerate(lines, 1))))
 
-        self.has_first_step = False
-        self.objects = []
+    def _translate(self, lines):
+        """
+        Translate (line number, line) pairs into a list of operations
+        """
+        return list(self._operations(lines))
+
+    def _operations(self, lines, state=None, complete=True):
+        """
+        Translate (line number, line) pairs into operations, generated as
+        each line is translated; continue the translation 'state' if given,
+        and unless 'complete' is false, end the lifelines still alive
+        """
+        state = state or Translation()
+        ops = state.ops
+        add_obj = state.add_obj
+        rem_obj = state.rem_obj
 
-        def add_obj(name):
-            if name not in self.objects:
-                self.objects.append(name)
+        def add(kind, *args):
+            if kind not in PARTICIPANTS and not state.has_first_step:
+                ops.append(Op("step", (), lnr))
+                state.has_first_step = True
+            ops.append(Op(kind, args, lnr))
 
-        def rem_obj(name):
-            if name in self.objects:
-                self.objects.remove(name)
+        def note(text):
+            ops.append(Op(COMMENT, (text,), lnr))
 
-        def add(txt):
-            txt = txt.strip()
-            if not txt:
-                return
-            ini = "object", "pobject", "placeholder_object", "actor"
-            obj = max([txt.startswith(i) for i in ini])
-            if not obj and not self.has_first_step:
-                newlines.append("step();")
-                self.has_first_step = True
-            newlines.append(txt)
+        def label(text):
+            return '" %s "' % text
 
         def nl2str(text):
             texts = text.split("\\n")
@@ -594,8 +1180,8 @@ class Parser:
             if not line.strip():
                 return
 
-            newlines.append('#' * (2 - level) * 40)
-            newlines.append('## [%s]' % line)
+            note('#' * (2 - level) * 40)
+            note('## [%s]' % line)
 
             oline = line
 
@@ -604,33 +1190,32 @@ class Parser:
                 return
 
             if line.startswith("#"):
-                newlines.append(line)
+                note(line)
                 return
 
             # try to match: [OBJECT[OP]] [_]{CONSTRAINT}
-            terms = Parser.EXPRE3.findall(line)
+            terms = match_constraint(line)
             if terms:
-                newlines.append('#' + ' ' * 50 + "##3## " + oline)
-                l, lop, below, r = terms[0]
+                note('#' + ' ' * 50 + "##3## " + oline)
+                l, lop, below, r = terms
                 r, nlines, maxlen = nl2str(r)
                 if not l:
-                    add('oconstraint(" %s ");' % (r))
+                    add('oconstraint', label(r))
                 elif not below:
-                    add('lconstraint(%s," %s ");' % (l, r))
+                    add('lconstraint', l, label(r))
                     if lop:
                         do_line(l + lop, level + 1)
                 else:
-                    add('lconstraint_below(%s," %s ");' % (l, r))
+                    add('lconstraint_below', l, label(r))
                     if lop:
                         do_line(l + lop, level + 1)
                 return
 
             # try to match: OBJECT[OP] OP OBJECT[OP] MORE
-            terms = Parser.EXPRE1.findall(line)
+            terms = match_arrow(line)
             if terms:
-                l, lop, op, r, rop, edge = terms[0]
-                newlines.append('#' + ' ' * 50 + "##1## " + oline)
-                ##newlines.append('#'+' '*50 + "# "+ `(l,op,r,edge)`)
+                l, lop, op, r, rop, edge = terms
+                note('#' + ' ' * 50 + "##1## " + oline)
 
                 async_head = False
                 async_tail = False
@@ -652,7 +1237,7 @@ class Parser:
                             async_tail = True
 
                     if async_tail:
-                        add('async();')
+                        add('async')
 
                     # trim long arrows
                     if op[0] == "<":
@@ -665,7 +1250,6 @@ class Parser:
                     op = op[1:] + ">"
                     l, r = r, l
                     lop, rop = rop, lop
-                ##newlines.append('#'+' '*50 + "# "+ `(l,op,r,edge)`)
 
                 r2 = ' '.join((r, edge)).strip()
 
@@ -677,30 +1261,30 @@ class Parser:
                 # http://www.spinellis.gr/sw/umlgraph/doc/seq-ops.html
 
                 if op == ":"  and r2 and not r2.startswith("#"):
-                    add('object(%s," %s ");' % (l, r2))
+                    add('object', l, label(r2))
                     add_obj(l)
 
                 elif op == ":":
-                    add('pobject(%s);' % (l))
+                    add('pobject', l)
 
                 elif op == "*":
                     if r2.startswith("#"):
                         r2 = ""
-                    add('actor(%s," %s ");' % (l, r2))
+                    add('actor', l, label(r2))
                     add_obj(l)
 
                 elif op == "->":
                     edge, nlines, maxlen = nl2str(edge)
                     if edge.startswith("<(>"):
-                        add('message(%s,%s,"");' % (l, r))
+                        add('message', l, r, '""')
                         edge = edge[3:].strip()
-                        add('lconstraint(%s," %s ");' % (l, edge))
+                        add('lconstraint', l, label(edge))
                     elif edge.startswith("<)>"):
-                        add('message(%s,%s,"");' % (l, r))
+                        add('message', l, r, '""')
                         edge = edge[3:].strip()
-                        add('lconstraint(%s," %s ");' % (r, edge))
+                        add('lconstraint', r, label(edge))
                     else:
-                        add('message(%s,%s," %s ");' % (l, r, edge))
+                        add('message', l, r, label(edge))
                     if lop:
                         do_line(l + lop, level + 1)
                     if rop:
@@ -708,15 +1292,14 @@ class Parser:
 
                 elif op == ">":
                     r2, nlines, maxlen = nl2str(r2)
-                    add('active(%s);' % l)
-                    #add('step();')
-                    add('message(%s,%s," %s ");' % (l, l, r2))
-                    add('inactive(%s);  # >' % l)
+                    add('active', l)
+                    add('message', l, l, label(r2))
+                    add('inactive', l)
                     if lop:
                         do_line(l + lop, level + 1)
 
                 elif op == ":>":
-                    add('cmessage(%s,%s," %s "," ");' % (l, r, edge))
+                    add('cmessage', l, r, label(edge), '" "')
                     add_obj(r)
                     if lop:
                         do_line(l + lop, level + 1)
@@ -724,36 +1307,28 @@ class Parser:
                         do_line(r + rop, level + 1)
 
                 elif op == "=>":
-                    subterms = Parser.EXPRE1_call.findall(edge)
-                    if subterms:
-                        subterms = subterms[0]
+                    subterms = split_call(edge)
 
                     # treat case: A => B  result=call(args)
-                    if subterms and len(subterms) == 3 and subterms[1] == "=":
+                    if subterms:
                         # short hand for request+result
                         res, op, edge = subterms
-                        add('message(%s,%s," %s ");' % (l, r, edge))
-                        add('active(%s);' % r)
-
-                        # sync/async for arrow head end:
-                        #if async_tail and not async_head:
-                        #    add('sync();')
-                        #elif not async_tail and async_head:
-                        #    add('async();')
+                        add('message', l, r, label(edge))
+                        add('active', r)
 
                         # return message is always async!
-                        add('async();')
-                        add('rmessage(%s,%s," %s ");' % (r, l, res))
-                        add('sync();')
+                        add('async')
+                        add('rmessage', r, l, label(res))
+                        add('sync')
 
-                        add('inactive(%s);  # =>' % r)
+                        add('inactive', r)
 
                     # treat case: A => B  result
                     else:
                         # result only
-                        add('async();')
-                        add('rmessage(%s,%s," %s ");' % (l, r, edge))
-                        add('sync();')
+                        add('async')
+                        add('rmessage', l, r, label(edge))
+                        add('sync')
 
                     # post-ops
                     if lop:
@@ -762,7 +1337,7 @@ class Parser:
                         do_line(r + rop, level + 1)
 
                 elif op == "#>":
-                    add('dmessage(%s,%s);' % (l, r))
+                    add('dmessage', l, r)
                     rem_obj(r)
                     if lop:
                         do_line(l + lop, level + 1)
@@ -779,7 +1354,7 @@ class Parser:
                     text = text.strip()
 
                     if not text:
-                        add('connect_to_comment(%s,%s);' % (l, opts[0]))
+                        add('connect_to_comment', l, opts[0])
                     else:
                         text, nlines, maxlen = nl2str(text)
                         if not opts[1]:  # auto-calculate box pos
@@ -788,8 +1363,8 @@ class Parser:
                             w = 0.10 + float(maxlen) / 13.0
                             h = 0.10 + 0.16 * nlines
                             opts[2] = "wid %.2f ht %.2f" % (w, h)
-                        opts = ",".join(opts)
-                        add('comment(%s,%s "%s");' % (l, opts, text))
+                        add('comment', l, opts[0], opts[1],
+                            '%s "%s"' % (opts[2], text))
 
                     if lop:
                         do_line(l + lop, level + 1)
@@ -808,147 +1383,346 @@ class Parser:
                     if edge:
                         if op == "]":
                             r, l = l, r
-                        add('begin_frame(%s,%s," %s ");' % (r, l, edge))
+                        add('begin_frame', r, l, label(edge))
                     else:
                         if op == "[":
                             r, l = l, r
-                        add('end_frame(%s,%s);' % (l, r))
+                        add('end_frame', l, r)
 
                 if async_head or async_tail:
-                    add('sync();')
+                    add('sync')
                 return
 
             # try to match: OBJECT[OP] [OBJECT[OP] ...]
-            terms = Parser.EXPRE2.findall(line)
-            if terms == line.split():
-                newlines.append('#' + ' ' * 50 + "##2## " + oline)
+            terms = match_modifiers(line)
+            if terms is not None:
+                note('#' + ' ' * 50 + "##2## " + oline)
                 for term in terms:
                     l, op = term[:-1], term[-1]
                     if op == "+":
-                        add('active(%s);' % l)
+                        add('active', l)
                     elif op == "-":
-                        add('inactive(%s);  # -' % l)
+                        add('inactive', l)
                     elif op == "!":
-                        add('active(%s);' % l)
-                        add('step();')
-                        add('inactive(%s);  # !' % l)
+                        add('active', l)
+                        add('step')
+                        add('inactive', l)
                     elif op == "#":
-                        add('complete(%s);' % l)
+                        add('complete', l)
                         rem_obj(l)
                     elif op == "~":
-                        add('delete(%s);' % l)
+                        add('delete', l)
                         rem_obj(l)
                 if ":" in terms:
-                    add('step();')
+                    add('step')
                 return
 
-            # all attemps to match by RE failed => output as-is
-            newlines.append(line)
+            # all attemps to match failed => output as-is
+            ops.append(Op(RAW, (line,), lnr))
 
-        for line in lines:
+        lnr = 0
+        for lnr, line in lines:
             do_line(line)
-
-        if self.objects:
-            add('step();')
-            for o in self.objects:
-                add('complete(%s);' % o)
-        return newlines
-
-    def format(self, opt_dbg, opt_percent, out, fmt, bgcolor=None):
+            for op in ops:
+                yield op
+            del ops[:]
+
+        if complete and state.objects:
+            add('step')
+            for o in state.objects:
+                add('complete', o)
+        for op in ops:
+            yield op
+
+    def physical_lines(self):
         """
-        The parser's entry point
+        Generate the lines of the input, like raw.split('\\n') but reading
+        a stream as needed; flag the last one
         """
-
-        raw = self.raw
-        # preprocess:
-        # - remove tabs
-        raw = raw.replace("\t", " ")
-        # - join lines ending with '\' with the next one
-        #   (lazy way, TODO: use regex)
-        while raw.find("\\\n ") >= 0:
-            raw = raw.replace("\\\n ", "\\\n")
-        while raw.find(" \\\n") >= 0:
-            raw = raw.replace(" \\\n", "\\\n")
-        raw = raw.replace("\\\n", " ")
-        lines = raw.split('\n')
+        if self.raw is not None:
+            lines = self.raw.split('\n')
+            for line in lines[:-1]:
+                yield line, False
+            yield lines[-1], True
+            return
+        stream = self.stream
+        previous = None
+        for line in stream:
+            if previous is not None:
+                yield previous[:-1], False
+            previous = line
+        if previous is None:
+            previous = ""
+        elif previous.endswith("\n"):
+            # the text after the last newline
+            yield previous[:-1], False
+            previous = ""
+        yield previous, True
+
+    def lines(self):
+        """
+        Preprocess the input into (line number, line) pairs, generated
+        in a single pass
+        """
+        joined = []
+        for lnr, (line, last) in enumerate(self.physical_lines(), 1):
+            # - remove tabs
+            line = line.replace("\t", " ")
+            # - join lines ending with '\' with the next one
+            if joined:
+                line = line.lstrip(" ")
+            if line.endswith("\\") and not last:
+                joined.append((lnr, line[:-1].rstrip(" ")))
+                continue
+            if joined:
+                yield (joined[0][0],
+                       " ".join([l for n, l in joined] + [line]))
+                joined = []
+            else:
+                yield lnr, line
+
+    def ir(self, opt_dbg=False):
+        """
+        Translate the input into a list of operations
+        """
+        lines = list(self.lines())
 
         # alternate syntax support
-        lines = self._convert_from_alternate_1(lines)
+        ops = self._translate(lines)
 
         # debug ? post-print
         if opt_dbg:
-            pic_lines = [l for l in lines if not l.startswith('#')]
-            print >>sys.stderr, raw
+            pic_lines = [l for l in emit_pic(ops) if not l.startswith('#')]
+            print >>sys.stderr, '\n'.join([l for n, l in lines])
             print >>sys.stderr, "----------"
             print >>sys.stderr, '\n'.join(pic_lines)
 
-        # go !
-        all = '\n'.join(lines).strip()
-        seq_pic = UMLGRAPH_PIC
-        all = u".PS\n%s\n%s\n.PE" % (seq_pic, all)
-
-        #os.system('pic2plot -T ps "%s" > "%s" 2>"%s"' % (pic, ps, errpath))
-        stdout, stderr = execute(["pic2plot",
-                                  "-T", "ps",
-                                  "--page-size", "a4,xsize=16.8cm,xoffset=-1cm",
-                                  ],
-                                 all, "latin1", None)
-
-        if stderr:
-            # Error handling
-
-            # let us parse the 1st line of the error file, saying:
-            #   pic2plot:<PIC_FILENAME>:<LINE_NR>:<ERROR_MESSAGE>
-            print >>sys.stderr, stderr
-            err = stderr.split('\n')[0].split(":")
-            if len(err) == 4:
-                lnr, msg = err[2:2 + 2]
-                ix = int(lnr) - 1
-                snip = [l.rstrip() for l in all.split('\n')]
-                snip, context = snip[ix], snip[max(ix - 2, 0):ix + 1 + 2]
-                context = "\n".join(context)
-            else:  # cannot parse it
-                msg = ":".join(err)
-                snip = ""
-
-            # print error message
-            print >>sys.stderr, "Umlsequence error: ", msg
-
-            # print code snippet
-            if snip:
-                print >>sys.stderr, "Faulty line:"
-                print >>sys.stderr, snip
-                print >>sys.stderr
-                print >>sys.stderr, "Context:"
-                print >>sys.stderr, context
-            return 1
+        return ops
 
-        stderr = None
-        if fmt <> "ps":
-            # Run the postprocessing/conversion chain
-            ps = stdout
-            cmd = [
-                "convert",
-                "-density", "%dx%d" % (opt_percent, opt_percent),
-                ]
+    def pic(self, ops=None, optimize=True):
+        """
+        Generate the PIC statements, without the prelude settings but
+        with the definitions of the macros used, translating the input
+        line by line unless 'ops' are given; unless 'optimize' is false,
+        the source comments are dropped and the operations simplified
+        """
+        if ops is None:
+            ops = self._operations(self.lines())
+        if optimize:
+            ops = peephole.optimize(ops)
+        ops = define_used(ops, PRELUDE)
+        # like '\n'.join(...).strip(); no statement is blank
+        previous = None
+        for line in emit_pic(ops):
+            if previous is None:
+                line = line.lstrip()
+            else:
+                yield previous
+            previous = line
+        if previous is not None:
+            yield previous.rstrip()
+
+    def translate(self, opt_dbg=False):
+        """
+        Translate the input into PIC statements, without the prelude
+        settings, optimized unless debugging
+        """
+        return '\n'.join(self.pic(self.ir(opt_dbg), not opt_dbg))
 
-            if bgcolor is not None:
-                # add background
-                cmd += ["-compose", "over", "-background", bgcolor, "-flatten"]
+    def format(self, opt_dbg, opt_percent, out, fmt, bgcolor=None,
+               backend="pic2plot", route="auto", diagnostics=None,
+               translated=None):
+        """
+        The parser's entry point. The errors are appended to the list
+        'diagnostics' as Diagnostic objects, or printed if it is None.
+        'translated' is the translation of the input, if already made
+        (see translate_diagram())
+        """
 
-            cmd += ["ps:-", fmt+":-"]
+        if backend == "native":
+            return self.format_native(opt_dbg, opt_percent, out, fmt, bgcolor,
+                                      diagnostics, translated)
 
-            stdout, stderr = execute(cmd, ps, None, None)
+        # go !
+        size = None
+        if translated is not None and not opt_dbg:
+            body = None
+            if route == "fit":
+                size = diagram_size(translated.ops)
+        elif opt_dbg or route == "fit":
+            ops = self.ir(opt_dbg)
+            body = self.pic(ops, not opt_dbg)
+            if route == "fit":
+                size = diagram_size(ops)
+        else:
+            body = self.pic()
 
+        # Run pic2plot, and the postprocessing/conversion chain if needed,
+        # reading pic2plot's output and writing the image straight into
+        # 'out'
+        cmds = plan(fmt, opt_percent, bgcolor, route, size)
+        if opt_dbg:
+            print >>sys.stderr, "Route:", " | ".join(
+                [" ".join(cmd) for cmd in cmds])
+        start = output_offset(out)
+
+        # the PIC text is translated while pic2plot reads it, and kept
+        # aside for error reports
+        all = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        if body is None:
+            text = [translated.pic]
+        else:
+            text = pic_document(body)
+            if metrics.enabled():
+                text = metrics.timed("translate", text)
+        try:
+            #os.system('pic2plot -T ps "%s" > "%s" 2>"%s"' % (pic, ps, errpath))
+            stdout, stderrs = execute_pipeline(cmds, text, "latin1", all, out)
+
+            if stderrs[0]:
+                truncate_output(out, start)
+                report(pic_error(stderrs[0], all), diagnostics)
+                return 1
+        finally:
+            all.close()
+
+        stderr = stderrs[-1]
         if not stderr:
-            out.write(stdout)
+            if stdout is not None:
+                with metrics.Stage("write", len(stdout), len(stdout)):
+                    out.write(stdout)
         else:
-            print >>sys.stderr, "Umlsequence error: ", stderr
+            truncate_output(out, start)
+            report(Diagnostic(os.path.basename(cmds[-1][0]), stderr),
+                   diagnostics)
             return 2
 
         # Done
         return 0
 
+    def format_native(self, opt_dbg, opt_percent, out, fmt, bgcolor=None,
+                      diagnostics=None, translated=None):
+        """
+        Render with the native SVG backend, without external programs
+        """
+        if fmt != "svg":
+            report(Diagnostic("native", "the native backend only produces "
+                              "svg, not %s" % fmt), diagnostics)
+            return 2
 
-def run(inp, out, pcent, debug, fmt, bgcolor=None):
-    return Parser(inp.read()).format(debug, pcent, out, fmt, bgcolor)
+        if opt_dbg:
+            ops = self.ir(opt_dbg)
+        elif translated is not None:
+            ops = translated.ops
+        else:
+            ops = self._operations(self.lines())
+        try:
+            with metrics.Stage("native") as stage:
+                data = svg.render(ops, opt_percent, bgcolor)
+                stage.bytes_out = len(data)
+        except svg.NativeError, e:
+            report(Diagnostic("native", str(e)), diagnostics)
+            return 1
+
+        with metrics.Stage("write", len(data), len(data)):
+            out.write(data)
+        return 0
+
+    def render(self, opt_percent, fmt, bgcolor=None, backend="pic2plot",
+               route="auto", translated=None):
+        """
+        Render into a string, printing nothing; return (ret, data,
+        diagnostics), data being None unless ret is 0
+        """
+        out = StringIO.StringIO()
+        diagnostics = []
+        ret = self.format(False, opt_percent, out, fmt, bgcolor, backend,
+                          route, diagnostics, translated)
+        return ret, not ret and out.getvalue() or None, diagnostics
+
+
+# A diagram translated once, for its render key and its rendering: its
+# parser, its operations, and the PIC document fed to pic2plot (None for
+# the native backend)
+Translated = namedtuple("Translated", "parser ops pic")
+
+
+def translate_diagram(raw, backend="pic2plot"):
+    """
+    Translate the diagram 'raw' for 'backend'; return a Translated tuple.
+    """
+    parser = Parser(raw)
+    with metrics.Stage("translate", len(raw)) as stage:
+        ops = parser.ir()
+        pic = None
+        if backend != "native":
+            pic = u"".join(pic_document(parser.pic(ops)))
+            stage.bytes_out = len(pic)
+    return Translated(parser, ops, pic)
+
+
+def render_key(raw, pcent, fmt, bgcolor, backend="pic2plot", route="auto",
+               translated=None):
+    """
+    Hash of everything the rendered bytes depend on: source, options and
+    tool versions; it keys the render cache and the build manifest.
+    The source is the PIC text pic2plot reads, or the operations the
+    native backend draws (with its REVISION), so that a change of the
+    translator changes the key. 'translated' is the translation of 'raw',
+    if already made by translate_diagram().
+    """
+    if translated is None:
+        translated = translate_diagram(raw, backend)
+    if backend == "native":
+        # the source comments are not drawn
+        ops = [op for op in translated.ops if op.kind != COMMENT]
+        return make_key(u"\n".join(emit_pic(ops)), pcent, fmt, bgcolor,
+                        backend, svg.REVISION)
+    size = route == "fit" and diagram_size(translated.ops) or None
+    cmds = plan(fmt, pcent, bgcolor, route, size)
+    return make_key(translated.pic, pcent, fmt, bgcolor,
+                    tool_fingerprint("pic2plot"),
+                    len(cmds) > 1 and tool_fingerprint("convert") or None,
+                    " | ".join([" ".join(cmd) for cmd in cmds]), route)
+
+
+def run(inp, out, pcent, debug, fmt, bgcolor=None, cache=None,
+        backend="pic2plot", route="auto", diagnostics=None, translated=None,
+        key=None):
+    """
+    Render the diagram read from 'inp' into 'out', through the render
+    cache if given. 'translated' and 'key' are the translation and the
+    render key of the diagram, if already computed.
+    """
+    if cache is None and translated is None:
+        # translate while reading
+        return Parser(inp).format(debug, pcent, out, fmt, bgcolor, backend,
+                                  route, diagnostics)
+
+    if translated is None:
+        translated = translate_diagram(inp.read(), backend)
+    parser = translated.parser
+    if cache is None:
+        return parser.format(debug, pcent, out, fmt, bgcolor, backend, route,
+                             diagnostics, translated)
+
+    key = key or render_key(None, pcent, fmt, bgcolor, backend, route,
+                            translated)
+    with metrics.Stage("cache", len(translated.parser.raw)) as stage:
+        data = cache.get(key)
+        stage.bytes_out = data is not None and len(data) or None
+    if data is None:
+        buf = StringIO.StringIO()
+        ret = parser.format(debug, pcent, buf, fmt, bgcolor, backend, route,
+                            diagnostics, translated)
+        if ret:
+            return ret
+        data = buf.getvalue()
+        cache.put(key, data)
+
+    if debug:
+        print >>sys.stderr, "Cache:", cache.stats()
+
+    with metrics.Stage("write", len(data), len(data)):
+        out.write(data)
+    return 0
@@ -0,0 +1,221 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Non-blocking rendering API, for services that must not wait on pic2plot
+and convert.
+
+render_async() starts rendering a diagram in a thread and returns at once
+a RenderFuture, whose result() is the image as a string of bytes:
+
+    future = render_async(source, fmt="png", zoom=150)
+    ...
+    data = future.result()
+
+Event loops can be notified with future.add_done_callback(fn) instead of
+waiting. At most set_limit() renders run at once (the others wait for
+their turn), or as many as the semaphore passed as 'limit' allows.
+future.cancel() kills the processes of a running render.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import signal
+import StringIO
+import threading
+
+import uml_sequence
+from uml_sequence import supervisor
+
+# Default number of renders running at once
+DEFAULT_LIMIT = 4
+
+_limit = threading.BoundedSemaphore(DEFAULT_LIMIT)
+
+
+def set_limit(n):
+    """
+    Let at most 'n' renders started from now on run at once.
+    """
+    global _limit
+    _limit = threading.BoundedSemaphore(max(n, 1))
+
+
+class CancelledError(Exception):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class RenderError(Exception):
+    """
+    Failed render; 'ret' is the exit code umlsequence would return,
+    'diagnostics' the uml_sequence.Diagnostic objects telling why, and
+    'messages' the text umlsequence would print.
+    """
+
+    def __init__(self, ret, diagnostics):
+        self.ret = ret
+        self.diagnostics = diagnostics
+        self.messages = u"".join([d.text() for d in diagnostics])
+        Exception.__init__(self, self.messages.strip() or
+                           "rendering failed with code %d" % ret)
+
+
+class Children(object):
+    """
+    The processes started by a render, killed on cancel.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.procs = []
+        self.killed = False
+
+    def add(self, p):
+        with self.lock:
+            self.procs.append(p)
+            if self.killed:
+                self._kill(p)
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            for p in self.procs:
+                self._kill(p)
+
+    def _kill(self, p):
+        # not once reaped, when its pid may be another process's
+        supervisor.kill(p, signal.SIGKILL)
+
+
+class RenderFuture(object):
+    """
+    Pending result of render_async().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._children = Children()
+        self._cancelled = False
+        self._data = None
+        self._error = None
+
+    def cancel(self):
+        """
+        Stop the render, killing its processes; return False if it is
+        already done.
+        """
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._cancelled = True
+            self._error = CancelledError()
+        self._children.kill()
+        self._finish()
+        return True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the render, up to 'timeout' seconds if given, and return
+        the image; raise RenderError, CancelledError or what the render
+        raised if it failed.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("rendering not done after %s s" % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._data
+
+    def exception(self, timeout=None):
+        try:
+            self.result(timeout)
+        except TimeoutError:
+            raise
+        except Exception, e:
+            return e
+        return None
+
+    def add_done_callback(self, fn):
+        """
+        Call fn(future) once done, in the thread that finished it (or now
+        if already done).
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set(self, data, error):
+        with self._lock:
+            if self._done.is_set():
+                # cancelled meanwhile
+                return
+            self._data = data
+            self._error = error
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+def _render(future, source, fmt, zoom, bgcolor, backend, route, cache,
+            limit):
+    with limit:
+        if future.done():
+            # cancelled while waiting
+            return
+        diagnostics = []
+        uml_sequence.children.tracker = future._children
+        try:
+            try:
+                out = StringIO.StringIO()
+                ret = uml_sequence.run(StringIO.StringIO(source), out, zoom,
+                                       False, fmt, bgcolor, cache, backend,
+                                       route, diagnostics)
+            except Exception, e:
+                future._set(None, e)
+                return
+        finally:
+            uml_sequence.children.tracker = None
+    if ret:
+        future._set(None, RenderError(ret, diagnostics))
+    else:
+        future._set(out.getvalue(), None)
+
+
+def render_async(source, fmt="ps", zoom=100, bgcolor="white",
+                 backend="pic2plot", route="auto", cache=None, limit=None):
+    """
+    Start rendering the diagram 'source' (text in either syntax) with the
+    options of umlsequence; return a RenderFuture.
+    """
+    if isinstance(source, unicode):
+        source = source.encode("utf-8")
+    future = RenderFuture()
+    t = threading.Thread(target=_render, args=(
+            future, source, fmt, zoom, bgcolor, backend, route, cache,
+            limit or _limit))
+    t.daemon = True
+    t.start()
+    return future
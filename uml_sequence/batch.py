@@ -0,0 +1,386 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Batch rendering of many diagram files over a pool of worker processes.
+
+Outputs are replaced atomically. In incremental mode, a manifest (see
+uml_sequence.manifest) lets unchanged diagrams be skipped.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import fnmatch
+import glob
+import multiprocessing
+import os
+import StringIO
+import sys
+
+import uml_sequence
+from uml_sequence import manifest, metrics, multi, pages, supervisor
+from uml_sequence.cache import RenderCache
+
+# Files picked when an input is a directory
+DEFAULT_PATTERN = "*.umlgraph"
+
+# Return code of a file that could not be read or written
+ERR_IO = 3
+
+
+def output_name(path, fmt):
+    return os.path.splitext(path)[0] + "." + fmt
+
+
+def expand_inputs(specs, pattern=DEFAULT_PATTERN):
+    """
+    Expand input specifications (file names, glob patterns or directories,
+    which are walked recursively for 'pattern') into a list of file names.
+    """
+    paths = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            found = []
+            for dirpath, dirnames, filenames in os.walk(spec):
+                found += [os.path.join(dirpath, name)
+                          for name in fnmatch.filter(filenames, pattern)]
+            paths += sorted(found)
+        elif glob.has_magic(spec):
+            paths += sorted(glob.glob(spec))
+        else:
+            paths.append(spec)
+
+    # remove duplicates, keeping order
+    seen = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
+
+
+def read_file_list(name):
+    """
+    Read input specifications, one per line, from a file ('-' for stdin).
+    """
+    f = name == "-" and sys.stdin or open(name)
+    try:
+        return [l.strip() for l in f
+                if l.strip() and not l.strip().startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def write_output(name, data, key=None):
+    """
+    Write the output 'name' atomically, embedding 'key' if given.
+    """
+    if key:
+        data = manifest.stamp(data, key)
+    manifest.write_atomic(name, data)
+
+
+def render_file(task):
+    """
+    Render one file; runs in a worker process.
+    Return (path, output, ret, messages).
+    """
+    path, pcent, debug, fmt, bgcolor, cache_dir, cache_size, backend, \
+        route, stamped = task
+    name = output_name(path, fmt)
+    metrics.set_context(input=path)
+
+    # collect this file's diagnostics instead of interleaving them
+    # with the ones of other workers
+    err = StringIO.StringIO()
+    saved, sys.stderr = sys.stderr, err
+    try:
+        try:
+            if cache_dir:
+                cache = RenderCache(cache_dir, cache_size)
+            else:
+                cache = None
+            inp = open(path)
+            try:
+                raw = inp.read()
+            finally:
+                inp.close()
+            # translated once, for the key and the render
+            translated = key = None
+            if cache or stamped:
+                translated = uml_sequence.translate_diagram(raw, backend)
+                key = uml_sequence.render_key(raw, pcent, fmt, bgcolor,
+                                              backend, route, translated)
+            out = StringIO.StringIO()
+            ret = uml_sequence.run(StringIO.StringIO(raw), out, pcent, debug,
+                                   fmt, bgcolor, cache, backend, route,
+                                   translated=translated, key=key)
+            if not ret:
+                write_output(name, out.getvalue(), stamped and key)
+        except (IOError, OSError, RuntimeError), e:
+            ret = ERR_IO
+            print >>sys.stderr, "Umlsequence error: ", e
+    finally:
+        sys.stderr = saved
+
+    return path, name, ret, err.getvalue()
+
+
+def render_group(task):
+    """
+    Render several files with a single pic2plot run; runs in a worker
+    process. Return a list of (path, output, ret, messages).
+    """
+    paths, pcent, debug, fmt, bgcolor, cache_dir, cache_size, backend, \
+        route, stamped = task
+    if len(paths) == 1 or backend != "pic2plot" or route == "fit" or \
+            fmt != "ps" and len(uml_sequence.plan(fmt, pcent, bgcolor,
+                                                  route)) == 1:
+        # nothing to share between native renders, nor between pic2plot
+        # runs writing the format themselves (they only write one page),
+        # nor between pages sized to each diagram
+        return [render_file((path, pcent, debug, fmt, bgcolor,
+                             cache_dir, cache_size, backend, route, stamped))
+                for path in paths]
+
+    if cache_dir:
+        cache = RenderCache(cache_dir, cache_size)
+    else:
+        cache = None
+    metrics.set_context(input=",".join(paths))
+
+    results = {}
+    todo = []
+    for path in paths:
+        try:
+            raw = open(path).read()
+        except IOError, e:
+            results[path] = None, ERR_IO, "Umlsequence error:  %s\n" % e, \
+                None
+            continue
+        key = (cache or stamped) and uml_sequence.render_key(
+            raw, pcent, fmt, bgcolor, backend, route)
+        data = cache and cache.get(key)
+        if data is not None:
+            results[path] = data, 0, "", key
+        else:
+            todo.append((path, raw, key))
+
+    try:
+        rendered = uml_sequence.render_together(
+            [text for name, text, k in todo], pcent, debug, fmt, bgcolor)
+    except RuntimeError, e:
+        rendered = []
+        for path, raw, key in todo:
+            results[path] = None, ERR_IO, "Umlsequence error:  %s\n" % e, key
+    for (path, raw, key), (ret, data, diagnostics) in zip(todo, rendered):
+        err = StringIO.StringIO()
+        for d in diagnostics:
+            d.write(err)
+        if not ret and cache:
+            cache.put(key, data)
+        results[path] = data, ret, err.getvalue(), key
+
+    out = []
+    for path in paths:
+        data, ret, messages, key = results[path]
+        name = output_name(path, fmt)
+        if not ret:
+            try:
+                write_output(name, data, stamped and key)
+            except (IOError, OSError), e:
+                ret = ERR_IO
+                messages += "Umlsequence error:  %s\n" % e
+        out.append((path, name, ret, messages))
+    return out
+
+
+def render_multi(task):
+    """
+    Render one file to several targets (see multi.render_targets()); runs
+    in a worker process. Return a list of (path, output, ret, messages).
+    """
+    path, targets, pcent, bgcolor, cache_dir, cache_size, route, \
+        threads = task
+    metrics.set_context(input=path)
+    names = [multi.target_name(path, t, pcent, bgcolor) for t in targets]
+    try:
+        raw = open(path).read()
+        if cache_dir:
+            cache = RenderCache(cache_dir, cache_size)
+        else:
+            cache = None
+        results = multi.render_targets(raw, targets, route, cache, threads)
+    except (IOError, OSError, RuntimeError), e:
+        return [(path, name, ERR_IO, "Umlsequence error:  %s\n" % e)
+                for name in names]
+
+    out = []
+    seen = set()
+    for name, (ret, data, diagnostics) in zip(names, results):
+        err = StringIO.StringIO()
+        for d in diagnostics:
+            d.write(err)
+        if ret:
+            # e.g. a syntax error, the same for all targets
+            if (ret, err.getvalue()) in seen:
+                continue
+            seen.add((ret, err.getvalue()))
+        else:
+            try:
+                write_output(name, data)
+            except (IOError, OSError), e:
+                ret = ERR_IO
+                print >>err, "Umlsequence error: ", e
+        out.append((path, name, ret, err.getvalue()))
+    return out
+
+
+def render_paged(task):
+    """
+    Render one file in pages (see pages.render_pages()); runs in a worker
+    process. Return a list of (path, output, ret, messages).
+    """
+    path, steps, pcent, fmt, bgcolor, route, threads = task
+    name = output_name(path, fmt)
+    metrics.set_context(input=path)
+    try:
+        raw = open(path).read()
+        ret, docs, diagnostics = pages.render_pages(raw, steps, fmt, pcent,
+                                                    bgcolor, route, threads)
+        if ret:
+            err = StringIO.StringIO()
+            for d in diagnostics:
+                d.write(err)
+            return [(path, name, ret, err.getvalue())]
+        names = len(docs) > 1 and pages.page_names(name, len(docs)) \
+            or [name]
+        for page_name, data in zip(names, docs):
+            write_output(page_name, data)
+    except (IOError, OSError, RuntimeError), e:
+        return [(path, name, ERR_IO, "Umlsequence error:  %s\n" % e)]
+    return [(path, page_name, 0, "") for page_name in names]
+
+
+def report_result(report, path, name, ret, messages, debug):
+    """
+    Print the outcome and the diagnostics of the render of one file.
+    """
+    if ret:
+        print >>report, "%s: FAILED (%d)" % (path, ret)
+    elif debug:
+        print >>report, "%s: -> %s" % (path, name)
+    for line in messages.rstrip("\n").split("\n"):
+        if line:
+            print >>report, "%s: %s" % (path, line)
+
+
+def outdated(paths, built, pcent, debug, fmt, bgcolor, backend, route,
+             report):
+    """
+    Return the files of 'paths' whose output is not up to date in the
+    manifest 'built', with their render keys.
+    """
+    todo = []
+    keys = {}
+    for path in paths:
+        try:
+            raw = open(path).read()
+        except IOError:
+            # let the worker report it
+            todo.append(path)
+            continue
+        key = uml_sequence.render_key(raw, pcent, fmt, bgcolor, backend,
+                                      route)
+        if built.up_to_date(output_name(path, fmt), path, key):
+            if debug:
+                print >>report, "%s: up to date" % path
+        else:
+            todo.append(path)
+            keys[path] = key
+    return todo, keys
+
+
+def run_batch(paths, jobs, pcent, debug, fmt, bgcolor=None,
+              cache_dir=None, cache_size=None, report=None, group_size=1,
+              backend="pic2plot", route="auto", built=None, targets=None,
+              page_steps=None):
+    """
+    Render each file of 'paths' next to it, using 'jobs' worker processes,
+    each running pic2plot for up to 'group_size' files at once.
+    With a Manifest 'built', only the files that changed are rendered, and
+    the outputs of deleted files are removed.
+    With a list of multi.Target 'targets', each file is rendered to all of
+    them, instead of 'fmt' only. With 'page_steps', each file is rendered
+    in pages of as many steps (see pages.render_pages()).
+    Diagnostics are reported per file; return the highest return code.
+    """
+    report = report or sys.stderr
+    group_size = max(group_size, 1)
+    total = len(paths)
+    if built is not None:
+        paths, keys = outdated(paths, built, pcent, debug, fmt, bgcolor,
+                               backend, route, report)
+    # the CPUs left to each worker for its conversions
+    threads = max(1, multiprocessing.cpu_count()
+                  / max(1, min(jobs, len(paths))))
+    if targets:
+        worker = render_multi
+        tasks = [(path, targets, pcent, bgcolor, cache_dir, cache_size,
+                  route, threads) for path in paths]
+    elif page_steps:
+        worker = render_paged
+        tasks = [(path, page_steps, pcent, fmt, bgcolor, route, threads)
+                 for path in paths]
+    else:
+        worker = render_group
+        tasks = [(paths[i:i + group_size], pcent, debug, fmt, bgcolor,
+                  cache_dir, cache_size, backend, route, built is not None)
+                 for i in range(0, len(paths), group_size)]
+
+    if jobs <= 1 or len(tasks) <= 1:
+        pool = None
+        results = (worker(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(worker, tasks)
+
+    ret = 0
+    failed = set()
+    try:
+        for path, name, file_ret, messages in \
+                (result for group in results for result in group):
+            report_result(report, path, name, file_ret, messages, debug)
+            if file_ret:
+                failed.add(path)
+            if built is not None:
+                if file_ret or path not in keys:
+                    # render it again next time
+                    built.forget(name)
+                else:
+                    built.record(name, path, keys[path])
+            ret = max(ret, file_ret)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if built is not None:
+        for name in built.prune():
+            if debug:
+                print >>report, "%s: pruned" % name
+        try:
+            built.save()
+        except (IOError, OSError), e:
+            print >>report, "Umlsequence error: ", e
+            ret = max(ret, ERR_IO)
+
+    if failed:
+        print >>report, "Umlsequence: %d of %d diagrams failed" % (
+            len(failed), total)
+    if debug or supervisor.troubles():
+        print >>report, "Umlsequence: external programs: %s" % \
+            supervisor.summary()
+    return ret
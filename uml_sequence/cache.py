@@ -0,0 +1,258 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Persistent, content-addressed cache of rendered diagrams.
+
+Entries are plain files named after a SHA-1 key computed from everything
+that influences the rendered bytes (the PIC text fed to pic2plot, options
+and tool versions), so a hit can be served without running pic2plot or convert.
+
+The cache directory may be shared by several processes:
+ - entries are written to a temporary file and renamed into place, so a
+   reader never sees a partial entry;
+ - the total size of the entries is kept in a lock file, updated by
+   each store under an exclusive lock on it;
+ - a reader racing with an eviction just sees a miss.
+
+Eviction is LRU, bounded by the total size of the entries; the
+modification time of an entry is bumped on every hit. The cache is only
+walked when the running total exceeds the bound (or is unknown, e.g. in
+a new cache), to count the entries exactly and remove the oldest ones.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+# Default upper bound of the cache size, in bytes
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+# Temporary files older than this (in seconds) are left-overs of a crashed
+# writer, and are removed during eviction
+STALE_TMP_AGE = 3600
+
+LOCK_NAME = ".lock"
+TMP_PREFIX = ".tmp-"
+
+
+def find_tool(name):
+    """
+    Return the full path of the executable 'name' as found in the PATH,
+    or None.
+    """
+    for d in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        path = os.path.join(d, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def tool_fingerprint(name):
+    """
+    Identify the installed version of an external tool without running it:
+    path, size and modification time of its executable.
+    """
+    path = find_tool(name)
+    if path is None:
+        return "%s:missing" % name
+    st = os.stat(os.path.realpath(path))
+    return "%s:%d:%d" % (path, st.st_size, int(st.st_mtime))
+
+
+def make_key(*parts):
+    """
+    Compute a key from its parts (strings or numbers).
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if part is None:
+            part = ""
+        elif isinstance(part, unicode):
+            part = part.encode("utf-8")
+        else:
+            part = str(part)
+        h.update("%d:" % len(part))
+        h.update(part)
+    return h.hexdigest()
+
+
+class RenderCache(object):
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def key(self, *parts):
+        """
+        Compute the key of an entry from its parts (strings or numbers).
+        """
+        return make_key(*parts)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the cached bytes for 'key', or None.
+        """
+        path = self._entry_path(key)
+        try:
+            f = open(path, "rb")
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.misses += 1
+            return None
+
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        # bump LRU position; the entry may have been evicted meanwhile
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Store 'data' under 'key', then evict entries if the cache is too big.
+        """
+        d = os.path.dirname(self._entry_path(key))
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd, tmp = tempfile.mkstemp(prefix=TMP_PREFIX, dir=d)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        path = self._entry_path(key)
+        try:
+            # replaced, e.g. by a concurrent store of the same entry
+            old = os.stat(path).st_size
+        except OSError:
+            old = 0
+        os.rename(tmp, path)
+        self.stores += 1
+
+        self._account(len(data) - old)
+
+    def _lock(self):
+        fd = os.open(os.path.join(self.path, LOCK_NAME),
+                     os.O_RDWR | os.O_CREAT, 0666)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _unlock(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _account(self, delta):
+        """
+        Add 'delta' bytes to the running total kept in the lock file, and
+        evict entries if it exceeds max_size.
+        """
+        fd = self._lock()
+        try:
+            text = os.read(fd, 64).strip()
+            if text.isdigit():
+                total = int(text) + delta
+            else:
+                total = None
+            if total is None or total > self.max_size:
+                total = self._evict()
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, "%d\n" % total)
+        finally:
+            self._unlock(fd)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size.
+        """
+        fd = self._lock()
+        try:
+            total = self._evict()
+            os.ftruncate(fd, 0)
+            os.write(fd, "%d\n" % total)
+        finally:
+            self._unlock(fd)
+
+    def _evict(self):
+        # walk the cache, under the lock; return the size left
+        now = time.time()
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                if name == LOCK_NAME:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(TMP_PREFIX):
+                    if now - st.st_mtime > STALE_TMP_AGE:
+                        self._unlink(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total <= self.max_size:
+            return total
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            if self._unlink(path):
+                self.evictions += 1
+            total -= size
+        return total
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            }
@@ -0,0 +1,195 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Validation of diagrams without rendering them.
+
+The operations a diagram translates into are checked in-process, without
+running pic2plot, for:
+ - participants used but never defined, or missing;
+ - messages to or from participants already destroyed (#>, # or ~);
+ - deactivations (-) of participants that are not active, and
+   activations (+) still open at the end (a warning only);
+ - frame ends (]) without a matching begin ([), and frames never closed;
+ - connections to comments that do not exist.
+Each problem is reported with the number of its source line.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import multiprocessing
+import re
+import sys
+
+import uml_sequence
+from uml_sequence.batch import ERR_IO
+from uml_sequence.ir import RAW, PARTICIPANTS
+
+# Return code of a diagram with errors
+ERR_CHECK = 1
+
+# Positions of the participants in the arguments of each macro
+PARTICIPANT_ARGS = {
+    "message": (0, 1), "rmessage": (0, 1), "cmessage": (0, 1),
+    "dmessage": (0, 1), "active": (0,), "inactive": (0,), "complete": (0,),
+    "delete": (0,), "lconstraint": (0,), "lconstraint_below": (0,),
+    "comment": (0,), "connect_to_comment": (0,), "begin_frame": (0,),
+    "end_frame": (0,),
+    }
+
+# Macros after which their (last) participant is gone
+DESTROYING = {"dmessage": 1, "complete": 0, "delete": 0}
+
+# Macros needing a live participant; frames, comments and constraints
+# only use its position
+LIVE = ("message", "rmessage", "cmessage", "dmessage", "active", "inactive",
+        "complete", "delete")
+
+# A participant created by a PIC statement passed through as-is
+PIC_PARTICIPANT = re.compile(r"\b(?:%s)\s*\(\s*([A-Za-z_0-9]+)"
+                             % "|".join(PARTICIPANTS))
+
+
+def check_ops(ops):
+    """
+    Check a sequence of operations; return a list of Diagnostic objects.
+    """
+    problems = []
+
+    def report(lnr, message, severity="error"):
+        problems.append(uml_sequence.Diagnostic(
+                "check", message, lnr=lnr, severity=severity))
+
+    defined = set()
+    destroyed = {}    # name -> line where it was destroyed
+    active = {}       # name -> [line of each open activation]
+    frames = {}       # name -> line of its begin
+    comments = set()
+    for op in ops:
+        if op.kind == RAW:
+            defined.update(PIC_PARTICIPANT.findall(op.args[0]))
+            continue
+        if op.kind in PARTICIPANTS:
+            defined.add(op.args[0])
+            destroyed.pop(op.args[0], None)
+            continue
+
+        for i in PARTICIPANT_ARGS.get(op.kind, ()):
+            name = op.args[i]
+            if not name:
+                report(op.line, "missing participant in %s" % op.kind)
+            elif name not in defined:
+                report(op.line, "undefined participant '%s'" % name)
+                # once
+                defined.add(name)
+            elif name in destroyed and op.kind in LIVE:
+                if op.kind == "cmessage" and i == 1:
+                    # created again
+                    del destroyed[name]
+                else:
+                    report(op.line, "%s uses participant '%s', destroyed "
+                           "on line %d" % (op.kind, name, destroyed[name]))
+
+        if op.kind == "active":
+            active.setdefault(op.args[0], []).append(op.line)
+        elif op.kind == "inactive":
+            if active.get(op.args[0]):
+                active[op.args[0]].pop()
+            else:
+                report(op.line, "participant '%s' deactivated while not "
+                       "active" % op.args[0])
+        elif op.kind == "begin_frame":
+            frames[op.args[1]] = op.line
+        elif op.kind == "end_frame":
+            if frames.pop(op.args[1], None) is None:
+                report(op.line, "end of frame '%s' without a begin"
+                       % op.args[1])
+        elif op.kind == "comment":
+            comments.add(op.args[1])
+        elif op.kind == "connect_to_comment":
+            if op.args[1] not in comments:
+                report(op.line, "connection to undefined comment '%s'"
+                       % op.args[1])
+
+        if op.kind in DESTROYING:
+            name = op.args[DESTROYING[op.kind]]
+            if name in defined and name not in destroyed:
+                destroyed[name] = op.line
+
+    for name, lnr in sorted(frames.items(), key=lambda item: item[1]):
+        report(lnr, "frame '%s' is never closed" % name)
+    for name, lines in sorted(active.items()):
+        for lnr in lines:
+            report(lnr, "participant '%s' is still active at the end" % name,
+                   "warning")
+    problems.sort(key=lambda d: d.lnr)
+    return problems
+
+
+def check(inp):
+    """
+    Check the diagram read from the string or stream 'inp'; return a list
+    of Diagnostic objects.
+    """
+    return check_ops(uml_sequence.Parser(inp).ir())
+
+
+def check_file(path):
+    """
+    Check one file ('-' for stdin); runs in a worker process.
+    Return (path, ret, lines).
+    """
+    try:
+        f = path == "-" and sys.stdin or open(path)
+        try:
+            problems = check(f)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    except IOError, e:
+        return path, ERR_IO, ["%s: error: %s" % (path, e)]
+    ret = [d for d in problems if d.severity == "error"] and ERR_CHECK or 0
+    name = path == "-" and "<stdin>" or path
+    return path, ret, [u"%s:%d: %s: %s" % (name, d.lnr, d.severity,
+                                          d.message) for d in problems]
+
+
+def check_files(paths, jobs, report=None):
+    """
+    Check each file of 'paths', using 'jobs' worker processes, and print
+    the problems found as 'file:line: severity: message'; return the
+    highest return code.
+    """
+    report = report or sys.stderr
+    if jobs <= 1 or len(paths) <= 1:
+        pool = None
+        results = (check_file(path) for path in paths)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(paths)))
+        # files are small: hand them out in batches
+        results = pool.imap(check_file, paths,
+                            max(1, min(64, len(paths) / (4 * jobs))))
+
+    ret = 0
+    failed = 0
+    try:
+        for path, file_ret, lines in results:
+            for line in lines:
+                print >>report, line.encode("utf-8", "replace")
+            if file_ret:
+                failed += 1
+            ret = max(ret, file_ret)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if failed:
+        print >>report, "Umlsequence: %d of %d diagrams have errors" % (
+            failed, len(paths))
+    return ret
@@ -0,0 +1,329 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Rendering of the diagrams embedded in documentation.
+
+Markdown and reStructuredText files are scanned for umlsequence blocks:
+ - Markdown: fenced code blocks whose info string is umlsequence,
+     ```umlsequence
+     A -> B hello
+     ```
+ - reST: the umlsequence directive, or a code block in umlsequence,
+     .. code-block:: umlsequence
+
+        A -> B hello
+
+Each distinct block (by its render key, see uml_sequence.render_key())
+is rendered once, in parallel, to an image named after the key in the
+output directory. An image already there is up to date, so a run
+only renders the blocks that are new or changed.
+
+The references to the images are printed, or written into the documents,
+right after each block: an image reference that follows a block is
+updated by the next runs rather than added again.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import multiprocessing
+import os
+import re
+import StringIO
+import sys
+from collections import namedtuple
+
+import uml_sequence
+from uml_sequence import batch, manifest, metrics
+
+# Documents scanned in directories
+DOC_PATTERNS = ("*.md", "*.markdown", "*.rst")
+
+# Default output directory, in the directory of the documents
+OUTPUT_DIR = "_umlsequence"
+
+# Name of the images, from the hash of the block
+IMAGE_NAME = "umlsequence-%s.%s"
+
+MD_FENCE = re.compile(r"^( {0,3})(`{3,}|~{3,})\s*([^`\s]*)")
+RST_DIRECTIVE = re.compile(
+    r"^(\s*)\.\.\s+(?:umlsequence::\s*|"
+    r"(?:code-block|code|sourcecode)::\s*umlsequence\s*)$")
+MD_REFERENCE = re.compile(r"^\s*!\[umlsequence\]\(([^)]*)\)\s*$")
+RST_REFERENCE = re.compile(r"^\s*\.\.\s+image::\s*(\S*umlsequence-\S*)\s*$")
+
+# A block: the number of its first line (1-based) and of the line after
+# its end, its text, and the indentation of its reference
+Block = namedtuple("Block", "start end raw indent")
+
+
+def indentation(line):
+    return len(line) - len(line.lstrip())
+
+
+def markdown_blocks(lines):
+    """
+    Find the fenced umlsequence blocks of the Markdown 'lines'.
+    """
+    blocks = []
+    k = 0
+    while k < len(lines):
+        m = MD_FENCE.match(lines[k])
+        k += 1
+        if not m:
+            continue
+        indent, fence, info = m.groups()
+        body = []
+        # to the closing fence: the same characters, at least as many
+        while k < len(lines):
+            line = lines[k]
+            k += 1
+            if line.strip().startswith(fence) and \
+                    not line.strip().strip(fence[0]) and \
+                    indentation(line) < 4:
+                break
+            n = min(len(indent), indentation(line))
+            body.append(line[n:])
+        else:
+            # never closed
+            break
+        if info == "umlsequence":
+            blocks.append(Block(k - len(body) - 1, k + 1,
+                                "\n".join(body) + "\n", indent))
+    return blocks
+
+
+def rst_blocks(lines):
+    """
+    Find the umlsequence directives and code blocks of the reST 'lines'.
+    """
+    blocks = []
+    k = 0
+    while k < len(lines):
+        m = RST_DIRECTIVE.match(lines[k])
+        k += 1
+        if not m:
+            continue
+        indent = m.group(1)
+        start = k
+        # the options, then the content, indented more than the directive
+        while k < len(lines) and lines[k].strip().startswith(":") and \
+                indentation(lines[k]) > len(indent):
+            k += 1
+        while k < len(lines) and not lines[k].strip():
+            k += 1
+        body = []
+        while k < len(lines) and (not lines[k].strip() or
+                                  indentation(lines[k]) > len(indent)):
+            body.append(lines[k])
+            k += 1
+        while body and not body[-1].strip():
+            body.pop()
+            k -= 1
+        if not body:
+            continue
+        n = min([indentation(l) for l in body if l.strip()])
+        blocks.append(Block(start, k + 1,
+                            "\n".join([l[n:] for l in body]) + "\n", indent))
+    return blocks
+
+
+def find_docs(specs):
+    """
+    Expand the specifications (files, glob patterns or directories, which
+    are walked for DOC_PATTERNS) into a list of document names.
+    """
+    docs = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            found = []
+            for pattern in DOC_PATTERNS:
+                found += batch.expand_inputs([spec], pattern)
+            docs += sorted(found)
+        else:
+            docs += batch.expand_inputs([spec])
+    seen = set()
+    return [d for d in docs if not (d in seen or seen.add(d))]
+
+
+def scan(doc):
+    """
+    Return the lines of the document 'doc', and its umlsequence blocks.
+    """
+    f = open(doc)
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    if "umlsequence" not in text:
+        return None, []
+    lines = text.split("\n")
+    if doc.endswith(".rst"):
+        return lines, rst_blocks(lines)
+    return lines, markdown_blocks(lines)
+
+
+def render_block(task):
+    """
+    Render a block into the image 'name'; runs in a worker process.
+    Return (name, ret, messages).
+    """
+    raw, name, pcent, fmt, bgcolor, backend, route = task
+    metrics.set_context(input=name)
+    err = StringIO.StringIO()
+    try:
+        ret, data, diagnostics = uml_sequence.Parser(raw).render(
+            pcent, fmt, bgcolor, backend, route)
+        for d in diagnostics:
+            d.write(err)
+        if not ret:
+            batch.write_output(name, data)
+    except (IOError, OSError, RuntimeError), e:
+        ret = batch.ERR_IO
+        print >>err, "Umlsequence error: ", e
+    return name, ret, err.getvalue()
+
+
+def reference(doc, image, block):
+    """
+    The line referencing 'image' after 'block' of 'doc'.
+    """
+    rel = os.path.relpath(image, os.path.dirname(doc) or ".")
+    rel = rel.replace(os.sep, "/")
+    if doc.endswith(".rst"):
+        return "%s.. image:: %s" % (block.indent, rel)
+    return "%s![umlsequence](%s)" % (block.indent, rel)
+
+
+def rewrite(doc, lines, blocks, images):
+    """
+    Put the reference to its image after each block of 'doc' that has
+    one in 'images'; return whether the document changed.
+    """
+    pattern = doc.endswith(".rst") and RST_REFERENCE or MD_REFERENCE
+    new = list(lines)
+    # from the last block, so that the line numbers stay valid
+    for block in reversed(blocks):
+        if block not in images:
+            continue
+        ref = reference(doc, images[block], block)
+        k = block.end - 1
+        if k + 1 < len(new) and not new[k].strip() and \
+                pattern.match(new[k + 1]):
+            new[k + 1] = ref
+        elif k < len(new) and new[k].strip():
+            new[k:k] = ["", ref, ""]
+        else:
+            new[k:k] = ["", ref]
+    if new == lines:
+        return False
+    manifest.write_atomic(doc, "\n".join(new))
+    return True
+
+
+def render_docs(specs, jobs, pcent, fmt, bgcolor=None, output_dir=None,
+                backend="pic2plot", route="auto", write=False, debug=False,
+                out=None, report=None):
+    """
+    Render the umlsequence blocks of the documents named by 'specs' into
+    'output_dir' (default: OUTPUT_DIR in the directory holding them),
+    using 'jobs' worker processes. The references to the images are
+    written into the documents if 'write', else printed on 'out'.
+    Diagnostics are reported per block; return the highest return code.
+    """
+    out = out or sys.stdout
+    report = report or sys.stderr
+    docs = find_docs(specs)
+    if output_dir is None:
+        top = os.path.commonprefix([os.path.abspath(d) for d in docs])
+        top = docs and os.path.dirname(top + "x") or "."
+        output_dir = os.path.join(os.path.relpath(top), OUTPUT_DIR)
+
+    ret = 0
+    scanned = []
+    keys = {}     # block text -> key
+    images = {}   # key -> image
+    todo = {}     # image -> block text
+    for doc in docs:
+        try:
+            lines, blocks = scan(doc)
+        except IOError, e:
+            print >>report, "%s: Umlsequence error:  %s" % (doc, e)
+            ret = batch.ERR_IO
+            continue
+        if not blocks:
+            continue
+        scanned.append((doc, lines, blocks))
+        for block in blocks:
+            if block.raw not in keys:
+                keys[block.raw] = uml_sequence.render_key(
+                    block.raw, pcent, fmt, bgcolor, backend, route)
+            key = keys[block.raw]
+            if key not in images:
+                images[key] = os.path.join(output_dir,
+                                           IMAGE_NAME % (key[:16], fmt))
+                if not os.path.exists(images[key]):
+                    todo[images[key]] = block.raw
+
+    # the distinct new blocks, in parallel
+    failed = {}
+    if todo:
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        tasks = [(raw, name, pcent, fmt, bgcolor, backend, route)
+                 for name, raw in sorted(todo.items())]
+        if jobs <= 1 or len(tasks) <= 1:
+            pool = None
+            results = (render_block(task) for task in tasks)
+        else:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+            results = pool.imap_unordered(render_block, tasks)
+        try:
+            for name, block_ret, messages in results:
+                if block_ret:
+                    failed[name] = block_ret, messages
+                ret = max(ret, block_ret)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    reported = set()
+    for doc, lines, blocks in scanned:
+        done = {}
+        for block in blocks:
+            image = images[keys[block.raw]]
+            where = "%s:%d" % (doc, block.start)
+            if image in failed:
+                # where it is first found
+                if image not in reported:
+                    reported.add(image)
+                    batch.report_result(report, where, image,
+                                        failed[image][0], failed[image][1],
+                                        debug)
+                continue
+            done[block] = image
+            if not write:
+                print >>out, "%s: %s" % (where, image)
+        if write:
+            try:
+                if rewrite(doc, lines, blocks, done) and debug:
+                    print >>report, "%s: references updated" % doc
+            except (IOError, OSError), e:
+                print >>report, "%s: Umlsequence error:  %s" % (doc, e)
+                ret = max(ret, batch.ERR_IO)
+
+    if debug:
+        print >>report, "Umlsequence: %d blocks in %d documents, " \
+            "%d distinct, %d rendered" % (
+                sum([len(blocks) for doc, lines, blocks in scanned]),
+                len(scanned), len(images), len(todo))
+    if failed:
+        print >>report, "Umlsequence: %d of %d diagrams failed" % (
+            len(failed), len(images))
+    return ret
@@ -0,0 +1,45 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Intermediate representation of a translated diagram.
+
+A diagram is a sequence of operations, each one a tuple (kind, args, line):
+ - kind is the name of a sequence macro of UMLGRAPH_PIC (object, actor,
+   message, active, begin_frame, comment, ...), or COMMENT for a PIC
+   comment, or RAW for a PIC statement passed through as-is;
+ - args is a tuple of the macro arguments, in PIC syntax (labels are
+   quoted); COMMENT and RAW have the text of the line as sole argument;
+ - line is the number of the source line the operation comes from.
+
+Backends (the PIC emitter below, the native SVG backend) and passes read
+operations, so nothing downstream needs to re-parse PIC text.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+from collections import namedtuple
+
+COMMENT = "#"
+RAW = ""
+
+# Macros creating a participant
+PARTICIPANTS = ("object", "pobject", "placeholder_object", "actor")
+
+Op = namedtuple("Op", "kind args line")
+
+
+def emit_pic(ops):
+    """
+    Generate the PIC lines of a sequence of operations.
+    """
+    for op in ops:
+        if op.kind == COMMENT or op.kind == RAW:
+            yield op.args[0]
+        else:
+            yield "%s(%s);" % (op.kind, ",".join(op.args))
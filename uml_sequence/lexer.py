@@ -0,0 +1,207 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Line classifier of the alternate syntax.
+
+Each function recognizes one form of line, in a single left-to-right scan
+without backtracking, and returns the same groups as the regular
+expressions it replaces:
+
+  match_constraint   [OBJECT[OP]] [_]{CONSTRAINT}
+                     ([A-Za-z_0-9]*)([\+\-\#~!]?) *(_?)\{(.*)\}
+  match_arrow        OBJECT[OP] OP OBJECT[OP] MORE
+                     ([A-Za-z_0-9]+?)([\+\-\#~!]?) *(ARROW) *
+                     ([#A-Za-z_0-9]*)([\+\-\#~!]?) *(.*)
+  match_modifiers    OBJECT[OP] [OBJECT[OP] ...]
+                     ([A-Za-z_0-9]+[\+\-\#~!]|:)+
+  split_call         RESULT = CALL
+                     (.*?) *(=) *(.*)
+
+Like re.findall()[0], the first three find the leftmost match anywhere in
+the line; match_modifiers requires every word of the line to match.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import string
+
+IDENT = frozenset(string.ascii_letters + string.digits + "_")
+MODS = frozenset("+-#~!")
+
+
+def match_constraint(line):
+    """
+    Return (object, op, below, constraint), or None.
+    """
+    b = line.find("{")
+    if b < 0:
+        return None
+    e = line.rfind("}")
+    if e < b:
+        return None
+
+    # the match starts as far left of the brace as the prefix allows:
+    # identifier, modifier, spaces, underscore
+    s = b
+    if s > 0 and line[s - 1] == "_":
+        s -= 1
+    while s > 0 and line[s - 1] == " ":
+        s -= 1
+    if s > 0 and line[s - 1] in MODS:
+        s -= 1
+    while s > 0 and line[s - 1] in IDENT:
+        s -= 1
+
+    # split the prefix into its groups
+    i = s
+    while i < b and line[i] in IDENT:
+        i += 1
+    obj = line[s:i]
+    op = ""
+    if i < b and line[i] in MODS:
+        op = line[i]
+        i += 1
+    while i < b and line[i] == " ":
+        i += 1
+    below = line[i:b]
+
+    return obj, op, below, line[b + 1:e]
+
+
+def _run(line, i, c):
+    """
+    Index past the run of characters c starting at i.
+    """
+    n = len(line)
+    while i < n and line[i] == c:
+        i += 1
+    return i
+
+
+def _arrow_right(line, i, c, question):
+    # \??c+>  (\?? too if 'question')
+    if line.startswith("?", i):
+        i += 1
+    j = _run(line, i, c)
+    if j == i or not line.startswith(">", j):
+        return None
+    j += 1
+    if question and line.startswith("?", j):
+        j += 1
+    return j
+
+
+def _arrow_left(line, i, c, question):
+    # <c+\??  (\??<c+\?? if 'question')
+    if question and line.startswith("?", i):
+        i += 1
+    if not line.startswith("<", i):
+        return None
+    j = _run(line, i + 1, c)
+    if j == i + 1:
+        return None
+    if line.startswith("?", j):
+        j += 1
+    return j
+
+
+def _arrow(line, i):
+    """
+    Return the end of the arrow (or other operator) starting at i, or None.
+    The alternatives are tried in the order of the original expression.
+    """
+    for end in (_arrow_right(line, i, "-", False),
+                _arrow_left(line, i, "-", False),
+                _arrow_right(line, i, "=", True),
+                _arrow_left(line, i, "=", True),
+                _arrow_right(line, i, "#", False),
+                _arrow_left(line, i, "#", False),
+                _arrow_right(line, i, ":", False),
+                _arrow_left(line, i, ":", False)):
+        if end is not None:
+            return end
+
+    if line.startswith("//", i):
+        return i + 2
+    if line.startswith(":", i) or line.startswith(">", i) \
+            or line.startswith("*", i) or line.startswith("[", i) \
+            or line.startswith("]", i):
+        return i + 1
+    if line.startswith("{", i):
+        j = i + 1
+        if line.startswith("_", j):
+            j += 1
+        if line.startswith("}", j):
+            return j + 1
+    return None
+
+
+def match_arrow(line):
+    """
+    Return (left, left_op, arrow, right, right_op, more), or None.
+    """
+    n = len(line)
+    i = 0
+    while i < n:
+        if line[i] not in IDENT:
+            i += 1
+            continue
+
+        # the left object is a whole identifier, since an arrow cannot
+        # start with an identifier character
+        s = i
+        while i < n and line[i] in IDENT:
+            i += 1
+
+        for lop in (line[i:i + 1] in MODS and line[i] or None, ""):
+            if lop is None:
+                continue
+            j = _run(line, i + len(lop), " ")
+            end = _arrow(line, j)
+            if end is not None:
+                break
+        else:
+            continue
+
+        k = _run(line, end, " ")
+        r = k
+        while r < n and (line[r] in IDENT or line[r] == "#"):
+            r += 1
+        rop = ""
+        if r < n and line[r] in MODS:
+            rop = line[r]
+        m = _run(line, r + len(rop), " ")
+        return line[s:i], lop, line[j:end], line[k:r], rop, line[m:]
+
+    return None
+
+
+def match_modifiers(line):
+    """
+    Return the words of the line if all are OBJECT+, OBJECT-, ..., or ':';
+    otherwise None.
+    """
+    words = line.split()
+    for word in words:
+        if word == ":":
+            continue
+        if len(word) < 2 or word[-1] not in MODS \
+                or not IDENT.issuperset(word[:-1]):
+            return None
+    return words
+
+
+def split_call(text):
+    """
+    Return (result, '=', call), or None.
+    """
+    k = text.find("=")
+    if k < 0:
+        return None
+    return text[:k].rstrip(" "), "=", text[k + 1:].lstrip(" ")
@@ -0,0 +1,202 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Incremental translation, for editors previewing a diagram as it is typed.
+
+The PIC output of a line only depends on the line and on whether the
+first step was emitted before it (the arrow style is restored by each
+line). The objects alive only decide the end of the lifelines, after the
+last line. So each line is kept with its output, the changes it makes to
+the objects alive, and the first-step flag after it (the checkpoint).
+
+After an edit, the lines from the first changed one are translated
+again, starting from the checkpoint before it, up to the last changed
+line and then as long as the checkpoint differs from the one of the
+previous text; the other lines keep their output. Lines joined by a
+trailing '\\' are translated together. The end of the lifelines is
+rebuilt by replaying the recorded changes, without translating anything.
+
+Finding the changed lines and the positions in the output takes list
+comparisons and slices, so that the time of an update depends on the
+size of the edit, hardly on the size of the diagram.
+
+    live = LiveTranslation(text)
+    ...
+    for start, stop, lines in reversed(live.update(new_text)):
+        preview[start:stop] = lines
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+from uml_sequence import Parser, Translation
+from uml_sequence.ir import emit_pic
+
+
+class Recorder(Translation):
+    """
+    The state of the translation of a single line, recording its changes
+    to the objects alive (True to add, False to remove, and the name)
+    instead of applying them.
+    """
+
+    def __init__(self, has_first_step):
+        Translation.__init__(self)
+        self.has_first_step = has_first_step
+        self.effects = []
+
+    def add_obj(self, name):
+        self.effects.append((True, name))
+
+    def rem_obj(self, name):
+        self.effects.append((False, name))
+
+
+def common_prefix(a, b, limit):
+    """
+    Number of leading items equal in the lists 'a' and 'b', up to 'limit'.
+    """
+    lo, hi = 0, limit
+    # bisect, comparing slices
+    while lo < hi:
+        mid = (lo + hi + 1) / 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a, b, limit):
+    """
+    Number of trailing items equal in the lists 'a' and 'b', up to 'limit'.
+    """
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) / 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def joined(lines, i):
+    """
+    Tell whether the line 'i' is joined to the one before.
+    """
+    return 0 < i < len(lines) and lines[i - 1].endswith("\\")
+
+
+class LiveTranslation(object):
+    """
+    The translation of a text being edited. 'output' is the list of its
+    PIC lines, as Parser(text).ir() emits them.
+
+    Each physical line has its PIC lines, its changes to the objects alive
+    and its checkpoint; those of a line joined to the one before are
+    empty, and its checkpoint is the same.
+    """
+
+    def __init__(self, text=""):
+        self.parser = Parser("")
+        self.lines = []
+        self.pics = []
+        self.effects = []
+        self.steps = []
+        self.output = []
+        self.tail = []        # the PIC lines ending the lifelines
+        self.translated = 0   # lines translated so far
+        self.update(text)
+
+    def _translate(self, lines, lnr, first_step):
+        """
+        Translate the physical lines 'lines', joined into one line, the
+        first one being line 'lnr'; return its PIC lines, changes to the
+        objects alive, and checkpoint.
+        """
+        (n, line), = Parser('\n'.join(lines)).lines()
+        state = Recorder(first_step)
+        pic = list(emit_pic(self.parser._operations([(lnr, line)], state,
+                                                    False)))
+        self.translated += 1
+        return pic, tuple(state.effects), state.has_first_step
+
+    def _tail(self):
+        state = Translation()
+        for effects in filter(None, self.effects):
+            for add, name in effects:
+                if add:
+                    state.add_obj(name)
+                else:
+                    state.rem_obj(name)
+        state.has_first_step = bool(self.steps) and self.steps[-1]
+        return list(emit_pic(self.parser._operations([], state)))
+
+    def update(self, text):
+        """
+        Translate the new content 'text' of the diagram; return the
+        changes of the output, as (start, stop, lines) tuples where 'lines'
+        replace output[start:stop]. The positions are in the previous
+        output, and increasing: apply the changes from the last one.
+        """
+        old = self.lines
+        lines = text.split('\n')
+
+        # the lines unchanged at the start and at the end, not joined to
+        # the changed ones
+        limit = min(len(old), len(lines))
+        first = common_prefix(old, lines, limit)
+        while first and lines[first - 1].endswith("\\"):
+            # joined to the next line, at least in one of the texts
+            first -= 1
+        kept = common_suffix(old, lines, limit - first)
+        while kept and (joined(lines, len(lines) - kept)
+                        or joined(old, len(old) - kept)):
+            kept -= 1
+
+        # translate from the first changed line, then the unchanged ones
+        # until the checkpoint is the same as in the previous text
+        first_step = first and self.steps[first - 1] or False
+        pics, effects, steps = [], [], []
+        shift = len(old) - len(lines)
+        i = first
+        while i < len(lines):
+            if i >= len(lines) - kept and first_step == \
+                    (i + shift and self.steps[i + shift - 1] or False):
+                break
+            end = i + 1
+            while joined(lines, end):
+                end += 1
+            pic, effect, first_step = self._translate(lines[i:end], i + 1,
+                                                      first_step)
+            pics += [pic] + [[]] * (end - i - 1)
+            effects += [effect] + [()] * (end - i - 1)
+            steps += [first_step] * (end - i)
+            i = end
+        stop = i + shift
+
+        changes = []
+        start = sum(map(len, self.pics[:first]))
+        end = start + sum(map(len, self.pics[first:stop]))
+        pic = [line for lines_pic in pics for line in lines_pic]
+        tail_start = len(self.output) - len(self.tail)
+        if pic != self.output[start:end]:
+            changes.append((start, end, pic))
+            self.output[start:end] = pic
+        self.lines = lines
+        self.pics[first:stop] = pics
+        self.effects[first:stop] = effects
+        self.steps[first:stop] = steps
+
+        tail = self._tail()
+        if tail != self.tail:
+            changes.append((tail_start, tail_start + len(self.tail), tail))
+            self.output[len(self.output) - len(self.tail):] = tail
+            self.tail = tail
+        return changes
@@ -0,0 +1,127 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Dependency graph of the macros of the PIC prelude, so that a document only
+defines the macros it uses.
+
+The prelude is split into its settings (the top-level statements, which
+are always emitted) and its macro definitions. A macro depends on the
+macros its body calls, e.g. destroy_message on message, complete and
+drawx, and complete on extend_lifeline.
+
+Since the PIC text is translated while pic2plot reads it, the macros used
+are not known when the document starts: define_used() defines each macro,
+with the macros it depends on, just before the first operation calling
+it. pic expands a macro when it is called, so the definitions need not
+follow the order of the prelude.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import re
+
+from ir import Op, COMMENT, RAW
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z_0-9]*")
+
+
+class Prelude(object):
+    """
+    A PIC prelude: 'settings' is the text of its top-level statements and
+    comments, 'macros' maps the name of each macro to its definition
+    (preceded by its comment), 'order' lists the names in the order of the
+    prelude, and 'deps' maps each name to the set of macros it calls.
+    """
+
+    def __init__(self, text):
+        self.macros = {}
+        self.order = []
+        self.deps = {}
+
+        settings = []
+        comment = []   # the comment lines preceding a statement
+        block = None   # the lines of the definition being read
+        depth = 0
+        for line in text.split('\n'):
+            code = line.strip()
+            if block is None:
+                if code.startswith("#"):
+                    comment.append(line)
+                    continue
+                if code.startswith("define"):
+                    name = WORD.findall(code)[1]
+                    block = comment + [line]
+                    comment = []
+                else:
+                    if code or settings and settings[-1].strip():
+                        settings += comment + [line]
+                    comment = []
+            else:
+                block.append(line)
+            depth += line.count("{") - line.count("}")
+            if block is not None and depth == 0:
+                self.macros[name] = '\n'.join(block)
+                self.order.append(name)
+                block = None
+        self.settings = '\n'.join(settings + comment)
+
+        for name in self.order:
+            # the body, after "define NAME", without its comments
+            code = '\n'.join([l for l in self.macros[name].split('\n')
+                              if not l.strip().startswith("#")])
+            self.deps[name] = self.uses(code.split(name, 1)[1]) - set([name])
+
+    def closure(self, names):
+        """
+        The macros 'names' and those they depend on, in prelude order.
+        """
+        todo = [n for n in names if n in self.macros]
+        needed = set()
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo += self.deps[name]
+        return [n for n in self.order if n in needed]
+
+    def uses(self, text):
+        """
+        The names of the macros called in the PIC text 'text'.
+        """
+        return set([w for w in WORD.findall(text) if w in self.macros])
+
+
+def define_used(ops, prelude):
+    """
+    Generate the operations 'ops', preceded by RAW operations defining the
+    macros of 'prelude' as they are first called.
+    """
+    defined = set()
+    for op in ops:
+        if op.kind == COMMENT or len(defined) == len(prelude.order):
+            names = ()
+        elif op.kind != RAW:
+            names = (op.kind,)
+        else:
+            code = op.args[0].strip()
+            if code.startswith("define") or "{" in code:
+                # a definition made in a user macro, or in a block that
+                # pic may skip, may not be run: define them all now
+                names = prelude.order
+            elif code.startswith("#"):
+                names = ()
+            else:
+                names = prelude.uses(code)
+
+        names = [name for name in names if name not in defined]
+        for name in names and prelude.closure(names):
+            if name not in defined:
+                defined.add(name)
+                yield Op(RAW, (prelude.macros[name],), op.line)
+        yield op
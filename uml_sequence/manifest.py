@@ -0,0 +1,208 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Incremental builds.
+
+A manifest records, for each output file, its source file and the key it
+was rendered with (see uml_sequence.render_key(): a hash of the
+translation of the source, the options and the tool versions). An output
+whose key is unchanged is not rendered again, and the outputs whose
+source was deleted are pruned.
+
+Outputs also carry their key, so that the manifest can be rebuilt from
+them: in a tEXt chunk of a PNG, a comment of an SVG, or a DSC comment of
+a PostScript file. Other formats rely on the manifest only.
+
+Outputs are written to a temporary file renamed into place, so that no
+reader ever sees a partial file.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import errno
+import json
+import os
+import re
+import struct
+import zlib
+
+# Default name of the manifest, in the current directory
+MANIFEST_NAME = ".umlsequence-manifest"
+
+# Name of the key embedded in the outputs
+KEY_LABEL = "umlsequence-key"
+
+# How much of an output is read to find its key
+STAMP_SEARCH = 4096
+
+PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+SVG_STAMP = re.compile(r"<!-- %s: ([0-9a-f]+) -->" % KEY_LABEL)
+PS_STAMP = re.compile(r"^%%UmlsequenceKey: ([0-9a-f]+)", re.M)
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + \
+        struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def stamp(data, key):
+    """
+    Return the output 'data' with 'key' embedded, if its format allows.
+    """
+    if data.startswith(PNG_SIGNATURE):
+        # right after the IHDR chunk
+        end = 8 + 12 + struct.unpack(">I", data[8:12])[0]
+        return data[:end] + png_chunk("tEXt", "%s\0%s" % (KEY_LABEL, key)) \
+            + data[end:]
+    if data.startswith("<?xml") or data.startswith("<svg"):
+        comment = "<!-- %s: %s -->\n" % (KEY_LABEL, key)
+        if data.startswith("<?xml"):
+            end = data.index("?>") + 2
+            return data[:end] + "\n" + comment + data[end:].lstrip("\n")
+        return comment + data
+    if data.startswith("%!"):
+        end = data.index("\n") + 1
+        return data[:end] + "%%%%UmlsequenceKey: %s\n" % key + data[end:]
+    return data
+
+
+def read_stamp(name):
+    """
+    Return the key embedded in the output file 'name', or None.
+    """
+    try:
+        f = open(name, "rb")
+    except IOError:
+        return None
+    try:
+        head = f.read(STAMP_SEARCH)
+    finally:
+        f.close()
+
+    if head.startswith(PNG_SIGNATURE):
+        pos = 8
+        while pos + 8 <= len(head):
+            length, kind = struct.unpack(">I4s", head[pos:pos + 8])
+            if kind == "IDAT":
+                break
+            if kind == "tEXt":
+                label, value = head[pos + 8:pos + 8 + length].split("\0", 1)
+                if label == KEY_LABEL:
+                    return value
+            pos += 12 + length
+        return None
+    for pattern in (SVG_STAMP, PS_STAMP):
+        m = pattern.search(head)
+        if m:
+            return m.group(1)
+    return None
+
+
+def write_atomic(name, data):
+    """
+    Replace the file 'name' with 'data', so that readers see either the
+    old or the new content.
+    """
+    directory, base = os.path.split(name)
+    while True:
+        # not mkstemp, which makes it private: the mode given here is
+        # masked with the umask like for any other file created
+        tmp = os.path.join(directory, ".%s.tmp-%s" % (
+            base, os.urandom(6).encode("hex")))
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+            break
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    try:
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(tmp, name)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+class Manifest(object):
+    """
+    The outputs built, stored in the JSON file 'path'. The file names in
+    it are relative to its directory.
+    """
+
+    def __init__(self, path=MANIFEST_NAME):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        try:
+            f = open(path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.entries = {}
+        else:
+            try:
+                try:
+                    self.entries = json.load(f)
+                except ValueError:
+                    # damaged: rebuilt from the outputs
+                    self.entries = {}
+            finally:
+                f.close()
+
+    def _rel(self, name):
+        return os.path.relpath(os.path.abspath(name), self.root)
+
+    def _abs(self, name):
+        return os.path.join(self.root, name)
+
+    def up_to_date(self, output, source, key):
+        """
+        Tell whether 'output' was built from 'source' with 'key' and is
+        still there.
+        """
+        entry = self.entries.get(self._rel(output))
+        if entry is not None:
+            if entry["key"] != key or not os.path.exists(output):
+                return False
+        elif read_stamp(output) == key:
+            # rebuilt from the output itself
+            self.record(output, source, key)
+        else:
+            return False
+        return True
+
+    def record(self, output, source, key):
+        self.entries[self._rel(output)] = dict(source=self._rel(source),
+                                               key=key)
+
+    def forget(self, output):
+        self.entries.pop(self._rel(output), None)
+
+    def prune(self):
+        """
+        Remove the outputs whose source is gone; return their names.
+        """
+        pruned = []
+        for output, entry in sorted(self.entries.items()):
+            if os.path.exists(self._abs(entry["source"])):
+                continue
+            try:
+                os.unlink(self._abs(output))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            del self.entries[output]
+            pruned.append(self._abs(output))
+        return pruned
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.entries, indent=1,
+                                           sort_keys=True) + "\n")
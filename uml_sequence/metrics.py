@@ -0,0 +1,194 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Per-stage instrumentation of the rendering.
+
+Each stage of a render reports an event to the hooks registered with
+add_hook(). An event is a dict with the keys:
+  stage      translate, pic2plot, convert, native, cache or write
+  wall       elapsed time, in seconds
+  cpu        CPU time of the stage, in seconds: of the external program,
+             or of the thread running the stage in-process
+  maxrss     maximum resident set size of the external program, in KiB,
+             or None for stages run in-process
+  bytes_in   size of the input of the stage, or None if unknown
+  bytes_out  size of the output of the stage, or None if unknown
+plus the fields given to set_context() in the thread running the stage,
+such as the input file name.
+
+Nothing is measured while no hook is registered. While one is, the pipes
+between external programs are relayed in Python in order to count the
+bytes.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+FIELDS = ("stage", "wall", "cpu", "maxrss", "bytes_in", "bytes_out")
+
+# getrusage() of the calling thread only, as other threads may be
+# rendering too (Linux; the constant is missing from Python 2)
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD",
+                        sys.platform.startswith("linux") and 1 or None)
+
+_hooks = []
+_context = threading.local()
+
+
+def add_hook(hook):
+    """
+    Call hook(event) for each stage of the renders to come.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def enabled():
+    return bool(_hooks)
+
+
+def set_context(**fields):
+    """
+    Set the fields added to the events to come from the calling thread,
+    e.g. input=name.
+    """
+    _context.fields = fields
+
+
+def context():
+    """
+    The fields set by set_context() in the calling thread.
+    """
+    return dict(getattr(_context, "fields", {}))
+
+
+def emit(stage, wall, cpu, maxrss=None, bytes_in=None, bytes_out=None):
+    if not _hooks:
+        return
+    event = context()
+    event.update(stage=stage, wall=wall, cpu=cpu, maxrss=maxrss,
+                 bytes_in=bytes_in, bytes_out=bytes_out)
+    for hook in list(_hooks):
+        hook(event)
+
+
+def cpu_time():
+    if RUSAGE_THREAD is None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    else:
+        usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def emit_process(stage, start, usage, bytes_in=None, bytes_out=None):
+    """
+    Report an external program started at 'start' that just ended, given
+    its resource usage as returned by os.wait4().
+    """
+    emit(stage, time.time() - start, usage.ru_utime + usage.ru_stime,
+         usage.ru_maxrss, bytes_in, bytes_out)
+
+
+class Stage(object):
+    """
+    Context manager reporting the work done in-process within its block;
+    set its bytes_in and bytes_out attributes there if known.
+    """
+
+    def __init__(self, stage, bytes_in=None, bytes_out=None):
+        self.stage = stage
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+
+    def __enter__(self):
+        if _hooks:
+            self.wall = time.time()
+            self.cpu = cpu_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _hooks:
+            emit(self.stage, time.time() - self.wall,
+                 cpu_time() - self.cpu, None, self.bytes_in, self.bytes_out)
+
+
+def timed(stage, texts):
+    """
+    Generate the items of the iterable 'texts', reporting the time spent
+    producing them, and their total length as output, as 'stage'.
+    """
+    wall = cpu = 0.
+    size = 0
+    texts = iter(texts)
+    while True:
+        w, c = time.time(), cpu_time()
+        try:
+            text = texts.next()
+        except StopIteration:
+            break
+        finally:
+            wall += time.time() - w
+            cpu += cpu_time() - c
+        size += len(text)
+        yield text
+    emit(stage, wall, cpu, None, None, size)
+
+
+class Report(object):
+    """
+    Hook printing each event on a line, as a table row or (if 'as_json')
+    as a JSON object, on stderr or appended to the file 'name'.
+    """
+
+    HEADER = "%-10s %10s %10s %12s %12s %12s" % (
+        "stage", "wall (ms)", "cpu (ms)", "maxrss (KiB)", "bytes in",
+        "bytes out")
+
+    def __init__(self, as_json=False, name=None):
+        self.as_json = as_json
+        self.name = name
+
+    def header(self):
+        if not self.as_json:
+            self.write(self.HEADER)
+
+    def __call__(self, event):
+        if self.as_json:
+            self.write(json.dumps(event, sort_keys=True))
+            return
+
+        row = "%-10s %10.1f %10.1f %12s %12s %12s" % (
+            event["stage"], event["wall"] * 1000, event["cpu"] * 1000,
+            event["maxrss"] is None and "-" or event["maxrss"],
+            event["bytes_in"] is None and "-" or event["bytes_in"],
+            event["bytes_out"] is None and "-" or event["bytes_out"])
+        extra = [str(event[k]) for k in sorted(event) if k not in FIELDS]
+        self.write(" ".join([row] + extra))
+
+    def write(self, line):
+        if self.name is None:
+            # looked up now, as batch workers redirect it per file
+            print >>sys.stderr, line
+            return
+        # one appending write per line, so that the lines of concurrent
+        # processes do not mix
+        fd = os.open(self.name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+        try:
+            os.write(fd, line + "\n")
+        finally:
+            os.close(fd)
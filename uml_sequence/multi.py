@@ -0,0 +1,221 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Rendering of a diagram to several targets (format, zoom and background
+color) at once.
+
+The diagram is translated once, and each distinct pic2plot command runs
+once: the targets converted from PostScript share a single pic2plot run.
+The conversions then run in parallel. Bitmaps differing only by their
+zoom are rasterized once, at the largest zoom, and scaled down from that
+raster, with the resolution of their zoom. Their bytes differ from those
+of a render at their zoom, so that they are cached under keys of their
+own.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import multiprocessing
+import os
+import re
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import uml_sequence
+from uml_sequence import metrics
+from uml_sequence.cache import make_key
+
+Target = namedtuple("Target", "fmt zoom bgcolor")
+
+# Formats that are nothing but a raster, so that scaling the raster down
+# is the same as rasterizing at a lower density
+RASTER_FORMATS = ("png", "gif", "jpg", "jpeg", "bmp", "tif", "tiff", "pnm",
+                  "ppm", "pgm", "pbm", "webp")
+
+# Lossless format of the shared rasters
+INTERMEDIATE = "miff"
+
+
+def parse_target(spec, pcent=100, bgcolor=None):
+    """
+    Parse a target specification FORMAT[:ZOOM[:BACKGROUND]], the zoom and
+    the background defaulting to 'pcent' and 'bgcolor'. Raise ValueError
+    if it is invalid.
+    """
+    parts = spec.split(":", 2)
+    if not parts[0] or not parts[0].isalnum():
+        raise ValueError("invalid target format: %s" % spec)
+    if len(parts) > 1 and parts[1]:
+        if not parts[1].isdigit() or not int(parts[1]):
+            raise ValueError("invalid target zoom: %s" % spec)
+        pcent = int(parts[1])
+    if len(parts) > 2 and parts[2]:
+        bgcolor = parts[2]
+    return Target(parts[0].lower(), pcent, bgcolor)
+
+
+def target_name(path, target, pcent=100, bgcolor=None):
+    """
+    Name of the output of 'target' for the input 'path': as in batch mode,
+    with the zoom and the background appended when they are not the
+    defaults 'pcent' and 'bgcolor', e.g. diagram-200.png.
+    """
+    base = os.path.splitext(path)[0]
+    if target.zoom != pcent:
+        base += "-%d" % target.zoom
+    if target.bgcolor != bgcolor:
+        base += "-" + re.sub("[^A-Za-z0-9]", "", target.bgcolor or "none")
+    return base + "." + target.fmt
+
+
+def _run(job):
+    cmds, data, enc = job
+    stdout, stderrs = uml_sequence.execute_pipeline(cmds, [data], enc)
+    return stdout, stderrs[-1]
+
+
+def run_jobs(jobs, threads):
+    """
+    Run the pipelines of 'jobs' ((commands, input, input encoding)
+    tuples), up to 'threads' at once; return their (stdout, stderr).
+    """
+    if len(jobs) <= 1 or threads <= 1:
+        return map(_run, jobs)
+    # the events of the threads are those of the caller's input
+    fields = metrics.context()
+
+    def run(job):
+        metrics.set_context(**fields)
+        return _run(job)
+
+    pool = ThreadPool(min(threads, len(jobs)))
+    try:
+        return pool.map(run, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def render_targets(raw, targets, route="auto", cache=None, threads=None,
+                   downscale=True):
+    """
+    Render the diagram 'raw' to each of 'targets' (Target tuples),
+    running up to 'threads' conversions at once (default: one per CPU).
+    Unless 'downscale' is false, the bitmaps converted from PostScript are
+    scaled down from a raster at the largest zoom.
+    Return a list of (ret, data, diagnostics), in the order of 'targets'.
+    """
+    threads = threads or multiprocessing.cpu_count()
+    results = [None] * len(targets)
+
+    # translate once, for the keys and the renders
+    translated = uml_sequence.translate_diagram(raw)
+    text = translated.pic
+    size = route == "fit" and uml_sequence.diagram_size(translated.ops) \
+        or None
+    plans = [uml_sequence.plan(t.fmt, t.zoom, t.bgcolor, route, size)
+             for t in targets]
+
+    # the bitmaps sharing their PostScript and background, by zoom
+    groups = {}
+    for i, t in enumerate(targets):
+        if downscale and len(plans[i]) > 1 and t.fmt in RASTER_FORMATS:
+            groups.setdefault((tuple(plans[i][0]), t.bgcolor), []).append(i)
+    shared = {}   # target -> (group key, largest zoom)
+    for key, members in groups.items():
+        if len(members) > 1:
+            zoom = max([targets[i].zoom for i in members])
+            for i in members:
+                shared[i] = key, zoom
+
+    if cache is not None:
+        keys = []
+        for i, t in enumerate(targets):
+            key = uml_sequence.render_key(raw, t.zoom, t.fmt, t.bgcolor,
+                                          "pic2plot", route, translated)
+            if i in shared and t.zoom != shared[i][1]:
+                # not the bytes of a render at this zoom
+                key = make_key(key, "scaled", shared[i][1])
+            keys.append(key)
+            with metrics.Stage("cache", len(raw)) as stage:
+                data = cache.get(key)
+                stage.bytes_out = data is not None and len(data) or None
+            if data is not None:
+                results[i] = 0, data, []
+    todo = [i for i in range(len(targets)) if results[i] is None]
+    if not todo:
+        return results
+
+    # each distinct pic2plot command once
+    firsts = sorted(set([tuple(plans[i][0]) for i in todo]))
+    outputs = dict(zip(firsts, run_jobs(
+                [([list(cmd)], text, "latin1") for cmd in firsts], threads)))
+
+    def fail(i, ret, diagnostic):
+        results[i] = ret, None, [diagnostic]
+
+    converts = []
+    for i in todo:
+        ps, err = outputs[tuple(plans[i][0])]
+        if err:
+            fail(i, 1, uml_sequence.pic_error(err, text))
+        elif len(plans[i]) == 1:
+            results[i] = 0, ps, []
+        else:
+            converts.append(i)
+
+    # rasterize the shared bitmaps, at the largest zoom of their group
+    # (even if that target was cached), and convert the rest, from
+    # PostScript
+    masters = sorted(set([shared[i] for i in converts if i in shared]))
+    jobs = []
+    for key, zoom in masters:
+        k = [k for k in groups[key] if targets[k].zoom == zoom][0]
+        cmd = plans[k][1][:-1] + [INTERMEDIATE + ":-"]
+        jobs.append(([cmd], outputs[key[0]][0], None))
+    direct = [i for i in converts if i not in shared]
+    jobs += [([plans[i][1]], outputs[tuple(plans[i][0])][0], None)
+             for i in direct]
+    done = run_jobs(jobs, threads)
+    rasters = dict(zip(masters, done))
+    for i, (data, err) in zip(direct, done[len(masters):]):
+        if err:
+            fail(i, 2, uml_sequence.Diagnostic("convert", err))
+        else:
+            results[i] = 0, data, []
+
+    # then encode or scale down each of the shared bitmaps
+    jobs = []
+    scaled = []
+    for i in converts:
+        if i not in shared:
+            continue
+        zoom = shared[i][1]
+        raster, err = rasters[shared[i]]
+        if err:
+            fail(i, 2, uml_sequence.Diagnostic("convert", err))
+            continue
+        cmd = ["convert", INTERMEDIATE + ":-"]
+        if targets[i].zoom != zoom:
+            # the pixels and the resolution of the zoom
+            cmd += ["-resize", "%.4g%%" % (100. * targets[i].zoom / zoom),
+                    "-density", "%dx%d" % (targets[i].zoom, targets[i].zoom)]
+        jobs.append(([cmd + [targets[i].fmt + ":-"]], raster, None))
+        scaled.append(i)
+    for i, (data, err) in zip(scaled, run_jobs(jobs, threads)):
+        if err:
+            fail(i, 2, uml_sequence.Diagnostic("convert", err))
+        else:
+            results[i] = 0, data, []
+
+    if cache is not None:
+        for i in todo:
+            if not results[i][0]:
+                cache.put(keys[i], results[i][1])
+    return results
@@ -0,0 +1,220 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Pagination of large diagrams.
+
+The operations of a diagram are cut, between source lines, into pages of
+a given number of steps (the messages and the explicit steps). Each page
+is a diagram of its own:
+ - it starts with the participants declared so far, in their columns:
+   those alive are drawn again, the others (not created yet, or
+   destroyed) are placeholders;
+ - the activations still open are carried over, by setting the active_
+   levels of the participants, so that their boxes continue without a
+   top edge; the open frames are begun again;
+ - it ends by closing the open frames and extending the lifelines to its
+   bottom, without the bottom edges of the active boxes.
+The PIC assignments and definitions met so far are repeated on each page.
+
+The pages are rendered concurrently, and come out as a multi-page PDF,
+or as one document per page.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import multiprocessing
+import os
+import re
+
+import uml_sequence
+from uml_sequence import metrics
+from uml_sequence.ir import Op, RAW, PARTICIPANTS
+from uml_sequence.multi import INTERMEDIATE, run_jobs
+
+# Macros moving down by one step, the messages first
+STEPS = ("message", "rmessage", "cmessage", "dmessage", "step")
+
+# PIC statements repeated on each page
+SETTING = re.compile(r"^\s*(define\b|[A-Za-z_][A-Za-z_0-9]*\s*=)")
+
+
+def closers(ops):
+    """
+    Map the index of each begin_frame operation of 'ops' to the
+    end_frame operation closing it, if any.
+    """
+    found = {}
+    opened = {}   # frame name -> indexes of its begins not closed yet
+    for k, op in enumerate(ops):
+        if op.kind == "begin_frame":
+            opened.setdefault(op.args[1], []).append(k)
+        elif op.kind == "end_frame" and opened.get(op.args[1]):
+            found[opened[op.args[1]].pop()] = op
+    return found
+
+
+def paginate(ops, steps):
+    """
+    Split the operations 'ops' of a diagram into pages of at least
+    'steps' steps each (the last one may have less), cut between source
+    lines; return the list of the operations of each page.
+    """
+    ops = list(ops)
+    ends = closers(ops)
+    # pages start with a line moving down (the lines ending activations
+    # or frames stay on the page before), and have messages
+    stepping = set([op.line for op in ops if op.kind in STEPS])
+    left = [0] * (len(ops) + 1)
+    for k in range(len(ops) - 1, -1, -1):
+        left[k] = left[k + 1] + (ops[k].kind in STEPS[:-1])
+    pages = []
+    page = []
+    declared = []   # participants and settings, in order
+    columns = set()
+    drawn = {}      # participant -> operation drawing it alive
+    alive = []
+    active = {}     # participant -> level of activation
+    frames = []     # (index, operation) of the open frames
+    comments = set()
+    count = 0
+    line = None
+    for k, op in enumerate(ops):
+        if count >= steps and op.line != line and op.line in stepping \
+                and left[k]:
+            # end this page
+            page.append(Op("step", (), line))
+            for i, begin in reversed(frames):
+                if i in ends:
+                    page.append(Op("end_frame", (ends[i].args[0],
+                                                 begin.args[1]), line))
+            page += [Op("extend_lifeline", (name,), line) for name in alive]
+            pages.append(page)
+
+            # and start the next one
+            page = []
+            for decl in declared:
+                if decl.kind == RAW:
+                    page.append(decl)
+                elif decl.args[0] in alive:
+                    page.append(drawn[decl.args[0]])
+                else:
+                    page.append(Op("pobject", decl.args[:1], decl.line))
+            page += [Op(RAW, ("active_%s = %d;" % (name, active[name]),),
+                        op.line) for name in alive if active.get(name, 0) > 0]
+            page.append(Op("step", (), op.line))
+            page += [begin for i, begin in frames]
+            comments = set()
+            count = 0
+
+        if op.kind in PARTICIPANTS:
+            name = op.args[0]
+            if name not in columns:
+                columns.add(name)
+                declared.append(op)
+            if op.kind in ("object", "actor"):
+                drawn[name] = op
+                if name not in alive:
+                    alive.append(name)
+        elif op.kind == RAW and SETTING.match(op.args[0]):
+            declared.append(op)
+        elif op.kind == "cmessage":
+            name = op.args[1]
+            drawn[name] = Op("object", (name, op.args[2]), op.line)
+            if name not in alive:
+                alive.append(name)
+        elif op.kind in ("dmessage", "complete", "delete"):
+            name = op.args[op.kind == "dmessage" and 1 or 0]
+            if name in alive:
+                alive.remove(name)
+        elif op.kind == "active":
+            active[op.args[0]] = active.get(op.args[0], 0) + 1
+        elif op.kind == "inactive":
+            active[op.args[0]] = active.get(op.args[0], 0) - 1
+        elif op.kind == "begin_frame":
+            frames.append((k, op))
+        elif op.kind == "end_frame":
+            opened = [f for f in frames if f[1].args[1] == op.args[1]]
+            if opened:
+                frames.remove(opened[-1])
+        elif op.kind == "comment" and op.args[1]:
+            comments.add(op.args[1])
+        elif op.kind == "connect_to_comment" and op.args[1] not in comments:
+            # the comment is on a previous page
+            continue
+
+        if op.kind in STEPS:
+            count += 1
+        line = op.line
+        page.append(op)
+
+    pages.append(page)
+    return pages
+
+
+def page_names(name, count):
+    """
+    Names of the outputs of 'count' pages rendered to the file 'name',
+    e.g. diagram-page1.png; zero-padded so that they sort in order.
+    """
+    base, ext = os.path.splitext(name)
+    width = len(str(count))
+    return ["%s-page%0*d%s" % (base, width, k, ext)
+            for k in range(1, count + 1)]
+
+
+def render_pages(raw, steps, fmt, pcent=100, bgcolor=None, route="auto",
+                 threads=None):
+    """
+    Render the diagram 'raw' in pages of 'steps' steps, up to 'threads'
+    pages at once (default: one per CPU). A PDF is a single document
+    holding all the pages; other formats make a document per page.
+    Return (ret, documents, diagnostics), documents being None unless
+    ret is 0.
+    """
+    threads = threads or multiprocessing.cpu_count()
+    parser = uml_sequence.Parser(raw)
+    with metrics.Stage("translate", len(raw)) as stage:
+        pages = paginate(parser.ir(), steps)
+        texts = [u"".join(uml_sequence.pic_document(parser.pic(page)))
+                 for page in pages]
+        stage.bytes_out = sum(map(len, texts))
+
+    # a PDF is assembled from the rasters of its pages
+    plans = []
+    for page in pages:
+        size = route == "fit" and uml_sequence.diagram_size(page) or None
+        plans.append(uml_sequence.plan(fmt == "pdf" and INTERMEDIATE or fmt,
+                                       pcent, bgcolor, route, size))
+
+    docs = []
+    outputs = run_jobs([([cmds[0]], text, "latin1")
+                        for cmds, text in zip(plans, texts)], threads)
+    for k, (ps, err) in enumerate(outputs):
+        if err:
+            diagnostic = uml_sequence.pic_error(err, texts[k])
+            diagnostic.message = " page %d:%s" % (k + 1, diagnostic.message)
+            return 1, None, [diagnostic]
+        docs.append(ps)
+
+    converts = [k for k, cmds in enumerate(plans) if len(cmds) > 1]
+    outputs = run_jobs([([plans[k][1]], docs[k], None) for k in converts],
+                       threads)
+    for k, (data, err) in zip(converts, outputs):
+        if err:
+            return 2, None, [uml_sequence.Diagnostic("convert", err)]
+        docs[k] = data
+
+    if fmt == "pdf":
+        # the rasters follow each other in a single MIFF stream
+        (data, err), = run_jobs([([["convert", INTERMEDIATE + ":-",
+                                    "pdf:-"]], "".join(docs), None)], 1)
+        if err:
+            return 2, None, [uml_sequence.Diagnostic("convert", err)]
+        docs = [data]
+    return 0, docs, []
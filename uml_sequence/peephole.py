@@ -0,0 +1,85 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Peephole optimizer of the operations sent to pic2plot, leaving the image
+unchanged:
+ - the comments echoing and tracing each source line are dropped;
+ - a sync() directly followed by an async(), or the reverse, is dropped
+   when it leaves the arrow style as it found it: the pair restores
+   arrowwid in any case, and arrowhead if the pair started in the style
+   it ends in;
+ - a run of step() calls becomes a single move of the same length.
+
+PIC lines passed through from the input may change the arrow style, so
+no pair is dropped across them.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+from ir import Op, COMMENT, RAW
+
+# arrowhead after each toggle
+TOGGLES = {"async": 0, "sync": 1}
+
+
+def merge_steps(ops):
+    """
+    Replace each run of step() operations with a single move.
+    """
+    run = []
+    for op in ops:
+        if op.kind == "step":
+            run.append(op)
+            continue
+        if len(run) > 1:
+            yield Op(RAW, ("down; move spacing * %d;" % len(run),),
+                     run[0].line)
+        elif run:
+            yield run[0]
+        run = []
+        yield op
+    if len(run) > 1:
+        yield Op(RAW, ("down; move spacing * %d;" % len(run),), run[0].line)
+    elif run:
+        yield run[0]
+
+
+def drop_toggles(ops):
+    """
+    Drop the sync()/async() pairs that change nothing.
+    """
+    head = None      # arrowhead, if known
+    pending = None   # a toggle, held until the next operation is known
+    before = None    # arrowhead before the pending toggle
+    for op in ops:
+        if pending is not None:
+            if op.kind in TOGGLES and op.kind != pending.kind \
+                    and before == TOGGLES[op.kind]:
+                pending = None
+                head = before
+                continue
+            yield pending
+            pending = None
+        if op.kind in TOGGLES:
+            pending, before = op, head
+            head = TOGGLES[op.kind]
+            continue
+        if op.kind == RAW:
+            head = None
+        yield op
+    if pending is not None:
+        yield pending
+
+
+def optimize(ops):
+    """
+    Generate the operations 'ops', optimized.
+    """
+    ops = (op for op in ops if op.kind != COMMENT)
+    return merge_steps(drop_toggles(ops))
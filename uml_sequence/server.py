@@ -0,0 +1,238 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Render server, keeping the module loaded between renders.
+
+Requests and responses are JSON objects, one per line, exchanged over a
+Unix-domain socket (several requests may be sent on a connection) or over
+stdin/stdout. A request is:
+  {"id": ..., "source": TEXT, "format": "ps", "zoom": 100,
+   "background": "white", "backend": "pic2plot", "route": "auto"}
+where all but "source" are optional; the response is:
+  {"id": ..., "ret": RETURN_CODE, "data": BASE64_IMAGE, "messages": TEXT}
+"data" being null unless the return code is 0.
+
+Requests are rendered concurrently by a bounded pool of threads, most of
+the time being spent waiting for pic2plot and convert.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import base64
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import StringIO
+import sys
+import threading
+
+import uml_sequence
+from uml_sequence.batch import ERR_IO
+from uml_sequence.cache import RenderCache
+
+# Values of the omitted request fields
+DEFAULTS = dict(format="ps", zoom=100, background="white",
+                backend="pic2plot", route="auto")
+
+# Return code of a malformed request
+ERR_REQUEST = 2
+
+
+def error(request_id, message, ret=ERR_REQUEST):
+    return dict(id=request_id, ret=ret, data=None,
+                messages="Umlsequence error:  %s\n" % message)
+
+
+def check(params):
+    """
+    Return what is wrong with the parameters of a request, or None.
+    """
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        return "unknown request fields: %s" % ", ".join(sorted(unknown))
+    if not isinstance(params["zoom"], (int, long)) or params["zoom"] <= 0:
+        return "zoom must be a positive integer"
+    if params["backend"] not in ("pic2plot", "native"):
+        return "unknown backend: %s" % params["backend"]
+    if params["route"] not in uml_sequence.ROUTES:
+        return "unknown route: %s" % params["route"]
+    if not isinstance(params["format"], basestring) \
+            or not params["format"].isalnum():
+        return "invalid format: %r" % (params["format"],)
+    # no option of convert in disguise
+    if not isinstance(params["background"], basestring) \
+            or params["background"].startswith("-"):
+        return "invalid background: %r" % (params["background"],)
+    return None
+
+
+def render_request(request, cache_dir=None, cache_size=None):
+    """
+    Render one request; return the response.
+    """
+    params = dict(DEFAULTS)
+    params.update(request)
+    request_id = params.pop("id", None)
+    source = params.pop("source", None)
+    if not isinstance(source, basestring):
+        return error(request_id, "no source in request")
+    problem = check(params)
+    if problem:
+        return error(request_id, problem)
+    if isinstance(source, unicode):
+        source = source.encode("utf-8")
+
+    diagnostics = []
+    try:
+        if cache_dir:
+            cache = RenderCache(cache_dir, cache_size)
+        else:
+            cache = None
+        out = StringIO.StringIO()
+        ret = uml_sequence.run(StringIO.StringIO(source), out,
+                               params["zoom"], False, params["format"],
+                               params["background"], cache,
+                               params["backend"], params["route"],
+                               diagnostics)
+    except Exception, e:
+        # keep serving whatever happens with one request
+        return error(request_id, e, ERR_IO)
+
+    return dict(id=request_id, ret=ret,
+                data=not ret and base64.b64encode(out.getvalue()) or None,
+                messages=u"".join([d.text() for d in diagnostics]))
+
+
+class Server(object):
+    """
+    Render requests, up to 'jobs' at once.
+    """
+
+    def __init__(self, jobs, cache_dir=None, cache_size=None):
+        self.jobs = max(jobs, 1)
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.workers = threading.BoundedSemaphore(self.jobs)
+
+    def render(self, line):
+        """
+        Render a request line; return the response.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError, e:
+            return error(None, "invalid request: %s" % e)
+        if not isinstance(request, dict):
+            return error(None, "invalid request: not an object")
+        with self.workers:
+            return render_request(request, self.cache_dir, self.cache_size)
+
+    def serve_stdio(self, inp=None, out=None):
+        """
+        Read requests from 'inp' until its end, and write the responses
+        to 'out', in the order they are rendered.
+        """
+        inp = inp or sys.stdin
+        out = out or sys.stdout
+        lock = threading.Lock()
+        # stop reading while all workers are busy and as many requests wait
+        pending = threading.BoundedSemaphore(2 * self.jobs)
+
+        def respond(line):
+            try:
+                response = self.render(line)
+                with lock:
+                    out.write(json.dumps(response) + "\n")
+                    out.flush()
+            finally:
+                pending.release()
+
+        for line in iter(inp.readline, ""):
+            if not line.strip():
+                continue
+            pending.acquire()
+            t = threading.Thread(target=respond, args=(line,))
+            t.daemon = True
+            t.start()
+
+        # wait for the last responses
+        for i in range(2 * self.jobs):
+            pending.acquire()
+
+    def serve_unix(self, path):
+        """
+        Accept connections on the Unix-domain socket 'path' until
+        interrupted, each one sending request lines.
+        """
+        server = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, ""):
+                    if line.strip():
+                        response = server.render(line)
+                        self.wfile.write(json.dumps(response) + "\n")
+                        self.wfile.flush()
+
+        listener = SocketServer.ThreadingUnixStreamServer(path, Handler)
+        listener.daemon_threads = True
+        try:
+            listener.serve_forever()
+        finally:
+            listener.server_close()
+            os.unlink(path)
+
+
+def remove_stale_socket(path):
+    """
+    Remove the socket 'path' left by a server that is gone; fail if a
+    server still listens on it.
+    """
+    if not os.path.exists(path):
+        return
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            s.connect(path)
+        except socket.error, e:
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                raise
+            os.unlink(path)
+            return
+    finally:
+        s.close()
+    raise RuntimeError("a server is already listening on %s" % path)
+
+
+def serve(address, jobs, cache_dir=None, cache_size=None):
+    """
+    Serve on the Unix-domain socket 'address', or on stdin/stdout if it
+    is '-'.
+    """
+    if address != "-":
+        try:
+            remove_stale_socket(address)
+        except (RuntimeError, socket.error), e:
+            print >>sys.stderr, "Umlsequence error: ", e
+            return ERR_IO
+
+    server = Server(jobs, cache_dir, cache_size)
+    # exit cleanly (removing the socket) when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if address == "-":
+            server.serve_stdio()
+        else:
+            server.serve_unix(address)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    return 0
@@ -0,0 +1,351 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Supervision of the external programs (pic2plot, convert).
+
+configure() sets, for the programs started from then on:
+ - a wall-clock timeout per stage (the name of the program): a program
+   running longer is sent SIGTERM, then SIGKILL after GRACE seconds,
+   together with the programs it started (e.g. the Ghostscript run by
+   convert);
+ - caps on the address space and the CPU time of each program;
+ - a cap on the number of programs running at once, shared by the worker
+   processes forked afterwards. A pipeline takes as many slots as it has
+   programs (up to the cap) before it starts, one pipeline at a time, so
+   that no two pipelines each hold some slots while waiting for more. A
+   pipeline longer than the cap takes them all, and runs all its
+   programs. The slots held by a worker process that died are taken
+   back by the processes waiting for them.
+
+The programs are started through wrapper commands of util-linux, so that
+no Python code runs in the child between fork and exec, which may
+deadlock in a multi-threaded process: prlimit sets the caps, and setsid
+puts a program with a timeout in a session (and process group) of its
+own. Both exec the program in the same process.
+
+The programs are reaped with reap(), and signalled with kill(), which
+never signals a program already reaped, since its pid may have been
+given to another process by then.
+
+A program killed by a timeout or by a signal has the reason appended to
+its stderr, so that its stage is reported as failed. The outcome of each
+program (ok, failed, timeout or killed) is counted per stage, in counters
+shared with the worker processes, once configure() has been called; see
+counts() and summary().
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import errno
+import multiprocessing
+import os
+import signal
+import threading
+
+from cache import find_tool
+
+# Seconds between SIGTERM and SIGKILL
+GRACE = 1.0
+
+# Seconds between the checks for slots held by dead processes, while
+# waiting for one
+RECLAIM = 1.0
+
+STAGES = ("pic2plot", "convert", "other")
+OUTCOMES = ("ok", "failed", "timeout", "killed")
+
+# Signals sent by the kernel when a limit is exceeded
+LIMIT_SIGNALS = {signal.SIGXCPU: "CPU time limit",
+                 signal.SIGKILL: "killed, e.g. out of memory",
+                 signal.SIGSEGV: "crashed, e.g. out of memory"}
+
+_timeouts = {}     # stage (None: any) -> seconds
+_memory = None     # bytes
+_cpu = None        # seconds
+_slots = None
+_capacity = None
+_gate = None
+_holders = None    # pid holding the gate, then each slot (0: none)
+_counts = None     # shared counters of the outcomes, see configure()
+
+
+def configure(timeouts=None, memory=None, cpu=None, processes=None):
+    """
+    Supervise the programs started from now on: 'timeouts' maps stages
+    (None for the others) to seconds, 'memory' caps the address space of
+    each program in bytes, 'cpu' its CPU time in seconds, and 'processes'
+    the number of programs running at once. Call it before forking the
+    worker processes that are to share the cap and the counters.
+    Raise ValueError if a wrapper command it needs is not installed.
+    """
+    global _timeouts, _memory, _cpu, _slots, _capacity, _gate, _holders
+    global _counts
+    for tool, needed in (("setsid", timeouts), ("prlimit", memory or cpu)):
+        if needed and find_tool(tool) is None:
+            raise ValueError("'%s' (util-linux) is needed to supervise "
+                             "the programs, and is not installed" % tool)
+    if _counts is None:
+        _counts = multiprocessing.Array("l", len(STAGES) * len(OUTCOMES))
+    _timeouts = dict(timeouts or {})
+    _memory = memory
+    _cpu = cpu
+    if processes:
+        _slots = multiprocessing.BoundedSemaphore(processes)
+        _gate = multiprocessing.Lock()
+        _holders = multiprocessing.Array("i", 1 + processes)
+        _capacity = processes
+    else:
+        _slots = _gate = _holders = _capacity = None
+
+
+def stage_of(cmd):
+    name = os.path.basename(cmd[0])
+    return name in STAGES and name or "other"
+
+
+def wrap(cmd):
+    """
+    The command running 'cmd' supervised: 'cmd' itself if there is no
+    limit, else 'cmd' run through the wrapper commands.
+    """
+    wrapper = []
+    if _timeouts:
+        # killed with the programs it starts
+        wrapper.append("setsid")
+    if _memory or _cpu:
+        wrapper.append("prlimit")
+        if _memory:
+            wrapper.append("--as=%d" % _memory)
+        if _cpu:
+            # SIGXCPU at the limit, SIGKILL a second later
+            wrapper.append("--cpu=%d:%d" % (_cpu, _cpu + 1))
+        wrapper.append("--")
+    return wrapper + list(cmd)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _reclaim():
+    # give back the gate and the slots held by the processes that died
+    with _holders.get_lock():
+        for k, pid in enumerate(_holders):
+            if pid and not _alive(pid):
+                _holders[k] = 0
+                (k and _slots or _gate).release()
+
+
+def _take(sem, first, last):
+    # wait for 'sem', and note this process in a free entry of _holders
+    while not sem.acquire(True, RECLAIM):
+        _reclaim()
+    with _holders.get_lock():
+        k = _holders[first:last].index(0) + first
+        _holders[k] = os.getpid()
+
+
+def _give(sem, first, last):
+    with _holders.get_lock():
+        k = _holders[first:last].index(os.getpid()) + first
+        _holders[k] = 0
+        sem.release()
+
+
+def acquire(n):
+    """
+    Wait for 'n' slots (at most the cap) to run programs; return the
+    number taken, to be given back with release().
+    """
+    if _slots is None:
+        return 0
+    n = min(n, _capacity)
+    taken = 0
+    try:
+        # one pipeline at a time takes its slots
+        _take(_gate, 0, 1)
+        try:
+            while taken < n:
+                _take(_slots, 1, 1 + _capacity)
+                taken += 1
+        finally:
+            _give(_gate, 0, 1)
+    except:
+        release(taken)
+        raise
+    return n
+
+
+def release(n):
+    for i in range(n):
+        _give(_slots, 1, 1 + _capacity)
+
+
+def track(p):
+    """
+    Prepare the process 'p' just started for reap() and kill().
+    """
+    p.reap_lock = threading.Lock()
+    p.reaped = None    # (status, resource usage) once reaped
+
+
+def reap(p):
+    """
+    Wait for the process 'p'; return its status and resource usage, as
+    os.wait4() does.
+    """
+    while True:
+        try:
+            pid, status, rusage = os.wait4(p.pid, 0)
+            break
+        except OSError, e:
+            if e.errno == errno.ECHILD:
+                # reaped by kill()
+                pid = None
+                break
+            if e.errno != errno.EINTR:
+                raise
+    with p.reap_lock:
+        if pid:
+            p.reaped = status, rusage
+        return p.reaped
+
+
+def kill(p, signum, group=False):
+    """
+    Send 'signum' to the process 'p', or to its process group if 'group',
+    unless it was reaped: its pid may be another process's by then.
+    """
+    with p.reap_lock:
+        if p.reaped is None:
+            # an exited process not reaped yet keeps its pid: reap it
+            # here if so, rather than signal it after reap() did
+            try:
+                pid, status, rusage = os.wait4(p.pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno != errno.ECHILD:
+                    raise
+                # reap() returned, and is waiting for the lock
+                return
+            if pid:
+                p.reaped = status, rusage
+        if p.reaped is not None:
+            return
+        try:
+            if group:
+                os.killpg(p.pid, signum)
+            else:
+                os.kill(p.pid, signum)
+        except OSError:
+            # gone meanwhile
+            pass
+
+
+class Watchdog(object):
+    """
+    Kill the process 'p' if it runs longer than the timeout of its stage;
+    stop() once it is reaped.
+    """
+
+    def __init__(self, p, stage):
+        self.p = p
+        self.timeout = _timeouts.get(stage, _timeouts.get(None))
+        self.fired = False
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        if self.timeout:
+            t = threading.Thread(target=self.run)
+            t.daemon = True
+            t.start()
+
+    def run(self):
+        if self.done.wait(self.timeout):
+            return
+        with self.lock:
+            self.fired = not self.done.is_set()
+        self.kill(signal.SIGTERM)
+        if not self.done.wait(GRACE):
+            self.kill(signal.SIGKILL)
+
+    def kill(self, signum):
+        with self.lock:
+            if self.done.is_set():
+                return
+        kill(self.p, signum, True)
+
+    def stop(self):
+        with self.lock:
+            self.done.set()
+
+
+def outcome(stage, p, watchdog, stderr):
+    """
+    Count the outcome of the reaped process 'p'; return the text to
+    append to its 'stderr', if it was killed.
+    """
+    note = ""
+    if watchdog.fired:
+        kind = "timeout"
+        note = "%s: killed after %gs (timeout)\n" % (stage, watchdog.timeout)
+    elif p.returncode < 0 and -p.returncode != signal.SIGPIPE:
+        kind = "killed"
+        note = "%s: killed by signal %d (%s)\n" % (
+            stage, -p.returncode,
+            LIMIT_SIGNALS.get(-p.returncode, "signal"))
+    elif p.returncode or stderr:
+        kind = "failed"
+    else:
+        kind = "ok"
+    if _counts is not None:
+        k = STAGES.index(stage) * len(OUTCOMES) + OUTCOMES.index(kind)
+        with _counts.get_lock():
+            _counts[k] += 1
+    return note
+
+
+def counts():
+    """
+    The outcomes of the programs run so far, by this process and the
+    processes forked from it, as {stage: {outcome: count}}; all zero
+    unless configure() was called.
+    """
+    if _counts is None:
+        values = [0] * (len(STAGES) * len(OUTCOMES))
+    else:
+        with _counts.get_lock():
+            values = list(_counts)
+    return dict([(stage, dict(zip(OUTCOMES, values[i * len(OUTCOMES):
+                                                   (i + 1) * len(OUTCOMES)])))
+                 for i, stage in enumerate(STAGES)])
+
+
+def troubles():
+    """
+    Number of programs killed so far, by a timeout or a signal.
+    """
+    return sum([c["timeout"] + c["killed"] for c in counts().values()])
+
+
+def summary():
+    """
+    The counts as a line of text, e.g. "pic2plot: 12 ok, 1 failed;
+    convert: 11 ok, 1 timeout".
+    """
+    parts = []
+    all = counts()
+    for stage in STAGES:
+        found = ["%d %s" % (all[stage][o], o) for o in OUTCOMES
+                 if all[stage][o]]
+        if found:
+            parts.append("%s: %s" % (stage, ", ".join(found)))
+    return "; ".join(parts) or "no programs run"
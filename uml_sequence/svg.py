@@ -0,0 +1,670 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Native SVG backend: draws the translated diagram in-process, without
+pic2plot nor convert.
+
+It interprets the operations calling the sequence macros of UMLGRAPH_PIC
+(object, actor, message, active, ...) and reproduces their geometry, following
+pic's conventions: positions are in inches, y grows upwards, objects are
+laid out in the current direction starting at the current position (Here).
+
+Only the macro calls (and assignments of numeric parameters such as
+boxwid) are understood; any other PIC statement is rejected.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import re
+from xml.sax.saxutils import escape, quoteattr
+
+from ir import COMMENT, RAW
+
+# Revision of the drawing, in the keys of the native renders: to be
+# increased whenever a change of this module changes the output
+REVISION = 1
+
+
+class NativeError(RuntimeError):
+    pass
+
+
+# pic's defaults, as redefined by UMLGRAPH_PIC's prelude
+DEFAULTS = {
+    "boxwid": .75,
+    "boxht": .3,
+    "movewid": .5,
+    "moveht": .5,
+    "linewid": .5,
+    "lineht": .5,
+    "arrowwid": .05,
+    "arrowht": .1,
+    "dashwid": .05,
+    "spacing": .25,
+    "awid": .1,
+    "corner_fold": .1,
+    "comment_default_ht": .5,
+    "comment_default_wid": 1.,
+    }
+
+# Text metrics, in inches
+TEXT_HT = .16
+CHAR_WID = .077
+FONT_SIZE = .13
+
+MARGIN = .1
+
+CREATE = u"\u00abcreate\u00bb"
+DESTROY = u"\u00abdestroy\u00bb"
+
+DIRECTIONS = {
+    "right": (1, 0),
+    "left": (-1, 0),
+    "up": (0, 1),
+    "down": (0, -1),
+    }
+
+CALL_RE = re.compile(r"^([A-Za-z_][A-Za-z_0-9]*) *\((.*)\) *;?(?: *#.*)?$")
+ASSIGN_RE = re.compile(
+    r"^([A-Za-z_][A-Za-z_0-9]*) *= *([0-9.]+) *;?(?: *#.*)?$")
+TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|([^ "]+)')
+
+
+def split_args(args):
+    """
+    Split macro arguments at the commas that are not quoted.
+    """
+    parts = []
+    current = []
+    quoted = False
+    escaped = False
+    for c in args:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == '"':
+            quoted = not quoted
+        elif c == "," and not quoted:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(c)
+    parts.append("".join(current).strip())
+    return parts
+
+
+def parse_attrs(arg):
+    """
+    Split a PIC attribute list into (words, texts), the texts being the
+    unquoted strings.
+    """
+    words = []
+    texts = []
+    for text, word in TOKEN_RE.findall(arg):
+        if word:
+            words.append(word)
+        else:
+            texts.append(text.replace('\\"', '"'))
+    return words, texts
+
+
+class Box(object):
+    __slots__ = ("x", "y", "wid", "ht")
+
+    def __init__(self, x, y, wid, ht):
+        self.x, self.y, self.wid, self.ht = x, y, wid, ht
+
+    n = property(lambda self: (self.x, self.y + self.ht / 2))
+    s = property(lambda self: (self.x, self.y - self.ht / 2))
+    e = property(lambda self: (self.x + self.wid / 2, self.y))
+    w = property(lambda self: (self.x - self.wid / 2, self.y))
+    ne = property(lambda self: (self.x + self.wid / 2, self.y + self.ht / 2))
+    nw = property(lambda self: (self.x - self.wid / 2, self.y + self.ht / 2))
+    se = property(lambda self: (self.x + self.wid / 2, self.y - self.ht / 2))
+    sw = property(lambda self: (self.x - self.wid / 2, self.y - self.ht / 2))
+
+
+class Renderer(object):
+    """
+    Interpreter of the sequence macros, accumulating shapes.
+    """
+
+    ALIASES = {
+        "pobject": "placeholder_object",
+        "cmessage": "create_message",
+        "dmessage": "destroy_message",
+        "rmessage": "return_message",
+        "lconstraint": "lifeline_constraint",
+        "oconstraint": "object_constraint",
+        }
+
+    def __init__(self):
+        self.vars = dict(DEFAULTS)
+        self.here = (0., 0.)
+        self.direction = "right"
+        self.arrowhead = 1
+        self.places = {}       # named boxes: objects, frames, comments
+        self.active = {}
+        self.lifestart = {}
+        self.last_box = None
+        self.shapes = []
+        self.bbox = None
+
+    # -- statements ----------------------------------------------------------
+
+    def op(self, kind, args):
+        if kind == COMMENT:
+            return
+        if kind == RAW:
+            return self.statement(args[0])
+
+        name = self.ALIASES.get(kind, kind)
+        method = getattr(self, "do_" + name, None)
+        if method is None:
+            raise NativeError("unsupported macro: %s(%s)"
+                              % (kind, ",".join(args)))
+        try:
+            method(*args)
+        except (KeyError, TypeError, ValueError):
+            raise NativeError("cannot draw: %s(%s)" % (kind, ",".join(args)))
+
+    def statement(self, line):
+        """
+        Interpret a PIC statement passed through as-is.
+        """
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+
+        m = ASSIGN_RE.match(line)
+        if m:
+            self.vars[m.group(1)] = float(m.group(2))
+            return
+
+        m = CALL_RE.match(line)
+        if not m:
+            raise NativeError("unsupported statement: %s" % line)
+        args = split_args(m.group(2))
+        if args == [""]:
+            args = []
+        self.op(m.group(1), tuple(args))
+
+    def do_object(self, name, label):
+        box = self.place_box(self.vars["boxwid"], self.vars["boxht"])
+        self.rect(box)
+        self.text(box.x, box.y, parse_attrs(label)[1])
+        self.underline(box)
+        self.new_object(name, box, box.s[1])
+
+    def do_actor(self, name, label):
+        # the stick figure, relative to the centre of its head
+        parts = [
+            [(0, -.06), (0, -.18)],
+            [(-.15, -.08), (.15, -.08)],
+            [(0, -.18), (-.08, -.33)],
+            [(0, -.18), (.08, -.33)],
+            ]
+        top, bottom, wid = .06, -.33, .3
+        block = self.place_box(wid, top - bottom)
+        dx, dy = block.x, block.y - (top + bottom) / 2
+        self.circle(dx, dy, .06)
+        for part in parts:
+            self.line([(x + dx, y + dy) for x, y in part])
+        self.text(dx, dy + top, ["", "", ""] + parse_attrs(label)[1])
+        self.new_object(name, block, block.s[1] - .05)
+
+    def do_placeholder_object(self, name):
+        box = self.place_box(self.vars["boxwid"], self.vars["boxht"])
+        self.new_object(name, box, box.s[1])
+
+    def new_object(self, name, box, lifestart):
+        self.places[name] = box
+        self.here = box.e
+        self.move("right")
+        self.active[name] = 0
+        self.lifestart[name] = lifestart
+
+    def do_extend_lifeline(self, name):
+        x = self.places[name].x
+        y = self.here[1]
+        awid = self.vars["awid"]
+        start = self.lifestart[name]
+        if self.active[name] > 0:
+            # the left edges of the boxes, then the right edge of the
+            # innermost box
+            hx = x - awid / 2
+            for level in range(self.active[name]):
+                self.line([(hx, start), (hx, y)])
+                hx += awid / 2
+            hx += awid / 2
+            self.line([(hx, start), (hx, y)])
+            self.here = hx, y
+        else:
+            self.line([(x, start), (x, y)], dashed=True, thin=True)
+            self.here = x, y
+        self.lifestart[name] = y
+
+    def do_complete(self, name):
+        self.do_extend_lifeline(name)
+        if self.active[name]:
+            # bottom of all active boxes
+            x = self.places[name].x - self.vars["awid"] / 2
+            y = self.here[1]
+            wid = (self.active[name] + 1) * self.vars["awid"] / 2
+            self.line([(x, y), (x + wid, y)])
+            self.here = x + wid, y
+
+    def offsets(self, src, dst, to_box=False):
+        awid = self.vars["awid"]
+        if self.places[src].x <= self.places[dst].x:
+            off_from = awid * .6
+            off_to = to_box and -self.vars["boxwid"] * .51 or -awid * .6
+        else:
+            off_from = -awid * .6
+            off_to = to_box and self.vars["boxwid"] * .51 or awid * .6
+        # add half a box width for each level of nesting
+        if self.active[src] > 1:
+            off_from += (self.active[src] - 1) * awid / 2
+        if not to_box and self.active[dst] > 1:
+            off_to += (self.active[dst] - 1) * awid / 2
+        return off_from, off_to
+
+    def do_message(self, src, dst, label):
+        self.do_step()
+        off_from, off_to = self.offsets(src, dst)
+        y = self.here[1]
+        x1 = self.places[src].x + off_from
+        texts = parse_attrs(label)[1]
+        if self.places[src].x == self.places[dst].x:
+            wid = self.vars["linewid"]
+            points = [(x1, y), (x1 + wid, y), (x1 + wid, y - .25),
+                      (x1, y - .25)]
+            self.line(points, arrow=True)
+            self.text(x1, y - .125, texts + [" ", " ", " "], "start")
+            self.here = points[-1]
+        else:
+            x2 = self.places[dst].x + off_to
+            self.line([(x1, y), (x2, y)], arrow=True)
+            self.text((x1 + x2) / 2, y, texts + [" "])
+            self.here = x2, y
+
+    def do_return_message(self, src, dst, label):
+        self.do_step()
+        off_from, off_to = self.offsets(src, dst)
+        y = self.here[1]
+        x1 = self.places[src].x + off_from
+        x2 = self.places[dst].x + off_to
+        self.line([(x1, y), (x2, y)], arrow=True, dashed=True)
+        self.text((x1 + x2) / 2, y, parse_attrs(label)[1] + [" "])
+        self.here = x2, y
+
+    def do_create_message(self, src, dst, label, *ignored):
+        self.do_step()
+        off_from, off_to = self.offsets(src, dst, True)
+        y = self.here[1]
+        x1 = self.places[src].x + off_from
+        x2 = self.places[dst].x + off_to
+        self.line([(x1, y), (x2, y)], arrow=True)
+        self.text((x1 + x2) / 2, y, [CREATE, " "])
+
+        wid, ht = self.vars["boxwid"], self.vars["boxht"]
+        if x1 <= x2:
+            box = Box(x2 + wid / 2, y, wid, ht)
+        else:
+            box = Box(x2 - wid / 2, y, wid, ht)
+        self.rect(box)
+        self.text(box.x, box.y, parse_attrs(label)[1])
+        self.underline(box)
+        self.last_box = box
+        self.lifestart[dst] = box.s[1]
+        self.here = x2, y
+        self.move(self.direction, (self.vars["spacing"] + ht) / 2)
+
+    def do_drawx(self, name):
+        x = self.places[name].x
+        y = self.lifestart[name]
+        awid = self.vars["awid"]
+        self.line([(x - awid, y - awid), (x + awid, y + awid)])
+        self.line([(x - awid, y + awid), (x + awid, y - awid)])
+
+    def do_destroy_message(self, src, dst):
+        self.do_step()
+        self.do_message(src, dst, '"%s"' % DESTROY)
+        self.do_complete(dst)
+        self.do_drawx(dst)
+
+    def do_delete(self, name):
+        self.do_complete(name)
+        self.lifestart[name] -= self.vars["awid"]
+        self.do_drawx(name)
+
+    def do_active(self, name):
+        self.do_extend_lifeline(name)
+        # top of the new active box
+        x = self.places[name].x + (self.active[name] - 1) * \
+            self.vars["awid"] / 2
+        y = self.here[1]
+        self.line([(x, y), (x + self.vars["awid"], y)])
+        self.here = x + self.vars["awid"], y
+        self.active[name] += 1
+
+    def do_inactive(self, name):
+        self.do_extend_lifeline(name)
+        self.active[name] -= 1
+        # bottom of the innermost active box
+        x = self.places[name].x + (self.active[name] - 1) * \
+            self.vars["awid"] / 2
+        y = self.here[1]
+        self.line([(x, y), (x + self.vars["awid"], y)])
+        self.here = x + self.vars["awid"], y
+
+    def do_step(self):
+        self.direction = "down"
+        self.move("down", self.vars["spacing"])
+
+    def do_async(self):
+        self.arrowhead = 0
+        self.vars["arrowwid"] *= 2
+
+    def do_sync(self):
+        self.arrowhead = 1
+        self.vars["arrowwid"] /= 2
+
+    def constraint(self, name, texts):
+        off_from = self.vars["awid"]
+        if self.active[name] > 1:
+            off_from += (self.active[name] - 1) * self.vars["awid"] / 2
+        box = Box(self.places[name].x + off_from, self.here[1],
+                  self.vars["boxwid"], self.vars["boxht"])
+        self.text(box.x, box.y, texts, "start")
+        self.last_box = box
+        self.here = self.exit_point(box)
+
+    def do_lifeline_constraint(self, name, label):
+        self.constraint(name, parse_attrs(label)[1] + [" "])
+
+    def do_lconstraint_below(self, name, label):
+        self.constraint(name, [""] + parse_attrs(label)[1])
+
+    def do_object_constraint(self, label):
+        x, y = self.last_box.nw
+        ht = self.vars["boxht"]
+        self.text(x, y + ht / 2, parse_attrs(label)[1], "start")
+        self.extend((x - self.vars["boxwid"] / 2, y),
+                    (x + self.vars["boxwid"] / 2, y + ht))
+
+    def do_begin_frame(self, name, label, text):
+        self.do_extend_lifeline(name)
+        x, y = self.places[name].x, self.here[1]
+        wid, ht = self.vars["boxwid"], self.vars["boxht"]
+        box = Box(x, y - ht / 2, wid, ht)
+        self.text(box.x, box.y, parse_attrs(text)[1])
+        d = box.e[1] - box.se[1]
+        ex, ey = box.e
+        self.line([box.ne, box.e, (ex - d, ey - d), box.sw], thin=True)
+        self.places[label] = box
+        self.last_box = box
+        self.here = box.s
+        self.lifestart[name] = self.here[1]
+
+    def do_end_frame(self, name, label):
+        wid, ht = self.vars["boxwid"], self.vars["boxht"]
+        x, y = self.places[name].x, self.here[1]
+        dummy = Box(x, y + ht / 2, wid, ht)
+        nwx, nwy = self.places[label].nw
+        frame_wid = dummy.se[0] - nwx
+        frame_ht = nwy - dummy.se[1]
+        box = Box(nwx + frame_wid / 2, nwy - frame_ht / 2,
+                  frame_wid, frame_ht)
+        self.rect(box, thin=True)
+        self.last_box = box
+        self.here = box.s
+
+    def do_comment(self, name, label, movement, attrs):
+        old_y = self.here[1]
+        x = self.places[name].x
+        if not movement:
+            movement = "up 0.25 right 0.25"
+        end = self.motion((x, old_y), movement)
+        self.line([(x, old_y), end], dashed=True, thin=True)
+        self.here = end
+
+        words, texts = parse_attrs(attrs)
+        wid = self.vars["comment_default_wid"]
+        ht = self.vars["comment_default_ht"]
+        for k in range(len(words) - 1):
+            if words[k] == "wid":
+                wid = float(words[k + 1])
+            elif words[k] == "ht":
+                ht = float(words[k + 1])
+        box = self.place_box(wid, ht)
+        self.text(box.x, box.y, texts)
+        if label:
+            self.places[label] = box
+
+        # the frame of the comment, with a folded corner
+        fold = self.vars["corner_fold"]
+        nex, ney = box.ne
+        self.line([box.nw, (nex - fold, ney), (nex, ney - fold), box.se,
+                   box.sw, box.nw], thin=True)
+        self.line([(nex - fold, ney), (nex - fold, ney - fold),
+                   (nex, ney - fold)], thin=True)
+        self.here = x, old_y
+
+    def do_connect_to_comment(self, name, label):
+        x, y = self.places[name].x, self.here[1]
+        box = self.places[label]
+        if x < box.w[0]:
+            end = box.w
+        elif x > box.e[0]:
+            end = box.e
+        elif y < box.s[1]:
+            end = box.s
+        elif y > box.n[1]:
+            end = box.n
+        else:
+            end = None
+        if end:
+            self.line([(x, y), end], dashed=True, thin=True)
+        self.here = x, y
+
+    # -- geometry ------------------------------------------------------------
+
+    def move(self, direction, distance=None):
+        if distance is None:
+            distance = self.vars[direction in ("left", "right")
+                                 and "movewid" or "moveht"]
+        dx, dy = DIRECTIONS[direction]
+        self.here = (self.here[0] + dx * distance,
+                     self.here[1] + dy * distance)
+
+    def motion(self, start, movement):
+        """
+        Apply a PIC motion such as 'up 0.25 right 0.25' to a point.
+        """
+        x, y = start
+        words = movement.split()
+        k = 0
+        while k < len(words):
+            dx, dy = DIRECTIONS[words[k]]
+            try:
+                distance = float(words[k + 1])
+                k += 2
+            except (IndexError, ValueError):
+                distance = self.vars[dx and "linewid" or "lineht"]
+                k += 1
+            x, y = x + dx * distance, y + dy * distance
+        return x, y
+
+    def place_box(self, wid, ht):
+        """
+        Place a box of the given size in the current direction, starting at
+        Here, and move Here to its exit point.
+        """
+        dx, dy = DIRECTIONS[self.direction]
+        x = self.here[0] + dx * wid / 2
+        y = self.here[1] + dy * ht / 2
+        box = Box(x, y, wid, ht)
+        self.here = self.exit_point(box)
+        self.last_box = box
+        self.extend(box.sw, box.ne)
+        return box
+
+    def exit_point(self, box):
+        dx, dy = DIRECTIONS[self.direction]
+        return box.x + dx * box.wid / 2, box.y + dy * box.ht / 2
+
+    def extend(self, p1, p2):
+        (x1, y1), (x2, y2) = p1, p2
+        if self.bbox is None:
+            self.bbox = [x1, y1, x2, y2]
+        else:
+            b = self.bbox
+            self.bbox = [min(b[0], x1), min(b[1], y1),
+                         max(b[2], x2), max(b[3], y2)]
+
+    # -- shapes --------------------------------------------------------------
+
+    def line(self, points, arrow=False, dashed=False, thin=False):
+        for p in points:
+            self.extend(p, p)
+        head = None
+        if arrow:
+            head = (points[-2], points[-1], self.arrowhead,
+                    self.vars["arrowwid"], self.vars["arrowht"])
+        self.shapes.append(("line", points, head, dashed, thin))
+
+    def rect(self, box, thin=False):
+        self.extend(box.sw, box.ne)
+        self.shapes.append(("rect", box, thin))
+
+    def circle(self, x, y, rad):
+        self.extend((x - rad, y - rad), (x + rad, y + rad))
+        self.shapes.append(("circle", (x, y), rad))
+
+    def underline(self, box):
+        self.line([(box.w[0] + .1, box.y - .07), (box.e[0] - .1, box.y - .07)])
+
+    def text(self, x, y, texts, anchor="middle"):
+        """
+        Stack text lines, centred vertically on (x, y).
+        """
+        n = len(texts)
+        for k, text in enumerate(texts):
+            ty = y + (n - 1) * TEXT_HT / 2 - k * TEXT_HT
+            text = text.strip()
+            if not text:
+                continue
+            wid = len(text) * CHAR_WID
+            if anchor == "start":
+                self.extend((x, ty - TEXT_HT / 2), (x + wid, ty + TEXT_HT / 2))
+            else:
+                self.extend((x - wid / 2, ty - TEXT_HT / 2),
+                            (x + wid / 2, ty + TEXT_HT / 2))
+            self.shapes.append(("text", (x, ty), text, anchor))
+
+    # -- output --------------------------------------------------------------
+
+    def svg(self, opt_percent=100, bgcolor=None):
+        """
+        Return the SVG document, at opt_percent pixels per inch.
+        """
+        x0, y0, x1, y1 = self.bbox or [0, 0, 0, 0]
+        x0, y0, x1, y1 = x0 - MARGIN, y0 - MARGIN, x1 + MARGIN, y1 + MARGIN
+        scale = float(opt_percent)
+
+        def px(p):
+            return "%.2f,%.2f" % ((p[0] - x0) * scale, (y1 - p[1]) * scale)
+
+        wid, ht = (x1 - x0) * scale, (y1 - y0) * scale
+        out = [
+            u'<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+            u'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+            u'width="%d" height="%d" viewBox="0 0 %.2f %.2f">' % (
+                round(wid), round(ht), wid, ht),
+            ]
+        if bgcolor and bgcolor != "transparent":
+            out.append(u'<rect width="100%%" height="100%%" fill=%s/>'
+                       % quoteattr(bgcolor))
+        out.append(u'<g fill="none" stroke="black" stroke-width="%.2f" '
+                   u'font-family="Helvetica, Arial, sans-serif" '
+                   u'font-size="%.2f">' % (.01 * scale, FONT_SIZE * scale))
+
+        dash = u' stroke-dasharray="%.2f"' % (self.vars["dashwid"] * scale)
+        thin = u' stroke-width="%.2f"' % (.007 * scale)
+        for shape in self.shapes:
+            kind = shape[0]
+            if kind == "line":
+                points, head, dashed, is_thin = shape[1:]
+                out.append(u'<polyline points="%s"%s%s/>' % (
+                    " ".join(px(p) for p in points),
+                    dashed and dash or u"", is_thin and thin or u""))
+                if head:
+                    out.append(self.arrowhead_svg(head, px))
+            elif kind == "rect":
+                box, is_thin = shape[1:]
+                out.append(u'<rect x="%.2f" y="%.2f" width="%.2f" '
+                           u'height="%.2f"%s/>' % (
+                               (box.nw[0] - x0) * scale,
+                               (y1 - box.nw[1]) * scale,
+                               box.wid * scale, box.ht * scale,
+                               is_thin and thin or u""))
+            elif kind == "circle":
+                (x, y), rad = shape[1:]
+                out.append(u'<circle cx="%.2f" cy="%.2f" r="%.2f"/>' % (
+                    (x - x0) * scale, (y1 - y) * scale, rad * scale))
+            elif kind == "text":
+                (x, y), text, anchor = shape[1:]
+                if not isinstance(text, unicode):
+                    text = unicode(text, "latin1")
+                out.append(u'<text x="%.2f" y="%.2f" text-anchor="%s" '
+                           u'dominant-baseline="central" fill="black" '
+                           u'stroke="none">%s</text>' % (
+                               (x - x0) * scale, (y1 - y) * scale, anchor,
+                               escape(text)))
+
+        out.append(u"</g>")
+        out.append(u"</svg>")
+        return u"\n".join(out) + u"\n"
+
+    def arrowhead_svg(self, head, px):
+        (ax, ay), (bx, by), filled, wid, ht = head
+        length = ((bx - ax) ** 2 + (by - ay) ** 2) ** .5 or 1.
+        ux, uy = (bx - ax) / length, (by - ay) / length
+        base = (bx - ux * ht, by - uy * ht)
+        left = (base[0] - uy * wid / 2, base[1] + ux * wid / 2)
+        right = (base[0] + uy * wid / 2, base[1] - ux * wid / 2)
+        if filled:
+            return u'<polygon points="%s %s %s" fill="black"/>' % (
+                px(left), px((bx, by)), px(right))
+        return u'<polyline points="%s %s %s"/>' % (
+            px(left), px((bx, by)), px(right))
+
+
+def extent(ops):
+    """
+    Lay out a sequence of operations; return the width and height of the
+    diagram in inches, margins included.
+    """
+    renderer = Renderer()
+    for op in ops:
+        renderer.op(op.kind, op.args)
+    x0, y0, x1, y1 = renderer.bbox or [0, 0, 0, 0]
+    return x1 - x0 + 2 * MARGIN, y1 - y0 + 2 * MARGIN
+
+
+def render(ops, opt_percent=100, bgcolor=None):
+    """
+    Draw a sequence of operations; return the SVG document as UTF-8 bytes.
+    """
+    renderer = Renderer()
+    for op in ops:
+        renderer.op(op.kind, op.args)
+    return renderer.svg(opt_percent, bgcolor).encode("utf-8")
@@ -0,0 +1,344 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Watch mode: render diagrams again as they are saved.
+
+Changes are detected with inotify on Linux, or else by polling the
+modification times. A burst of events (an editor writing a temporary
+file, renaming it, then touching the result) is debounced: renders start
+once no event came for DEBOUNCE seconds. Each changed file is rendered
+by batch.render_file() on a pool of worker processes; a file changed
+again while it is being rendered is rendered once more when that render
+ends, never twice at a time.
+
+-------------------------------------------------------------------------------
+
+Copyright (C) 2012 by Pascal Bauermeister <pascal.bauermeister@gmail.com>
+
+This module is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2, or (at your option)
+any later version.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import itertools
+import multiprocessing
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+from uml_sequence import batch
+
+# Seconds without events before changed files are rendered
+DEBOUNCE = 0.2
+
+# Seconds between two scans of the polling watcher
+POLL_INTERVAL = 0.5
+
+# Seconds between two checks of the renders in progress
+RESULT_INTERVAL = 0.05
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+IN_NONBLOCK = 0x00000800
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct("iIII")
+
+
+class Targets(object):
+    """
+    The files named by input specifications (file names, glob patterns or
+    directories, walked for 'pattern'), as in batch.expand_inputs(), and
+    the directories to watch for them.
+    """
+
+    def __init__(self, specs, pattern=batch.DEFAULT_PATTERN):
+        self.pattern = pattern
+        self.files = set()
+        self.globs = []
+        self.trees = []
+        for spec in specs:
+            spec = os.path.normpath(spec)
+            if os.path.isdir(spec):
+                self.trees.append(spec)
+            elif glob.has_magic(spec):
+                self.globs.append(spec)
+            else:
+                self.files.add(spec)
+
+    def wanted(self, path):
+        path = os.path.normpath(path)
+        if path in self.files:
+            return True
+        for spec in self.globs:
+            if fnmatch.fnmatch(path, spec):
+                return True
+        if fnmatch.fnmatch(os.path.basename(path), self.pattern):
+            for tree in self.trees:
+                if not os.path.relpath(path, tree).startswith(os.pardir):
+                    return True
+        return False
+
+    def roots(self):
+        """
+        Return the directories to watch, and whether to watch their
+        subdirectories.
+        """
+        roots = [(os.path.dirname(path) or ".", False)
+                 for path in self.files]
+        for spec in self.globs:
+            # the directories before the first wildcard
+            parts = spec.split(os.sep)
+            fixed = list(itertools.takewhile(lambda p: not glob.has_magic(p),
+                                             parts[:-1]))
+            roots.append((os.sep.join(fixed) or ".",
+                          len(fixed) < len(parts) - 1))
+        roots += [(tree, True) for tree in self.trees]
+        return roots
+
+
+class PollWatcher(object):
+    """
+    Find changes by comparing the size and modification time of the
+    files, every POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, targets, specs):
+        self.targets = targets
+        self.specs = specs
+        self.stamps = self.scan()
+
+    def scan(self):
+        stamps = {}
+        for path in batch.expand_inputs(self.specs, self.targets.pattern):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps[os.path.normpath(path)] = st.st_size, st.st_mtime
+        return stamps
+
+    def wait(self, timeout):
+        """
+        Return the files changed within 'timeout' seconds (None: until a
+        change).
+        """
+        end = timeout is not None and time.time() + timeout
+        while True:
+            delay = POLL_INTERVAL
+            if end:
+                delay = max(0, min(delay, end - time.time()))
+            time.sleep(delay)
+            stamps = self.scan()
+            changed = [path for path, stamp in stamps.items()
+                       if self.stamps.get(path) != stamp]
+            self.stamps = stamps
+            if changed or end and time.time() >= end:
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Find changes with inotify(7), called through ctypes. Raise OSError if
+    it is not available.
+    """
+
+    def __init__(self, targets):
+        name = ctypes.util.find_library("c")
+        libc = name and ctypes.CDLL(name, use_errno=True)
+        if not libc or not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc = libc
+        self.targets = targets
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.dirs = {}   # watch descriptor -> (directory, recursive)
+        try:
+            for root, recursive in targets.roots():
+                self.add(root, recursive)
+        except OSError:
+            self.close()
+            raise
+
+    def add(self, directory, recursive):
+        """
+        Watch 'directory' (and its subdirectories, if 'recursive'); return
+        the files already in the new subdirectories.
+        """
+        found = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            wd = self.libc.inotify_add_watch(self.fd, dirpath, WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e in (errno.ENOENT, errno.ENOTDIR):
+                    # gone meanwhile
+                    continue
+                # e.g. ENOSPC: out of watches
+                raise OSError(e, "inotify_add_watch: %s" % dirpath)
+            # a directory may be both a target's and in a target tree
+            self.dirs[wd] = dirpath, recursive or \
+                self.dirs.get(wd, (None, False))[1]
+            found += [os.path.join(dirpath, name) for name in filenames]
+            if not recursive:
+                break
+        return found
+
+    def wait(self, timeout):
+        """
+        Return the files changed within 'timeout' seconds (None: until a
+        change).
+        """
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            ready = None
+        if not ready:
+            return []
+
+        changed = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + length].rstrip("\0")
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost: take all files as changed
+                changed += batch.expand_inputs(
+                    [d for d, recursive in self.dirs.values()],
+                    self.targets.pattern)
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs:
+                continue
+            directory, recursive = self.dirs[wd]
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if recursive:
+                    changed += self.add(path, True)
+            elif not mask & IN_CREATE:
+                # created files are rendered once written
+                changed.append(path)
+        return [p for p in changed if self.targets.wanted(p)]
+
+    def close(self):
+        os.close(self.fd)
+
+
+def render_timed(task):
+    """
+    batch.render_file(), also returning the time it took.
+    """
+    start = time.time()
+    result = batch.render_file(task)
+    return result + (time.time() - start,)
+
+
+def watch(specs, jobs, pcent, debug, fmt, bgcolor=None, cache_dir=None,
+          cache_size=None, backend="pic2plot", route="auto",
+          pattern=batch.DEFAULT_PATTERN, poll=False, report=None):
+    """
+    Render the files named by 'specs' next to them whenever they change,
+    until interrupted, using 'jobs' worker processes. The render time and
+    the latency since the change are reported for each file.
+    """
+    report = report or sys.stderr
+    targets = Targets(specs, pattern)
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher(targets)
+        except OSError, e:
+            print >>report, "Umlsequence: %s; polling for changes" % e
+    if watcher is None:
+        watcher = PollWatcher(targets, specs)
+
+    # workers leave the interrupt to the watch loop
+    handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pool = multiprocessing.Pool(max(jobs, 1))
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    changed = {}   # path -> time of its first change not yet rendered
+    running = {}   # path -> (async result, time of the change)
+    last = 0       # time of the last event
+    print >>report, "Umlsequence: watching %d inputs" % len(specs)
+    try:
+        while True:
+            if running:
+                timeout = RESULT_INTERVAL
+            elif changed:
+                timeout = max(0, last + DEBOUNCE - time.time())
+            else:
+                timeout = None
+            paths = watcher.wait(timeout)
+            now = time.time()
+            for path in paths:
+                changed.setdefault(os.path.normpath(path), now)
+            if paths:
+                last = now
+
+            for path, (result, since) in running.items():
+                if result.ready():
+                    del running[path]
+                    try:
+                        path, name, ret, messages, elapsed = result.get()
+                    except Exception, e:
+                        # whatever failed, keep watching
+                        batch.report_result(
+                            report, path, batch.output_name(path, fmt),
+                            batch.ERR_IO, "Umlsequence error:  %s: %s\n" % (
+                                e.__class__.__name__, e), False)
+                        continue
+                    batch.report_result(report, path, name, ret, messages,
+                                        False)
+                    if not ret:
+                        print >>report, "%s: -> %s (%.2fs, %.2fs after " \
+                            "the change)" % (path, name, elapsed,
+                                             time.time() - since)
+
+            if changed and now - last >= DEBOUNCE:
+                for path in sorted(changed):
+                    if path in running or not os.path.isfile(path):
+                        # again when its render ends; or deleted
+                        if path not in running:
+                            del changed[path]
+                        continue
+                    task = (path, pcent, debug, fmt, bgcolor, cache_dir,
+                            cache_size, backend, route, False)
+                    running[path] = (pool.apply_async(render_timed, (task,)),
+                                     changed.pop(path))
+    except (KeyboardInterrupt, SystemExit):
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+    watcher.close()
+    return 0